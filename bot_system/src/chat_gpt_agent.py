@@ -3,34 +3,62 @@ import re
 from langchain.document_loaders import TextLoader
 from langchain.indexes import VectorstoreIndexCreator
 from langchain.prompts import PromptTemplate
-from langchain.chains.conversational_retrieval.base import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
 from langchain.chat_models import ChatOpenAI
 from langchain.embeddings import OpenAIEmbeddings
+from langchain_core.vectorstores import VectorStore
 
 from bot_system.src.lib.config import OPENAI_API_KEY
-from bot_system.src.lib.core import ChatAgent
+from bot_system.src.lib.core import ChatAgent, metrics
+from bot_system.src.lib.prompt_assembler import ConversationMemory, PromptAssembler
+
+DEFAULT_TOKEN_BUDGETS = {
+    "context": 1500,
+    "chat_history": 800,
+    "animations": 600,
+    "facial_expressions": 100,
+    "speech_emotions": 100,
+    "question": 200,
+}
 
 
 class ChatGPTAgent(ChatAgent):
     """ A class representing a chat agent using GPT-4o. Extends the ChatAgent class. """
-    def __init__(self, mock: bool = False, context_knowledge_path: str = "data/"):
+
+    mock_answer = (
+        "Hier wäre die Antwort auf deine Frage, aber ich bin noch nicht fertig. Komm später wieder."
+        + "Aber hier ist ein Witz: Warum hat der Mathematikbuch nicht geschlafen? Weil es viele Probleme hatte."
+    )
+
+    def __init__(
+        self,
+        mock: bool = False,
+        context_knowledge_path: str = "data/",
+        token_budgets: dict[str, int] | None = None,
+        history_window_turns: int = 4,
+        vectorstore: VectorStore | None = None,
+    ):
         """
         Create a new instance of the ChatGPTAgent class.
 
         Args:
             mock (bool, optional): A flag indicating whether the agent is in mock mode or not. Defaults to False.
             context_knowledge_path (str, optional): The path to the context knowledge data. Defaults to "data/".
+            token_budgets (dict[str, int] | None, optional): The token budget per prompt section. Defaults to DEFAULT_TOKEN_BUDGETS.
+            history_window_turns (int, optional): The number of recent turns sent verbatim, older turns are summarized. Defaults to 4.
+            vectorstore (VectorStore | None, optional): A vectorstore of the context knowledge shared with other agents. Defaults to None, building one from context_knowledge_path.
         """
         super().__init__()
-        file_paths = [os.path.join(context_knowledge_path, file) for file in os.listdir(context_knowledge_path) if file.endswith(".txt")]
-        loaders = [TextLoader(file_path) for file_path in file_paths]
-        embedding = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
-        vectorstore = VectorstoreIndexCreator(embedding=embedding).from_loaders(loaders).vectorstore  # type: ignore
+        self.embedding = OpenAIEmbeddings(api_key=OPENAI_API_KEY)
+        if vectorstore is None:
+            vectorstore = self.build_vectorstore(context_knowledge_path, self.embedding)
 
-        memory = ConversationBufferMemory(memory_key="chat_history", input_key="question", return_messages=True)
+        self.retriever = vectorstore.as_retriever()
+        self.llm = ChatOpenAI(api_key=OPENAI_API_KEY, model="gpt-4o")  # type: ignore
+        self.summary_llm = ChatOpenAI(api_key=OPENAI_API_KEY, model="gpt-4o-mini")  # type: ignore
+        self.memory = ConversationMemory(self._summarize, history_window_turns)
+        self.assembler = PromptAssembler(token_budgets if token_budgets is not None else DEFAULT_TOKEN_BUDGETS)
 
-        promptHist = PromptTemplate.from_template(
+        self.promptHist = PromptTemplate.from_template(
             """
             Du bist ZEKI-GPT, ein Serviceroboter mit emotionalem Bewusstsein am Zentrum für erlebbare KI (kurz ZEKI). Du beantwortest Gäste Fragen und reagierst auf ihre Emotionen falls nötig. Versuche dich eher kurz zu halten.
             Sollten die Emotionen deines Gesprächspartners nicht mir dem gesagten übereinstimmen, gehe explizit darauf ein.
@@ -72,24 +100,102 @@ class ChatGPTAgent(ChatAgent):
             Antworte so menschlich wie möglich und gehe auf die Emotionen des Gesprächspartners ein. Formuliere die Antwort wie einen gesprochenen Dialog, bis auf die animationsanweisungen.
             """
         )
-        self.conversationChain = ConversationalRetrievalChain.from_llm(
-            llm=ChatOpenAI(api_key=OPENAI_API_KEY, model="gpt-4o"),  # type: ignore
-            retriever=vectorstore.as_retriever(),
-            combine_docs_chain_kwargs={"prompt": promptHist},
-            memory=memory,
-        )
         self.mock = mock
 
+    @staticmethod
+    def build_vectorstore(context_knowledge_path: str, embedding: OpenAIEmbeddings | None = None) -> VectorStore:
+        """
+        Build the vectorstore of the context knowledge.
+
+        Args:
+            context_knowledge_path (str): The path to the context knowledge data.
+            embedding (OpenAIEmbeddings | None, optional): The embedding model. Defaults to a new OpenAIEmbeddings instance.
+
+        Returns:
+            VectorStore: The vectorstore.
+        """
+        file_paths = [os.path.join(context_knowledge_path, file) for file in os.listdir(context_knowledge_path) if file.endswith(".txt")]
+        loaders = [TextLoader(file_path) for file_path in file_paths]
+        embedding = embedding if embedding is not None else OpenAIEmbeddings(api_key=OPENAI_API_KEY)
+        return VectorstoreIndexCreator(embedding=embedding).from_loaders(loaders).vectorstore  # type: ignore
+
     # Override
     def prompt(self, prompt):
+        response = self.draft(prompt)
+        self.remember(prompt, response)
+        return response
+
+    # Override
+    def draft(self, prompt):
         if self.mock:
-            return {
-                "answer": "Hier wäre die Antwort auf deine Frage, aber ich bin noch nicht fertig. Komm später wieder."
-                + "Aber hier ist ein Witz: Warum hat der Mathematikbuch nicht geschlafen? Weil es viele Probleme hatte.",
+            return {"answer": self.mock_answer}
+
+        summary, turns = self.memory.snapshot()
+        sections, token_counts = self.assembler.assemble(
+            {
+                "context": self._retrieve(self._standalone_question(prompt["question"], turns)),
+                "chat_history": self.assembler.history(summary, turns, self.assembler.budgets.get("chat_history", DEFAULT_TOKEN_BUDGETS["chat_history"])),
+                "animations": prompt["animations"].split("\n"),
+                "facial_expressions": prompt["facial_expressions"],
+                "speech_emotions": prompt["speech_emotions"],
+                "question": prompt["question"],
             }
+        )
+        token_usage = {
+            "context": token_counts["context"],
+            "history": token_counts["chat_history"],
+            "animations": token_counts["animations"],
+            "emotions": token_counts["facial_expressions"] + token_counts["speech_emotions"],
+            "question": token_counts["question"],
+        }
+        prompt_text = self.promptHist.format(**sections)
+        token_usage["total"] = self.assembler.count(prompt_text)
+        print(f"Prompt tokens: {token_usage}")
 
-        response = self.conversationChain.run(prompt)
+        with metrics.time("openai_request_seconds", errors="openai_errors_total", operation="chat"):
+            response = str(self.llm.invoke(prompt_text).content)
+        clean_answer = re.sub(r"\^.*?\(.*?\)", "", response)
         return {
             "answer": response.replace("\n", " "),
-            "clean_answer": re.sub(r"\^.*?\(.*?\)", "", response),
+            "clean_answer": clean_answer,
+            "token_usage": token_usage,
         }
+
+    # Override
+    def remember(self, prompt, response):
+        if not self.mock:
+            self.memory.add_turn(prompt["question"], response.get("clean_answer") or response["answer"])
+
+    def _standalone_question(self, question: str, turns: list[tuple[str, str]], recent_turns: int = 2) -> str:
+        """ Rephrases a follow-up question into a question that is understandable without the chat history, so that the retrieval finds the context of its topic. """
+        if not turns:
+            return question
+        conversation = "\n".join([f"Gast: {turn_question}\nZEKI-GPT: {answer}" for turn_question, answer in turns[-recent_turns:]])
+        condense_prompt = (
+            "Formuliere die Folgefrage des Gastes anhand des Gesprächsverlaufs als eigenständige Frage, die ohne den Verlauf verständlich ist. "
+            + "Antworte nur mit der Frage.\n"
+            + f"Gesprächsverlauf:\n{conversation}\n"
+            + f"Folgefrage: {question}"
+        )
+        with metrics.time("openai_request_seconds", errors="openai_errors_total", operation="condense"):
+            return str(self.summary_llm.invoke(self.assembler.truncate(condense_prompt, 1000)).content).strip() or question
+
+    def _retrieve(self, question: str) -> list[str]:
+        """ The context documents relevant to the question, retrieved with an OpenAI embedding of the question. """
+        with metrics.time("openai_request_seconds", errors="openai_errors_total", operation="retrieval"):
+            return [document.page_content for document in self.retriever.invoke(question)]
+
+    def _summarize(self, summary: str, turns: list[tuple[str, str]]) -> str:
+        """ Folds turns that left the history window into the running summary. """
+        conversation = "\n".join([f"Gast: {question}\nZEKI-GPT: {answer}" for question, answer in turns])
+        summary_prompt = (
+            "Fasse den bisherigen Gesprächsverlauf zwischen einem Gast und ZEKI-GPT in wenigen Sätzen zusammen. "
+            + "Behalte Namen, Themen und offene Fragen des Gastes bei.\n"
+            + f"Bisherige Zusammenfassung: {summary or 'Keine'}\n"
+            + f"Neue Gesprächsabschnitte:\n{conversation}"
+        )
+        with metrics.time("openai_request_seconds", errors="openai_errors_total", operation="summary"):
+            return str(self.summary_llm.invoke(self.assembler.truncate(summary_prompt, 2000)).content)
+
+    def dispose(self) -> None:
+        self.memory.dispose()
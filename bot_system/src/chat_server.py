@@ -1,8 +1,12 @@
-from flask import Flask, render_template
+from flask import Flask, Response, abort, jsonify, render_template, request
 from flask_socketio import SocketIO
+import hmac
 import threading
 
-from bot_system.src.lib.core import ChatServer
+from bot_system.src.lib.core import ChatServer, metrics
+from bot_system.src.lib.message_store import MessageStore
+from bot_system.src.lib.profiler import SamplingProfiler
+from bot_system.src.lib.socket_broadcaster import SocketIOBroadcaster
 from bot_system.src.handlers.speech_intent_detection_handler import SpeechIntent, SpeechIntentDetectionHandler
 
 
@@ -11,17 +15,35 @@ class PepperChatServer(ChatServer):
     A class representing a chat server for Pepper robot. Extends the ChatServer class.
     """
 
-    def __init__(self, speech_intent_handler: SpeechIntentDetectionHandler | None = None, start=True):
+    def __init__(
+        self,
+        speech_intent_handler: SpeechIntentDetectionHandler | None = None,
+        start=True,
+        intent_max_rate: float = 10.0,
+        message_store: MessageStore | None = None,
+        page_size: int = 50,
+        admin_token: str | None = None,
+    ):
         """
         Create a new instance of the PepperChatServer class.
 
         Args:
             speech_intent_handler (SpeechIntentDetectionHandler | None, optional): The speech intent handler. If provided, the chat server will send speech intents to the client to be displayed. Defaults to None.
             start (bool, optional): Whether to start the server automatically. Defaults to True.
+            intent_max_rate (float, optional): The maximum number of speech intent updates sent to the clients per second. Defaults to 10.0.
+            message_store (MessageStore | None, optional): The persistent chat history. Defaults to a MessageStore at the default location.
+            page_size (int, optional): The number of messages rendered on page load and returned per history page. Defaults to 50.
+            admin_token (str | None, optional): The token required by the admin routes, passed as token parameter or X-Admin-Token header.
+                Defaults to None, allowing admin requests from localhost only.
         """
+        self.message_store = message_store if message_store is not None else MessageStore()
+        self.page_size = page_size
+        self.admin_token = admin_token
+        self.profiler = SamplingProfiler()
         super().__init__()
         self.app = Flask(__name__)
         self.socketio = SocketIO(self.app)
+        self.broadcaster = SocketIOBroadcaster(self.socketio, max_rates={"intent": intent_max_rate})
 
         if speech_intent_handler is not None:
             speech_intent_handler._stream.subscribe(lambda input: self.send_intent(input.value))
@@ -39,6 +61,54 @@ class PepperChatServer(ChatServer):
         def index():
             return render_template("chat.html", messages=self.get_messages())
 
+        @self.app.route("/history")
+        def history():
+            before_id = request.args.get("before", type=int)
+            # SQLite treats a negative limit as no limit
+            limit = max(1, min(request.args.get("limit", self.page_size, type=int), 500))
+            messages = self.message_store.page(before_id, limit + 1)
+            return jsonify({"messages": messages[-limit:], "has_more": len(messages) > limit})
+
+        @self.app.route("/history/since/<int:after_id>")
+        def history_since(after_id: int):
+            limit = max(1, min(request.args.get("limit", 200, type=int), 500))
+            return jsonify({"messages": self.message_store.since(after_id, limit)})
+
+        @self.app.route("/metrics")
+        def metrics_text():
+            return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+        @self.app.route("/admin/profile")
+        def profile():
+            """
+            Profile the process for the given seconds and return the sampled stacks and the top allocations as JSON, or with
+            format=collapsed the stacks as a collapsed stack file for flame graph tools.
+            """
+            self._check_admin()
+            try:
+                result = self.profiler.capture(
+                    request.args.get("seconds", 10.0, type=float),
+                    interval=max(request.args.get("interval", 0.01, type=float), 0.001),
+                    trace_memory=request.args.get("memory", "0") in ("1", "true"),
+                )
+            except RuntimeError as e:
+                return jsonify({"error": str(e)}), 409
+
+            if request.args.get("format") == "collapsed":
+                return Response(result.collapsed(), mimetype="text/plain", headers={"Content-Disposition": "attachment; filename=profile.collapsed"})
+            return jsonify({"duration": result.duration, "samples": result.samples, "collapsed": result.collapsed(), "top_allocations": result.top_allocations})
+
+    def _check_admin(self):
+        """ Abort the request unless it carries the admin token, or comes from localhost if there is none. """
+        if self.admin_token is None:
+            if request.remote_addr not in ("127.0.0.1", "::1"):
+                abort(403)
+        else:
+            candidates = (request.args.get("token"), request.headers.get("X-Admin-Token"))
+            # Compared in constant time, so the response time does not reveal how much of the token matched
+            if not any(candidate is not None and hmac.compare_digest(candidate.encode(), self.admin_token.encode()) for candidate in candidates):
+                abort(403)
+
     def setup_socketio_events(self):
         """ Set up the SocketIO events for the chat server. Enables the server to receive messages from the chat UI. """
         @self.socketio.on("send_message")
@@ -48,26 +118,41 @@ class PepperChatServer(ChatServer):
             self.add_message(message, sender, from_chat=True)
             print(f"Received message from {sender}: {message}")
 
+    # Override
+    def store_message(self, message):
+        self.message_store.add(message)
+
+    # Override
+    def get_messages(self):
+        return self.message_store.page(limit=self.page_size)
+
     # Override
     def send_message(self, message):
-        self.socketio.emit("message", {"message": message.text, "sender": message.sender})
+        self.broadcaster.publish("message", {"id": message.id, "message": message.text, "sender": message.sender})
 
     def send_intent(self, intent: SpeechIntent):
         """
-        Send a speech intent to the chat clients.
+        Send a speech intent to the chat clients. Unchanged intents are not sent and updates are rate limited to intent_max_rate.
 
         Args:
             intent (SpeechIntent): The speech intent to send.
         """
-        self.socketio.emit(
+        self.broadcaster.publish(
             "intent",
             {
                 "is_moving_mouth": intent.is_moving_mouth,
                 "has_eye_contact": intent.has_eye_contact,
                 "is_speech": intent.is_speech,
             },
+            conflate=True,
         )
 
+    # Override
+    def stop(self):
+        super().stop()
+        self.broadcaster.dispose()
+        self.message_store.dispose()
+
     def run(self, host="0.0.0.0", port=4200):
         """
         Run the chat server.
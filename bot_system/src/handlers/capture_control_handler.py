@@ -0,0 +1,102 @@
+import time
+from threading import Lock, Thread
+from typing import Any, Callable
+
+from cv2.typing import MatLike
+
+from bot_system.src.lib.core import InputStreamHandler
+from bot_system.src.handlers.face_detection_handler import DetectedFace, FaceDetectionHandler
+
+
+class CaptureControlHandler(InputStreamHandler[DetectedFace | MatLike, DetectedFace | MatLike, DetectedFace | MatLike, dict[str, Any]]):
+    """
+    Requests the camera frame rate and resolution the face detection needs. Outputs every changed capture request.
+
+    Without a face the camera runs at idle_fps. A small, distant face is tracked at VGA resolution. If the face detection
+    skips most frames because it is still busy, the capture pauses until the next check.
+    """
+
+    fusable = True
+
+    def __init__(
+        self,
+        face_detection_handler: FaceDetectionHandler,
+        request_capture: Callable[[dict[str, Any]], bool],
+        active_fps: float = 20,
+        idle_fps: float = 5,
+        no_face_timeout: float = 2.0,
+        small_face_ratio: float = 0.15,
+        saturation_threshold: float = 0.5,
+        check_interval: float = 0.25,
+    ):
+        """
+        Create a new instance of the CaptureControlHandler class.
+
+        Args:
+            face_detection_handler (FaceDetectionHandler): The face detection of the camera frames.
+            request_capture (Callable[[dict[str, Any]], bool]): Sends a capture request to the camera, e.g. PepperVideoProvider.request_capture.
+            active_fps (float, optional): The frame rate while a face is tracked. Defaults to 20.
+            idle_fps (float, optional): The frame rate without a face. Defaults to 5.
+            no_face_timeout (float, optional): The time in seconds without a face after which the camera idles. Defaults to 2.0.
+            small_face_ratio (float, optional): The face width relative to the frame width below which VGA is requested. Defaults to 0.15.
+            saturation_threshold (float, optional): The fraction of skipped frames above which the capture pauses. Defaults to 0.5.
+            check_interval (float, optional): The interval in seconds of the timeout and saturation checks. Defaults to 0.25.
+        """
+        self.face_detection_handler = face_detection_handler
+        self.request_capture = request_capture
+        self.active_fps = active_fps
+        self.idle_fps = idle_fps
+        self.no_face_timeout = no_face_timeout
+        self.small_face_ratio = small_face_ratio
+        self.saturation_threshold = saturation_threshold
+        self.check_interval = check_interval
+
+        self.last_face_time = 0.0
+        self.last_face_ratio = 1.0
+        self.last_frame_counts = (0, 0)
+        self.request: dict[str, Any] = {}
+        self.request_lock = Lock()
+
+        super().__init__(face_detection_handler)
+
+        self.is_running = True
+        self.check_thread = Thread(target=self._check_loop, daemon=True)
+        self.check_thread.start()
+
+    def handle(self, input):
+        if isinstance(input.value, DetectedFace):
+            self.last_face_time = input.capture_time
+            self.last_face_ratio = input.value.dimensions[0] / input.value.frame.shape[1]
+
+    def _check_loop(self):
+        while self.is_running:
+            time.sleep(self.check_interval)
+            self._update_request()
+
+    def _is_saturated(self) -> bool:
+        received = self.face_detection_handler.received_frames
+        skipped = self.face_detection_handler.skipped_frames
+        last_received, last_skipped = self.last_frame_counts
+        self.last_frame_counts = (received, skipped)
+        return received > last_received and (skipped - last_skipped) / (received - last_received) > self.saturation_threshold
+
+    def _update_request(self):
+        if self._is_saturated():
+            request = {**self.request, "paused": True}
+        elif time.time() - self.last_face_time > self.no_face_timeout:
+            request = {"fps": self.idle_fps, "resolution": "qvga", "paused": False}
+        elif self.last_face_ratio < self.small_face_ratio:
+            request = {"fps": self.active_fps, "resolution": "vga", "paused": False}
+        else:
+            request = {"fps": self.active_fps, "resolution": "qvga", "paused": False}
+
+        with self.request_lock:
+            if request == self.request:
+                return
+            if self.request_capture(request):
+                self.request = request
+                self.output(request)
+
+    def dispose(self) -> None:
+        self.is_running = False
+        super().dispose()
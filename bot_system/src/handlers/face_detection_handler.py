@@ -17,14 +17,30 @@ class DetectedFace:
 
 
 class FaceDetectionHandler(InputStreamHandler[MatLike, MatLike, MatLike, DetectedFace | MatLike]):
+    fusable = True
+    # Only the latest frame waits while a frame is detected
+    fused_queue_size = 1
+
     def __init__(self, image_provider: InputStreamProvider[MatLike]):
         self.face_cascade = cv2.CascadeClassifier(haarcascades + "haarcascade_frontalface_default.xml")
         self.is_detecting = False
+        # The scale of the frame the faces are detected in, the face region is cut from the full frame
+        self.detection_scale = 1.0
+        # Frames received and frames skipped because the previous frame was still being detected
+        self.received_frames = 0
+        self.skipped_frames = 0
 
         super().__init__(image_provider)
 
+    # Override
+    def skip(self, input):
+        self.received_frames += 1
+        self.skipped_frames += 1
+
     def handle(self, input):
+        self.received_frames += 1
         if self.is_detecting:
+            self.skipped_frames += 1
             return
         self.is_detecting = True
 
@@ -32,16 +48,23 @@ class FaceDetectionHandler(InputStreamHandler[MatLike, MatLike, MatLike, Detecte
         gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
         # Detect faces in the frame
-        faces = self.face_cascade.detectMultiScale(gray_frame, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        scale = self.detection_scale
+        if scale < 1.0:
+            detection_frame = cv2.resize(gray_frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            min_size = max(int(30 * scale), 12)
+        else:
+            detection_frame = gray_frame
+            min_size = 30
+        faces = self.face_cascade.detectMultiScale(detection_frame, scaleFactor=1.1, minNeighbors=5, minSize=(min_size, min_size))
         largest_face = max(faces, key=lambda x: x[2] * x[3] if len(faces) else 0, default=None)
 
         if largest_face is not None:
             rgb_frame = cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2RGB)
-            x, y, w, h = largest_face
+            x, y, w, h = (int(round(value / scale)) for value in largest_face) if scale < 1.0 else largest_face
             face_roi = rgb_frame[y : y + h, x : x + w]
 
-            self.output(DetectedFace(frame, face_roi, (x, y), (w, h)))
+            self.output(DetectedFace(frame, face_roi, (x, y), (w, h)), input.capture_time)
         else:
-            self.output(frame)
+            self.output(frame, input.capture_time)
         
         self.is_detecting = False
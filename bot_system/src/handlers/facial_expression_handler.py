@@ -5,12 +5,24 @@ from cv2.data import haarcascades
 from cv2.typing import MatLike
 from deepface.DeepFace import analyze
 
-from bot_system.src.lib.core import InputStreamHandler, InputStreamProvider
+from bot_system.src.lib.core import InputStreamHandler, InputStreamProvider, metrics
+from bot_system.src.lib.model_pool import SharedModel
 from bot_system.src.handlers.face_detection_handler import DetectedFace
 
 
 class FacialExpressionHandler(InputStreamHandler[DetectedFace | MatLike, DetectedFace | MatLike, DetectedFace | MatLike, dict[str, Any]]):
-    def __init__(self, image_provider: InputStreamProvider[DetectedFace | MatLike]):
+    def __init__(
+        self,
+        image_provider: InputStreamProvider[DetectedFace | MatLike],
+        shared_model: SharedModel | None = None,
+        session_id: str = "default",
+        max_rate: float | None = None,
+    ):
+        self.shared_model = shared_model
+        self.session_id = session_id
+        # The maximum number of analyzed faces per second, faces captured in between are skipped
+        self.max_rate = max_rate
+        self.last_analysis_time = float("-inf")
         self.face_cascade = cv2.CascadeClassifier(haarcascades + "haarcascade_frontalface_default.xml")
 
         super().__init__(image_provider, blocking=True)
@@ -20,14 +32,22 @@ class FacialExpressionHandler(InputStreamHandler[DetectedFace | MatLike, Detecte
             return
 
         detected_face = input.value
-
-        result = analyze(detected_face.face_roi, actions=["emotion"], enforce_detection=False)
+        if self.max_rate is not None and input.capture_time - self.last_analysis_time < 1.0 / self.max_rate:
+            return
+        self.last_analysis_time = input.capture_time
+
+        with metrics.time("model_inference_seconds", model="deepface_emotion"):
+            if self.shared_model is not None:
+                # DeepFace caches its models globally, the shared model only serializes and interleaves the sessions
+                result = self.shared_model.run(self.session_id, lambda _: analyze(detected_face.face_roi, actions=["emotion"], enforce_detection=False))
+            else:
+                result = analyze(detected_face.face_roi, actions=["emotion"], enforce_detection=False)
         
         if result is not None and len(result) >= 0:
             for emotion, score in result[0]["emotion"].items():
                 result[0]["emotion"][emotion] /= 100
 
-            self.output(result[0])
+            self.output(result[0], input.capture_time)
 
     def dispose(self) -> None:
         super().dispose()
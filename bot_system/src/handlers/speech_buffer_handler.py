@@ -1,15 +1,25 @@
-from io import BufferedReader
-import os
+from io import BufferedReader, BytesIO
+import itertools
 import wave
 from collections import deque
 from typing import cast
 
-from bot_system.src.lib.config import CHANNELS, CHUNK, RATE, WAVE_OUTPUT_FILENAME
+from bot_system.src.lib.config import CHANNELS, CHUNK, RATE
 from bot_system.src.lib.core import Input, InputStreamHandler, InputStreamProvider
 from bot_system.src.handlers.speech_intent_detection_handler import SpeechIntent
 
 
+def read_utterance(audio_file: BufferedReader) -> bytes:
+    """ Read an utterance without moving the position of the file, the transcription and speech emotion handlers read it in parallel. """
+    if isinstance(audio_file.raw, BytesIO):
+        return audio_file.raw.getvalue()
+    with open(audio_file.name, "rb") as file:
+        return file.read()
+
+
 class SpeechBufferHandler(InputStreamHandler[bytes, SpeechIntent, bytes, BufferedReader]):
+    fusable = True
+
     def __init__(
         self,
         speech_provider: InputStreamProvider[bytes],
@@ -19,6 +29,9 @@ class SpeechBufferHandler(InputStreamHandler[bytes, SpeechIntent, bytes, Buffere
         self.mock = mock
         self.min_speech_duration = 2.3
         self.is_detecting_speech = False
+        self.speech_start_time = 0.0
+        # Every utterance gets a correlation id, so the results of the handlers analyzing it in parallel can be joined
+        self.utterance_ids = itertools.count()
 
         self.speech_intent = SpeechIntent(False, False, False)
         self.audio_frames_sliding_window: deque[bytes] = deque(maxlen=int(RATE / CHUNK) * 2)
@@ -46,6 +59,7 @@ class SpeechBufferHandler(InputStreamHandler[bytes, SpeechIntent, bytes, Buffere
         if not self.is_detecting_speech and self.speech_intent.intents_speaking():
             self.is_detecting_speech = True
             self._start_buffer()
+            self.speech_start_time = input.capture_time - (len(self.frames) - 1) * CHUNK / RATE
 
         if self.is_detecting_speech and not self.speech_intent.intents_speaking():
             self.is_detecting_speech = False
@@ -54,7 +68,6 @@ class SpeechBufferHandler(InputStreamHandler[bytes, SpeechIntent, bytes, Buffere
     def _start_buffer(self):
         print(f"Detecting speech...")
         self.frames = list(self.audio_frames_sliding_window)
-        self._buffer_to_audio(self.frames, "test.wav")
         print(f"{len(self.frames)} frames")
 
     def _add_to_buffer(self, audio: bytes):
@@ -69,21 +82,18 @@ class SpeechBufferHandler(InputStreamHandler[bytes, SpeechIntent, bytes, Buffere
 
         if speech_duration > self.min_speech_duration:
             audio_file = self._buffer_to_audio(self.frames)
-            self.output(audio_file, speech_duration)
+            self.output(audio_file, self.speech_start_time, speech_duration, next(self.utterance_ids))
         else:
             print(f"Speech too short, must be at least {self.min_speech_duration} seconds!")
 
-    def _buffer_to_audio(self, audio: list[bytes], filename: str = WAVE_OUTPUT_FILENAME) -> BufferedReader:
-        waveFile = wave.open(filename, "wb")
+    def _buffer_to_audio(self, audio: list[bytes]) -> BufferedReader:
+        """ Write the utterance to an in-memory WAV file, so the sessions of a process never share a file. """
+        wave_buffer = BytesIO()
+        waveFile = wave.open(wave_buffer, "wb")
         waveFile.setnchannels(CHANNELS)
         waveFile.setsampwidth(2)
         waveFile.setframerate(RATE)
         waveFile.writeframes(b"".join(audio))
         waveFile.close()
-        audio_file = open(filename, "rb")
-        return audio_file
-
-    def dispose(self) -> None:
-        super().dispose()
-        if os.path.exists(WAVE_OUTPUT_FILENAME):
-            os.remove(WAVE_OUTPUT_FILENAME)
+        wave_buffer.seek(0)
+        return BufferedReader(wave_buffer)  # type: ignore
@@ -4,14 +4,18 @@ from typing import Any, cast
 from funasr.auto.auto_model import AutoModel
 
 from bot_system.src.lib.config import CHUNK, RATE
-from bot_system.src.lib.core import Input, InputStreamHandler, InputStreamProvider
+from bot_system.src.lib.core import Input, InputStreamHandler, InputStreamProvider, metrics
+from bot_system.src.lib.model_pool import SharedModel
 from bot_system.src.handlers.face_detection_handler import DetectedFace
+from bot_system.src.handlers.speech_buffer_handler import read_utterance
 from bot_system.src.handlers.speech_intent_detection_handler import SpeechIntent
 
 
 class SpeechEmotionHandler(InputStreamHandler[BufferedReader, BufferedReader, BufferedReader, dict[str, Any]]):
-    def __init__(self, audio_provider: InputStreamProvider[BufferedReader]):
-        self.model = AutoModel(model="iic/emotion2vec_plus_large")
+    def __init__(self, audio_provider: InputStreamProvider[BufferedReader], shared_model: SharedModel | None = None, session_id: str = "default"):
+        self.shared_model = shared_model
+        self.session_id = session_id
+        self.model = self.load_model() if shared_model is None else None
         self.is_analyzing = False
 
         self.audio_provider = audio_provider
@@ -20,11 +24,19 @@ class SpeechEmotionHandler(InputStreamHandler[BufferedReader, BufferedReader, Bu
 
     def handle(self, input):
         audio_file = input.value
-        frames = audio_file.read()
-        res = self.model.generate(input=frames)
+        frames = read_utterance(audio_file)
+        with metrics.time("model_inference_seconds", model="emotion2vec"):
+            if self.shared_model is not None:
+                res = self.shared_model.run(self.session_id, lambda model: model.generate(input=frames))
+            else:
+                res = self.model.generate(input=frames)
         labels = [str(label).split("/")[-1] for label in res[0]["labels"]]
         speech_emotions = dict(zip(labels, res[0]["scores"]))
-        self.output(speech_emotions)
+        self.output(speech_emotions, input.capture_time, input.duration, input.correlation_id)
+
+    @staticmethod
+    def load_model() -> AutoModel:
+        return AutoModel(model="iic/emotion2vec_plus_large")
 
     def dispose(self) -> None:
         super().dispose()
@@ -7,14 +7,15 @@ from typing import cast
 import cv2
 from cv2.typing import MatLike
 import numpy as np
+import pyaudio
 import webrtcvad
 from mediapipe.python.solutions.face_mesh import FaceMesh
 
 from bot_system.src.lib.config import CHANNELS, CHUNK, FORMAT, OPENAI_API_KEY, RATE, WAVE_OUTPUT_FILENAME
-from bot_system.src.lib.core import Input, InputStreamHandler, InputStreamProvider
+from bot_system.src.lib.core import Input, InputStreamHandler, InputStreamProvider, JoinedInput, StreamJoin
 from bot_system.src.handlers.face_detection_handler import DetectedFace
 from bot_system.src.lib.run_on_main import RunOnMainThread
-from face_analyzer import FaceAnalyzer
+from face_analyzer import FaceAnalyzer, with_estimated_pupils
 
 import matplotlib.pyplot as plt
 
@@ -44,6 +45,8 @@ class SpeechIntent:
 
 
 class SpeechIntentDetectionHandler(InputStreamHandler[DetectedFace | MatLike, bytes, bytes, SpeechIntent]):
+    fusable = True
+
     def __init__(
         self,
         face_provider: InputStreamProvider[DetectedFace | MatLike],
@@ -51,9 +54,12 @@ class SpeechIntentDetectionHandler(InputStreamHandler[DetectedFace | MatLike, by
         mouth_angle_fluctuation_threshold: float = 0.005,
         gaze_angle_threshold: float = 0.7,
         probability_threshold: float = 0.75,
-        intent_start_buffer_len: int = 20,
-        intent_end_buffer_len: int = 20,
+        intent_start_window: float = 1.0,
+        intent_end_window: float = 1.0,
+        join_tolerance: float = 0.1,
+        join_max_lateness: float = 0.5,
         debug: bool = False,
+        debug_fps: float = 15.0,
     ):
         """
         Initializes a SpeechIntentHandler object.
@@ -64,7 +70,11 @@ class SpeechIntentDetectionHandler(InputStreamHandler[DetectedFace | MatLike, by
             mouth_angle_fluctuation_threshold (float): The threshold for mouth angle fluctuation.
             gaze_angle_threshold (float): The threshold for gaze angle in radians.
             probability_threshold (float): The threshold for the probability of the speech intent detection in the sliding window.
-            buffer_length (int): The length of the buffer for the sliding window of the speech intent detection
+            intent_start_window (float): The length in seconds of the sliding window while no speech intent is detected.
+            intent_end_window (float): The length in seconds of the sliding window while a speech intent is detected.
+            join_tolerance (float): The maximum time in seconds between a video frame and the audio joined with it.
+            join_max_lateness (float): The maximum time in seconds a video frame waits for the audio stream, e.g. while the audio is paused.
+            debug_fps (float): The maximum rate of the debug frame and plot updates, updates in between are skipped.
 
         Returns:
             None
@@ -75,31 +85,61 @@ class SpeechIntentDetectionHandler(InputStreamHandler[DetectedFace | MatLike, by
         self.gaze_angle_threshold = gaze_angle_threshold
         self.probability_threshold = probability_threshold
         self.debug = debug
+        self.debug_fps = debug_fps
 
         self.speech_intent = SpeechIntent(False, False, False)
 
-        self.intent_start_buffer_len = intent_start_buffer_len
-        self.intent_end_buffer_len = intent_end_buffer_len
+        self.intent_start_window = intent_start_window
+        self.intent_end_window = intent_end_window
 
         self.intent_queue = deque[SpeechIntent](maxlen=100)
 
         self.vad_frame_duration = 30  # ms
-        self.vad_frame_len = int(RATE / 1000 * self.vad_frame_duration * FORMAT / 4)
-
-        self.has_eye_contact_buffer = deque[bool](maxlen=max(intent_start_buffer_len, intent_end_buffer_len))
-        self.is_moving_mouth_buffer = deque[bool](maxlen=max(intent_start_buffer_len, intent_end_buffer_len))
-        self.is_speech_buffer = deque(maxlen=max(intent_start_buffer_len, intent_end_buffer_len))
+        self.bytes_per_frame = CHANNELS * pyaudio.get_sample_size(FORMAT)
+        self.vad_frame_len = int(RATE / 1000 * self.vad_frame_duration) * self.bytes_per_frame
+
+        # The evidence by capture time, the windows span a time rather than a number of frames, so the detection latency
+        # does not depend on the frame rate the camera runs at
+        self.has_eye_contact_buffer = deque[tuple[float, bool]]()
+        self.is_moving_mouth_buffer = deque[tuple[float, bool]]()
+        self.is_speech_buffer = deque[tuple[float, float]]()
+        self.last_face_time = float("-inf")
+        self.last_evidence_time = float("-inf")
+
+        # The face and voice activity evidence is aligned by capture time, each video frame is joined with the audio
+        # captured around it, as the analyzed frames arrive later than the audio
+        self.join = StreamJoin[tuple[bool, bool], list[bool]](
+            face_provider, audio_provider, tolerance=join_tolerance, max_lateness=join_max_lateness, subscribe=False
+        )
+        self.join._stream.subscribe(lambda input: self._handle_joined(input.value))
 
-        self.vad = webrtcvad.Vad(1)
+        self.vad_mode = 1
+        self.vad = webrtcvad.Vad(self.vad_mode)
         self.face_analyzer = FaceAnalyzer()
-        self.face_mesh = FaceMesh(
+        # The face mesh is recreated on the handling thread when the iris refinement is switched
+        self.refine_landmarks = True
+        self.face_mesh = self._create_face_mesh(self.refine_landmarks)
+        self.face_mesh_refines_landmarks = self.refine_landmarks
+
+        super().__init__((face_provider, audio_provider), blocking=True)
+
+    @staticmethod
+    def _create_face_mesh(refine_landmarks: bool) -> FaceMesh:
+        return FaceMesh(
             max_num_faces=1,
-            refine_landmarks=True,
+            refine_landmarks=refine_landmarks,
             min_detection_confidence=0.5,
             min_tracking_confidence=0.5,
         )
 
-        super().__init__((face_provider, audio_provider), blocking=True)
+    def set_iris_refinement(self, enabled: bool) -> None:
+        """ Switch the iris landmarks of the face mesh. Without them, the pupils are estimated from the eye contours, which is faster but less accurate. """
+        self.refine_landmarks = enabled
+
+    def set_vad_mode(self, mode: int) -> None:
+        """ Set the aggressiveness of the voice activity detection from 0 to 3. More aggressive modes report less noise as speech. """
+        self.vad_mode = mode
+        self.vad.set_mode(mode)
 
     def handle(self, input):
         if input.source == self.audio_provider:
@@ -110,6 +150,7 @@ class SpeechIntentDetectionHandler(InputStreamHandler[DetectedFace | MatLike, by
 
     def _handle_audio(self, input: Input[bytes]):
         audio = input.value
+        is_speech = []
 
         vad_frame_count = 1
         while self.vad_frame_len * vad_frame_count < len(audio):
@@ -117,27 +158,39 @@ class SpeechIntentDetectionHandler(InputStreamHandler[DetectedFace | MatLike, by
             vad_frame_end = self.vad_frame_len * vad_frame_count
             vad_frame = audio[vad_frame_start:vad_frame_end]
 
-            self.is_speech_buffer.append(self.vad.is_speech(vad_frame, RATE))
+            is_speech.append(self.vad.is_speech(vad_frame, RATE))
             vad_frame_count += 1
 
-        self._update_speech_intent()
+        duration = input.duration or len(audio) / (RATE * self.bytes_per_frame)
+        self.join.add(Input(self.audio_provider, is_speech, input.capture_time, duration))
+
+        # Without video frames, e.g. while the capture is paused, the intent is updated from the audio alone and the face
+        # evidence runs out with the window
+        if input.capture_time - self.last_face_time > self._window():
+            self.is_speech_buffer.append((input.capture_time, float(np.mean(is_speech)) if is_speech else 0.0))
+            self._update_speech_intent(input.capture_time)
 
     def _handle_face(self, input: Input[DetectedFace | MatLike]):
         if not isinstance(input.value, DetectedFace):
             frame = input.value
-            self.has_eye_contact_buffer.append(False)
-            self.is_moving_mouth_buffer.append(False)
+            self.join.add(Input(self.face_provider, (False, False), input.capture_time, input.duration))
 
         else:
             frame = input.value.frame
             detected_face = input.value
 
+            refine_landmarks = self.refine_landmarks
+            if refine_landmarks != self.face_mesh_refines_landmarks:
+                self.face_mesh.close()
+                self.face_mesh = self._create_face_mesh(refine_landmarks)
+                self.face_mesh_refines_landmarks = refine_landmarks
             results = self.face_mesh.process(detected_face.face_roi)
 
             if results.multi_face_landmarks:  # type: ignore
+                landmarks = results.multi_face_landmarks[0].landmark  # type: ignore
                 face_analysis = self.face_analyzer.analyze(
                     detected_face.frame,
-                    results.multi_face_landmarks[0].landmark,  # type: ignore
+                    landmarks if refine_landmarks else with_estimated_pupils(landmarks),
                     detected_face.position,
                     detected_face.dimensions,
                     True,
@@ -148,39 +201,44 @@ class SpeechIntentDetectionHandler(InputStreamHandler[DetectedFace | MatLike, by
                     is_moving_mouth = bool(face_analysis.mouth_angle_fluctuation > self.mouth_angle_fluctuation_threshold)
                     is_gazing = bool(face_analysis.angle_radians < self.gaze_angle_threshold)
 
-                    self.has_eye_contact_buffer.append(is_gazing)
-                    self.is_moving_mouth_buffer.append(is_moving_mouth)
+                    self.join.add(Input(self.face_provider, (is_gazing, is_moving_mouth), input.capture_time, input.duration))
 
             else:
-                self.has_eye_contact_buffer.append(False)
-                self.is_moving_mouth_buffer.append(False)
-
-        self._update_speech_intent()
+                self.join.add(Input(self.face_provider, (False, False), input.capture_time, input.duration))
 
         if self.debug:
-            RunOnMainThread.schedule(lambda: self._show_frame(frame))
+            RunOnMainThread.schedule(lambda: self._show_frame(frame), key=(self, "frame"), max_rate=self.debug_fps)
+
+    def _handle_joined(self, joined: JoinedInput[tuple[bool, bool], list[bool]]):
+        has_eye_contact, is_moving_mouth = joined.primary.value
+        is_speech = [frame_is_speech for audio in joined.secondary for frame_is_speech in audio.value]
+        capture_time = joined.primary.capture_time
+        self.last_face_time = max(self.last_face_time, capture_time)
+
+        self.has_eye_contact_buffer.append((capture_time, has_eye_contact))
+        self.is_moving_mouth_buffer.append((capture_time, is_moving_mouth))
+        # The share of voice activity frames around the video frame
+        self.is_speech_buffer.append((capture_time, float(np.mean(is_speech)) if is_speech else 0.0))
+
+        self._update_speech_intent(capture_time)
 
     def _estimate_probability(self, buffer: deque):
-        return bool(np.mean(buffer) > self.probability_threshold)
-
-    def _check_buffer_maxlen(self):
-        if self.speech_intent.intents_speaking():
-            if self.has_eye_contact_buffer.maxlen != self.intent_end_buffer_len:
-                self.has_eye_contact_buffer = deque[bool](self.has_eye_contact_buffer, maxlen=self.intent_end_buffer_len)
-            if self.is_moving_mouth_buffer.maxlen != self.intent_end_buffer_len:
-                self.is_moving_mouth_buffer = deque[bool](self.is_moving_mouth_buffer, maxlen=self.intent_end_buffer_len)
-            if self.is_speech_buffer.maxlen != self.intent_end_buffer_len:
-                self.is_speech_buffer = deque(self.is_speech_buffer, maxlen=self.intent_end_buffer_len)
-        else:
-            if self.has_eye_contact_buffer.maxlen != self.intent_start_buffer_len:
-                self.has_eye_contact_buffer = deque[bool](self.has_eye_contact_buffer, maxlen=self.intent_start_buffer_len)
-            if self.is_moving_mouth_buffer.maxlen != self.intent_start_buffer_len:
-                self.is_moving_mouth_buffer = deque[bool](self.is_moving_mouth_buffer, maxlen=self.intent_start_buffer_len)
-            if self.is_speech_buffer.maxlen != self.intent_start_buffer_len:
-                self.is_speech_buffer = deque(self.is_speech_buffer, maxlen=self.intent_start_buffer_len)
-
-    def _update_speech_intent(self):
-        self._check_buffer_maxlen()
+        return bool(buffer) and bool(np.mean([value for _, value in buffer]) > self.probability_threshold)
+
+    def _window(self) -> float:
+        return self.intent_end_window if self.speech_intent.intents_speaking() else self.intent_start_window
+
+    def _trim_buffers(self, now: float):
+        """ Drop the evidence captured before the window ending at the given capture time. """
+        start = now - self._window()
+        for buffer in (self.has_eye_contact_buffer, self.is_moving_mouth_buffer, self.is_speech_buffer):
+            while buffer and buffer[0][0] < start:
+                buffer.popleft()
+
+    def _update_speech_intent(self, capture_time: float):
+        # Late joined frames do not move the window back
+        self.last_evidence_time = max(self.last_evidence_time, capture_time)
+        self._trim_buffers(self.last_evidence_time)
         self.speech_intent = SpeechIntent(
             is_speech=self._estimate_probability(self.is_speech_buffer),
             is_moving_mouth=self._estimate_probability(self.is_moving_mouth_buffer),
@@ -190,7 +248,11 @@ class SpeechIntentDetectionHandler(InputStreamHandler[DetectedFace | MatLike, by
 
         self.intent_queue.append(self.speech_intent)
         if self.debug:
-            RunOnMainThread.schedule(self._plot_intent)
+            RunOnMainThread.schedule(self._plot_intent, key=(self, "plot"), max_rate=self.debug_fps)
+
+    def dispose(self) -> None:
+        self.join.dispose()
+        super().dispose()
 
     def _show_frame(self, frame):
         cv2.imshow("output window", frame)
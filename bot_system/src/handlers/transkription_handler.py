@@ -1,8 +1,9 @@
 from io import BufferedReader
 from openai import OpenAI
 
-from bot_system.src.lib.config import OPENAI_API_KEY, WAVE_OUTPUT_FILENAME
-from bot_system.src.lib.core import Input, InputStreamHandler, InputStreamProvider
+from bot_system.src.lib.config import OPENAI_API_KEY
+from bot_system.src.lib.core import Input, InputStreamHandler, InputStreamProvider, metrics
+from bot_system.src.handlers.speech_buffer_handler import read_utterance
 from bot_system.src.handlers.speech_intent_detection_handler import SpeechIntent
 
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
@@ -20,11 +21,12 @@ class TranskriptionHandler(InputStreamHandler[BufferedReader, bytes, bytes, str]
 
     def handle(self, input):
         if self.mock:
-            self.output("Hallo, wie geht es dir?. Ich bin kein chatbot. Ich bin ein Mensch.")
+            self.output("Hallo, wie geht es dir?. Ich bin kein chatbot. Ich bin ein Mensch.", input.capture_time, input.duration, input.correlation_id)
             return
         
         audio_file = input.value
 
-        transcription = openai_client.audio.transcriptions.create(model="whisper-1", file=audio_file)
-        self.output(transcription.text)
+        with metrics.time("openai_request_seconds", errors="openai_errors_total", operation="transcription"):
+            transcription = openai_client.audio.transcriptions.create(model="whisper-1", file=("utterance.wav", read_utterance(audio_file)))
+        self.output(transcription.text, input.capture_time, input.duration, input.correlation_id)
 
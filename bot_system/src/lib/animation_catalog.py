@@ -0,0 +1,112 @@
+import csv
+import re
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Animation:
+    name: str
+    path: str
+    labels: tuple[str, ...]
+
+
+class AnimationCatalog:
+    """
+    An indexed catalog of the Pepper animations.
+
+    Provides a label index, a single compiled resolver that rewrites the animation names in ^run/^start/^stop/^wait tags
+    to their full paths and a selector for the animations most relevant to the detected emotions.
+    """
+
+    tag_pattern = re.compile(r"\^(run|start|stop|wait)\(\s*([^()\s]+)\s*\)")
+
+    emotion_aliases = {"disgusted": "disgust", "fearful": "fear", "surprised": "surprise"}
+
+    # Animation labels that fit a reaction to the emotion of the conversation partner
+    emotion_labels = {
+        "happy": {"happy", "joyful", "enthusiastic", "excited", "winner", "warm", "zestful"},
+        "sad": {"sad", "disappointed", "despairing", "calm", "gentle", "soothe"},
+        "angry": {"calm", "appease", "pacify", "placate", "soothe", "quiet"},
+        "fear": {"calm", "gentle", "soothe", "peaceful", "quiet"},
+        "surprise": {"excited", "agitated", "enthusiastic", "not know", "unknown"},
+        "disgust": {"negative", "no", "reject", "oppose"},
+        "neutral": {"explain", "present", "clear", "think"},
+    }
+
+    # Labels useful in most answers, included with a small base score
+    general_labels = {"body language", "explain", "hello", "yes", "no", "think", "you", "I", "show", "present"}
+
+    def __init__(self, csv_path: str = "bot_system/animations.csv"):
+        """
+        Create a new instance of the AnimationCatalog class.
+
+        Args:
+            csv_path (str, optional): The path to the animation csv with the columns animation, path and labels. Defaults to "bot_system/animations.csv".
+        """
+        self.animations: dict[str, Animation] = {}
+        self.label_index: dict[str, list[Animation]] = {}
+
+        with open(csv_path, "r") as animation_csv:
+            for row in csv.DictReader(animation_csv, fieldnames=["animation", "path", "labels"], skipinitialspace=True):
+                labels = tuple(label.strip() for label in row["labels"].split(";") if label.strip())
+                animation = Animation(row["animation"].strip(), row["path"].strip(), labels)
+                self.animations[animation.name] = animation
+                for label in labels:
+                    self.label_index.setdefault(label, []).append(animation)
+
+    def __len__(self) -> int:
+        return len(self.animations)
+
+    def resolve_tags(self, text: str) -> str:
+        """
+        Replace the animation names inside animation tags with their full paths. Text outside of tags and unknown names are left untouched.
+
+        Args:
+            text (str): The answer of the LLM.
+
+        Returns:
+            str: The answer with resolved animation paths.
+        """
+        return self.tag_pattern.sub(self._resolve_tag, text)
+
+    def _resolve_tag(self, match: re.Match) -> str:
+        animation = self.animations.get(match.group(2))
+        return f"^{match.group(1)}({animation.path if animation is not None else match.group(2)})"
+
+    def select(self, emotions: dict[str, float], k: int = 24, per_label_set: int = 2) -> list[Animation]:
+        """
+        Select the animations most relevant to the given emotions.
+
+        Args:
+            emotions (dict[str, float]): The detected emotion scores by label.
+            k (int, optional): The maximum number of animations. Defaults to 24.
+            per_label_set (int, optional): The maximum number of animations sharing the same labels, to keep the selection diverse. Defaults to 2.
+
+        Returns:
+            list[Animation]: The selected animations, most relevant first.
+        """
+        weights: dict[str, float] = {}
+        for emotion, score in emotions.items():
+            emotion = self.emotion_aliases.get(emotion, emotion)
+            weights[emotion] = weights.get(emotion, 0.0) + score
+
+        def score(animation: Animation) -> float:
+            labels = set(animation.labels)
+            relevance = sum(weight for emotion, weight in weights.items() if labels & self.emotion_labels.get(emotion, set()))
+            return relevance + (0.1 if labels & self.general_labels else 0.0)
+
+        selected: list[Animation] = []
+        label_set_counts: dict[tuple[str, ...], int] = {}
+        for animation in sorted(self.animations.values(), key=score, reverse=True):
+            if label_set_counts.get(animation.labels, 0) >= per_label_set:
+                continue
+            label_set_counts[animation.labels] = label_set_counts.get(animation.labels, 0) + 1
+            selected.append(animation)
+            if len(selected) >= k:
+                break
+        return selected
+
+    @staticmethod
+    def to_prompt(animations: list[Animation]) -> str:
+        """ Format animations for the prompt, one "animation: labels" line each. """
+        return "\n".join([f"{animation.name}: {'; '.join(animation.labels)}" for animation in animations])
@@ -9,3 +9,16 @@ CHUNK = 1365
 WAVE_OUTPUT_FILENAME = "/Users/simonprivat/Workspace/Projects/emo-consens-bot/bot_system/output.wav"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
+
+TTS_RATE = 24000
+TTS_MODEL = "tts-1"
+TTS_VOICE = "fable"
+TTS_SPEED = 1.1
+
+# Message bus ports of the streams sent to and received from the remote analysis host
+BUS_FACE_PORT = 5555
+BUS_SPEECH_PORT = 5556
+BUS_FACIAL_EXPRESSION_PORT = 5557
+BUS_SPEECH_EMOTION_PORT = 5558
+# The bus ports of the n-th session of a process are offset by n times the stride
+BUS_PORT_STRIDE = 10
@@ -1,8 +1,14 @@
+import bisect
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
-from threading import Thread
+import threading
+from threading import Lock, RLock, Thread, Timer
 import time
-from typing import Any, Generic, TypeVar, overload
+from typing import Any, Callable, Generic, Iterator, TypeVar, overload
 
+import numpy as np
 import reactivex as rx
 from reactivex import Observable, operators as ops
 
@@ -13,14 +19,139 @@ P2 = TypeVar("P2")
 P3 = TypeVar("P3")
 
 
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms by name and labels, rendered in the Prometheus text exposition format.
+
+    Collectors are called before rendering to update gauges that are sampled rather than recorded, e.g. queue depths.
+    """
+
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, prefix: str = "pepper_"):
+        self.prefix = prefix
+        self.lock = Lock()
+        self.types: dict[str, str] = {}
+        self.help: dict[str, str] = {}
+        self.values: dict[str, dict[tuple[tuple[str, str], ...], float]] = {}
+        self.histograms: dict[str, dict[tuple[tuple[str, str], ...], list[float]]] = {}
+        self.buckets: dict[str, tuple[float, ...]] = {}
+        self.collectors: list[Callable[["MetricsRegistry"], None]] = []
+
+    def describe(self, name: str, kind: str, help: str, buckets: tuple[float, ...] | None = None) -> None:
+        """ Set the type (counter, gauge or histogram), the help text and the histogram buckets of a metric. """
+        with self.lock:
+            self.types[name] = kind
+            self.help[name] = help
+            if buckets is not None:
+                self.buckets[name] = buckets
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.types.setdefault(name, "counter")
+            values = self.values.setdefault(name, {})
+            values[key] = values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        with self.lock:
+            self.types.setdefault(name, "gauge")
+            self.values.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """ Add an observation to a histogram, e.g. a duration in seconds. """
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.types.setdefault(name, "histogram")
+            buckets = self.buckets.setdefault(name, self.default_buckets)
+            # Counts per bucket, then the sum and the count of all observations
+            histogram = self.histograms.setdefault(name, {}).setdefault(key, [0.0] * (len(buckets) + 2))
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def time(self, name: str, errors: str | None = None, **labels: str) -> Iterator[None]:
+        """ Observe the duration of the block in seconds, also if it raises. If it raises, the errors counter is incremented. """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            if errors is not None:
+                self.inc(errors, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def add_collector(self, collector: Callable[["MetricsRegistry"], None]) -> None:
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self) -> str:
+        """ Render all metrics in the Prometheus text exposition format. """
+        for collector in list(self.collectors):
+            try:
+                collector(self)
+            except Exception as e:
+                print(f"Error in metrics collector {collector}: ", e)
+
+        lines = []
+        with self.lock:
+            for name in sorted(set(self.values) | set(self.histograms)):
+                full_name = self.prefix + name
+                if name in self.help:
+                    lines.append(f"# HELP {full_name} {self.help[name]}")
+                lines.append(f"# TYPE {full_name} {self.types.get(name, 'untyped')}")
+                for key, value in self.values.get(name, {}).items():
+                    lines.append(f"{full_name}{self._labels(key)} {value:g}")
+                buckets = self.buckets.get(name, self.default_buckets)
+                for key, histogram in self.histograms.get(name, {}).items():
+                    cumulative = 0.0
+                    for bound, count in zip((*buckets, float("inf")), histogram):
+                        cumulative += count
+                        lines.append(f"{full_name}_bucket{self._labels(key, le='+Inf' if bound == float('inf') else f'{bound:g}')} {cumulative:g}")
+                    lines.append(f"{full_name}_sum{self._labels(key)} {histogram[-2]:g}")
+                    lines.append(f"{full_name}_count{self._labels(key)} {histogram[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(key: tuple[tuple[str, str], ...], **extra: str) -> str:
+        labels = [*key, *extra.items()]
+        if not labels:
+            return ""
+        escaped = [(label, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for label, value in labels]
+        return "{" + ",".join(f'{label}="{value}"' for label, value in escaped) + "}"
+
+
+# The registry of the process, recorded by the providers and handlers and served by the chat server
+metrics = MetricsRegistry()
+metrics.describe("inputs_emitted_total", "counter", "Inputs emitted by a provider.")
+metrics.describe("inputs_dropped_total", "counter", "Inputs a provider did not emit, by reason.")
+metrics.describe("inputs_received_total", "counter", "Inputs received by a handler.")
+metrics.describe("handler_errors_total", "counter", "Inputs a handler failed to handle.")
+metrics.describe("handling_seconds", "histogram", "Time a handler spent handling an input.")
+metrics.describe("handling_lag_seconds", "histogram", "Time from the end of an input's capture until a handler handled it, by source.")
+metrics.describe("handlers_in_flight", "gauge", "Inputs a handler is currently handling.")
+metrics.describe("threads", "gauge", "Threads of the process.")
+metrics.describe("model_inference_seconds", "histogram", "Inference time of a model.")
+metrics.describe("openai_request_seconds", "histogram", "Latency of an OpenAI API call.")
+metrics.describe("openai_errors_total", "counter", "Failed OpenAI API calls.")
+metrics.describe("socketio_emits_total", "counter", "Socket.IO frames emitted, by event.")
+metrics.describe("llm_requests_total", "counter", "Chat agent requests, by final state.")
+metrics.add_collector(lambda registry: registry.set("threads", threading.active_count()))
+
+
 class InputStreamProvider(Generic[OUT]):
     def __init__(self):
         self._stream: rx.Subject[Input[OUT]] = rx.Subject()
         self.is_paused = False
 
-    def output(self, value: OUT, capture_time: float | None = None) -> None:
+    def output(self, value: OUT, capture_time: float | None = None, duration: float = 0.0, correlation_id: int | None = None) -> None:
         if not self.is_paused:
-            self._stream.on_next(Input(self, value, capture_time if capture_time is not None else time.time()))
+            metrics.inc("inputs_emitted_total", provider=type(self).__name__)
+            self._stream.on_next(Input(self, value, capture_time if capture_time is not None else time.time(), duration, correlation_id))
+        else:
+            metrics.inc("inputs_dropped_total", provider=type(self).__name__, reason="paused")
 
     def pause(self) -> None:
         self.is_paused = True
@@ -38,9 +169,31 @@ class Input(Generic[OUT]):
     source: InputStreamProvider[OUT]
     value: OUT
     capture_time: float
+    duration: float = 0.0
+    # Identifies the input inputs were derived from, e.g. the utterance of a transcription, so parallel results can be joined
+    correlation_id: int | None = None
+
+
+# Marks the threads of fused execution units, fusable handlers receiving an input on them handle it on the same thread
+_fused_context = threading.local()
 
 
 class InputStreamHandler(Generic[P1, P2, P3, OUT], InputStreamProvider[OUT]):
+    """
+    Handles the inputs of up to three providers, each input on a new thread.
+
+    Fusable handlers are cheap and handle their inputs one after another instead. An input received on the thread of a
+    fused execution unit is handled right there, so a linear chain of fusable handlers runs back-to-back without thread
+    hops. Other inputs start a unit on the worker thread of the handler. Handlers that are not fusable keep their own
+    thread per input, so slow consumers never hold up a unit.
+    """
+
+    fusable = False
+    # The maximum number of inputs waiting for the worker of a fusable handler, the oldest is skipped. None is unbounded.
+    fused_queue_size: int | None = None
+    # Labels the metrics of the handler, so the handlers of the sessions of one process can be told apart
+    session_id = "default"
+
     @overload
     def __init__(self, providers: InputStreamProvider[P1], blocking=False) -> None: ...
     @overload
@@ -63,6 +216,12 @@ class InputStreamHandler(Generic[P1, P2, P3, OUT], InputStreamProvider[OUT]):
             providers = (providers,)
         self.blocking = blocking
         self.providers = providers
+        self.in_flight = 0
+        self.in_flight_lock = Lock()
+        self.fused_queue: deque[Input[P1] | Input[P2] | Input[P3]] = deque()
+        self.fused_condition = threading.Condition()
+        self.fused_worker: Thread | None = None
+        self.is_fused_running = True
         self._setup_provider_stream(providers)
         self.is_handling = False
         self.is_paused = False
@@ -74,7 +233,73 @@ class InputStreamHandler(Generic[P1, P2, P3, OUT], InputStreamProvider[OUT]):
         rx.merge(*provider_streams).subscribe(self._handle_on_thread)
 
     def _handle_on_thread(self, input: Input[P1] | Input[P2] | Input[P3]) -> None:
-        Thread(target=self.handle, args=(input,)).start()
+        if not self.fusable:
+            # Named after the handler, so profiles and thread dumps show which handler a thread belongs to
+            Thread(target=self._handle_measured, args=(input,), name=type(self).__name__).start()
+        elif getattr(_fused_context, "is_fused", False):
+            self._handle_fused(input)
+        else:
+            self._enqueue_fused(input)
+
+    def _enqueue_fused(self, input: Input[P1] | Input[P2] | Input[P3]) -> None:
+        skipped = None
+        with self.fused_condition:
+            if not self.is_fused_running:
+                return
+            if self.fused_worker is None:
+                self.fused_worker = Thread(target=self._fused_work, name=f"{type(self).__name__}-fused", daemon=True)
+                self.fused_worker.start()
+            if self.fused_queue_size is not None and len(self.fused_queue) >= self.fused_queue_size:
+                skipped = self.fused_queue.popleft()
+            self.fused_queue.append(input)
+            self.fused_condition.notify()
+        if skipped is not None:
+            metrics.inc("inputs_dropped_total", provider=type(self).__name__, reason="fused_queue_full")
+            self.skip(skipped)
+
+    def _fused_work(self) -> None:
+        _fused_context.is_fused = True
+        while True:
+            with self.fused_condition:
+                while self.is_fused_running and not self.fused_queue:
+                    self.fused_condition.wait()
+                if not self.is_fused_running:
+                    return
+                input = self.fused_queue.popleft()
+            self._handle_fused(input)
+
+    def _handle_fused(self, input: Input[P1] | Input[P2] | Input[P3]) -> None:
+        # An error must not propagate into the handler that output the input on the same thread
+        try:
+            self._handle_measured(input)
+        except Exception as e:
+            print(f"Error in handler {type(self).__name__}: ", e)
+
+    def skip(self, input: Input[P1] | Input[P2] | Input[P3]) -> None:
+        """ Called for an input a fusable handler skipped because its queue was full. """
+        pass
+
+    def _handle_measured(self, input: Input[P1] | Input[P2] | Input[P3]) -> None:
+        name = type(self).__name__
+        session = self.session_id
+        metrics.inc("inputs_received_total", handler=name, session=session)
+        with self.in_flight_lock:
+            self.in_flight += 1
+            metrics.set("handlers_in_flight", self.in_flight, handler=name, session=session)
+        start = time.perf_counter()
+        try:
+            self.handle(input)
+        except Exception:
+            metrics.inc("handler_errors_total", handler=name, session=session)
+            raise
+        finally:
+            metrics.observe("handling_seconds", time.perf_counter() - start, handler=name, session=session)
+            # Includes the waiting in the fused queue and the upstream handlers, which the handling time does not show
+            lag = time.time() - (input.capture_time + input.duration)
+            metrics.observe("handling_lag_seconds", lag, handler=name, source=type(input.source).__name__, session=session)
+            with self.in_flight_lock:
+                self.in_flight -= 1
+                metrics.set("handlers_in_flight", self.in_flight, handler=name, session=session)
 
     def _handle_safe(self, input: Input[P1] | Input[P2] | Input[P3]) -> None:
         try:
@@ -90,6 +315,9 @@ class InputStreamHandler(Generic[P1, P2, P3, OUT], InputStreamProvider[OUT]):
         raise NotImplementedError
 
     def dispose(self) -> None:
+        with self.fused_condition:
+            self.is_fused_running = False
+            self.fused_condition.notify()
         for provider in self.providers:
             provider.dispose()
         super().dispose()
@@ -100,20 +328,421 @@ class ChatAgent:
     def prompt(self, prompt: dict[str, str]) -> dict[str, Any]:
         raise NotImplementedError
 
+    def remember(self, prompt: dict[str, str], response: dict[str, Any]) -> None:
+        """ Add a turn that was answered without prompting this agent to its conversation memory. """
+        pass
+
+    def draft(self, prompt: dict[str, str]) -> dict[str, Any]:
+        """ Answer without adding the turn to the conversation memory, remember adds it if the answer is used. Agents without memory just prompt. """
+        return self.prompt(prompt)
+
+
+class TimeIndexedBuffer(Generic[OUT]):
+    """
+    A fixed capacity ring buffer of inputs ordered by capture_time.
+
+    Every entry is written twice, at its ring position and one capacity further, so that the buffered inputs always form
+    one contiguous slice and a time window can be found by binary search. Inputs older than max_age seconds are dropped.
+    If a vectorize function is given, running sums of the vectors are kept so that the mean over any time window is
+    computed in O(log n).
+    """
+
+    def __init__(self, capacity: int = 2048, max_age: float | None = 120.0, vectorize: Callable[[OUT], np.ndarray] | None = None):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.vectorize = vectorize
+        self.lock = Lock()
+
+        self.times = np.zeros(2 * capacity, dtype=np.float64)
+        self.inputs: list[Input[OUT] | None] = [None] * (2 * capacity)
+        self.vectors: np.ndarray | None = None
+        self.cumulative: np.ndarray | None = None
+        self.start = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, input: Input[OUT]) -> None:
+        """ Add an input. Inputs arriving out of order are indexed at the newest capture_time so the index stays sorted. """
+        vector = self.vectorize(input.value) if self.vectorize is not None else None
+        with self.lock:
+            capture_time = input.capture_time
+            if self.size > 0:
+                capture_time = max(capture_time, self.times[self.start + self.size - 1])
+
+            if self.size == self.capacity:
+                self._drop_oldest()
+
+            position = (self.start + self.size) % self.capacity
+            for index in (position, position + self.capacity):
+                self.times[index] = capture_time
+                self.inputs[index] = input
+            if vector is not None:
+                self._add_vector(position, vector)
+            self.size += 1
+
+            if self.max_age is not None:
+                while self.size > 0 and capture_time - self.times[self.start] > self.max_age:
+                    self._drop_oldest()
+
+    def _add_vector(self, position: int, vector: np.ndarray):
+        if self.vectors is None or self.cumulative is None:
+            self.vectors = np.zeros((2 * self.capacity, len(vector)), dtype=np.float64)
+            self.cumulative = np.zeros((2 * self.capacity, len(vector)), dtype=np.float64)
+
+        previous = self.cumulative[self.start + self.size - 1] if self.size > 0 else 0.0
+        for index in (position, position + self.capacity):
+            self.vectors[index] = vector
+            self.cumulative[index] = previous + vector
+
+    def _drop_oldest(self):
+        self.inputs[self.start] = self.inputs[self.start + self.capacity] = None
+        self.start = (self.start + 1) % self.capacity
+        self.size -= 1
+
+    def _bounds(self, start: float, end: float) -> tuple[int, int]:
+        times = self.times[self.start : self.start + self.size]
+        return self.start + int(np.searchsorted(times, start, "left")), self.start + int(np.searchsorted(times, end, "right"))
+
+    def count(self, start: float, end: float) -> int:
+        """ Count the inputs captured in [start, end]. """
+        with self.lock:
+            first, last = self._bounds(start, end)
+            return last - first
+
+    def window(self, start: float, end: float) -> list[Input[OUT]]:
+        """ Get the inputs captured in [start, end], oldest first. """
+        with self.lock:
+            first, last = self._bounds(start, end)
+            return [input for input in self.inputs[first:last] if input is not None]
+
+    def vector_window(self, start: float, end: float) -> tuple[np.ndarray, np.ndarray]:
+        """ Get copies of the capture times and vectors of the inputs captured in [start, end]. Requires a vectorize function. """
+        with self.lock:
+            if self.vectors is None:
+                return np.zeros(0), np.zeros((0, 0))
+            first, last = self._bounds(start, end)
+            return self.times[first:last].copy(), self.vectors[first:last].copy()
+
+    def mean(self, start: float, end: float) -> np.ndarray | None:
+        """ Get the mean vector of the inputs captured in [start, end] in O(log n), None if there are none. Requires a vectorize function. """
+        with self.lock:
+            if self.vectors is None or self.cumulative is None:
+                return None
+            first, last = self._bounds(start, end)
+            if last <= first:
+                return None
+            total = self.cumulative[last - 1] - self.cumulative[first] + self.vectors[first]
+            return total / (last - first)
+
+
+@dataclass
+class JoinedInput(Generic[P1, P2]):
+    """ An input of the primary stream with the secondary inputs captured within the join tolerance of it, oldest first. """
+
+    primary: Input[P1]
+    secondary: list[Input[P2]]
+
+
+class StreamJoin(InputStreamProvider[JoinedInput[P1, P2]], Generic[P1, P2]):
+    """
+    Joins two input streams by capture_time.
+
+    Every primary input is emitted with the secondary inputs whose capture interval [capture_time, capture_time + duration]
+    lies within tolerance seconds of its capture_time. A primary input is held back until the secondary watermark, the
+    end of the latest secondary input, passed its window, or until it is max_lateness seconds older than the newest input
+    of either stream, so a stalled secondary stream delays the join by at most max_lateness. Primary inputs are emitted in
+    capture order, inputs arriving after their window was emitted are dropped and counted in late_inputs. Both streams
+    buffer at most capacity inputs.
+    """
+
+    def __init__(
+        self,
+        primary: InputStreamProvider[P1],
+        secondary: InputStreamProvider[P2],
+        tolerance: float = 0.1,
+        max_lateness: float = 0.5,
+        capacity: int = 256,
+        subscribe: bool = True,
+    ):
+        """
+        Create a new instance of the StreamJoin class.
+
+        Args:
+            primary (InputStreamProvider[P1]): The stream whose inputs are emitted.
+            secondary (InputStreamProvider[P2]): The stream whose inputs are attached to the primary inputs.
+            tolerance (float, optional): The maximum time in seconds between a primary input and a joined secondary input. Defaults to 0.1.
+            max_lateness (float, optional): The maximum time in seconds a primary input waits for the secondary stream. Defaults to 0.5.
+            capacity (int, optional): The maximum number of buffered inputs per stream. Defaults to 256.
+            subscribe (bool, optional): Whether to join the outputs of the providers. If False, inputs are passed to add, e.g. inputs derived by a handler. Defaults to True.
+        """
+        super().__init__()
+        self.primary = primary
+        self.secondary = secondary
+        self.tolerance = tolerance
+        self.max_lateness = max_lateness
+        self.capacity = capacity
+
+        # Both sorted by capture_time, the times are kept separately for binary search
+        self.pending_times: list[float] = []
+        self.pending_inputs: list[Input[P1]] = []
+        self.secondary_times: list[float] = []
+        self.secondary_inputs: list[Input[P2]] = []
+
+        self.secondary_watermark = float("-inf")
+        self.latest_time = float("-inf")
+        self.emitted_until = float("-inf")
+        self.late_inputs = 0
+        # Reentrant, joined inputs are emitted while holding the lock to keep them in order
+        self.lock = RLock()
+
+        self.subscriptions = [primary._stream.subscribe(self.add), secondary._stream.subscribe(self.add)] if subscribe else []
+
+    def add(self, input: Input[P1] | Input[P2]) -> list[JoinedInput[P1, P2]]:
+        """
+        Add an input of either stream and emit the primary inputs that are ready.
+
+        Args:
+            input (Input[P1] | Input[P2]): The input, its source decides the stream.
+
+        Returns:
+            list[JoinedInput[P1, P2]]: The joined inputs emitted by this call.
+        """
+        with self.lock:
+            self.latest_time = max(self.latest_time, input.capture_time)
+            if input.source == self.primary:
+                self._add_primary(input)
+            elif input.source == self.secondary:
+                self._add_secondary(input)
+            else:
+                raise ValueError(f"Input of {input.source} is not part of the join")
+            return self._emit_ready()
+
+    def _add_primary(self, input: Input[P1]):
+        if input.capture_time < self.emitted_until:
+            self.late_inputs += 1
+            return
+        index = bisect.bisect_right(self.pending_times, input.capture_time)
+        self.pending_times.insert(index, input.capture_time)
+        self.pending_inputs.insert(index, input)
+        if len(self.pending_inputs) > self.capacity:
+            self._emit_first()
+
+    def _add_secondary(self, input: Input[P2]):
+        end = input.capture_time + input.duration
+        if end < self.emitted_until - self.tolerance:
+            self.late_inputs += 1
+            return
+        self.secondary_watermark = max(self.secondary_watermark, end)
+        index = bisect.bisect_right(self.secondary_times, input.capture_time)
+        self.secondary_times.insert(index, input.capture_time)
+        self.secondary_inputs.insert(index, input)
+        if len(self.secondary_inputs) > self.capacity:
+            del self.secondary_times[0], self.secondary_inputs[0]
+
+    def _emit_ready(self) -> list[JoinedInput[P1, P2]]:
+        joined = []
+        while self.pending_times:
+            capture_time = self.pending_times[0]
+            if capture_time + self.tolerance > self.secondary_watermark and capture_time > self.latest_time - self.max_lateness:
+                break
+            joined.append(self._emit_first())
+
+        # Secondary inputs ending before the window of the next primary input can not be joined anymore
+        while self.secondary_inputs and self.secondary_times[0] + self.secondary_inputs[0].duration < self.emitted_until - self.tolerance:
+            del self.secondary_times[0], self.secondary_inputs[0]
+        return joined
+
+    def _emit_first(self) -> JoinedInput[P1, P2]:
+        capture_time = self.pending_times.pop(0)
+        primary = self.pending_inputs.pop(0)
+        last = bisect.bisect_right(self.secondary_times, capture_time + self.tolerance)
+        secondary = [input for input in self.secondary_inputs[:last] if input.capture_time + input.duration >= capture_time - self.tolerance]
+
+        self.emitted_until = capture_time
+        joined = JoinedInput(primary, secondary)
+        self.output(joined, capture_time, primary.duration)
+        return joined
+
+    def flush(self) -> list[JoinedInput[P1, P2]]:
+        """ Emit all pending primary inputs with the secondary inputs received so far. """
+        with self.lock:
+            return [self._emit_first() for _ in range(len(self.pending_inputs))]
+
+    def dispose(self) -> None:
+        for subscription in self.subscriptions:
+            subscription.dispose()
+        super().dispose()
+
+
+class ForkJoin(InputStreamProvider[dict[InputStreamProvider, Input]]):
+    """
+    Joins the results of parallel branches derived from the same input by correlation id.
+
+    The branches are handlers of the source, each handling the source input on its own thread, and output their results
+    with the correlation id of the source input. The results of a correlation id are emitted exactly once, as a dict from
+    branch to result, when all branches delivered, grace seconds after the required branches delivered or timeout
+    seconds after the fork, whatever comes first. The critical path is the slowest branch instead of the sum of the
+    branches. Missing optional branches degrade the result, a missing required branch drops it. Results arriving after
+    their correlation id was emitted or dropped are ignored.
+    """
+
+    def __init__(
+        self,
+        source: InputStreamProvider,
+        branches: tuple[InputStreamProvider, ...],
+        required: tuple[InputStreamProvider, ...] | None = None,
+        timeout: float = 10.0,
+        grace: float = 2.0,
+        max_pending: int = 16,
+    ):
+        """
+        Create a new instance of the ForkJoin class.
+
+        Args:
+            source (InputStreamProvider): The provider of the forked inputs, which carry a correlation id.
+            branches (tuple[InputStreamProvider, ...]): The providers of the results.
+            required (tuple[InputStreamProvider, ...] | None, optional): The branches without which a result is dropped. Defaults to None, all branches.
+            timeout (float, optional): The maximum time in seconds from the fork to the join. Defaults to 10.0.
+            grace (float, optional): The time in seconds optional branches are waited for once the required branches delivered. Defaults to 2.0.
+            max_pending (int, optional): The maximum number of correlation ids waiting for results, the oldest is dropped first. Defaults to 16.
+        """
+        super().__init__()
+        self.source = source
+        self.branches = branches
+        self.required = required if required is not None else branches
+        self.timeout = timeout
+        self.grace = grace
+        self.max_pending = max_pending
+
+        self.forks: dict[int, Input] = {}
+        self.pending: dict[int, dict[InputStreamProvider, Input]] = {}
+        self.timers: dict[int, Timer] = {}
+        self.finished: deque[int] = deque(maxlen=4 * max_pending)
+        self.joined = 0
+        self.degraded = 0
+        self.dropped = 0
+        self.lock = Lock()
+
+        self.subscriptions = [source._stream.subscribe(self._fork)] + [branch._stream.subscribe(self._add_result) for branch in branches]
+
+    def _fork(self, input: Input) -> None:
+        if input.correlation_id is None:
+            return
+        with self.lock:
+            if input.correlation_id in self.finished:
+                return
+            self.forks[input.correlation_id] = input
+            self.pending.setdefault(input.correlation_id, {})
+            if input.correlation_id not in self.timers:
+                self._schedule(input.correlation_id, self.timeout)
+            self._drop_oldest()
+
+    def _add_result(self, input: Input) -> None:
+        if input.correlation_id is None:
+            return
+        with self.lock:
+            if input.correlation_id in self.finished:
+                return
+            results = self.pending.setdefault(input.correlation_id, {})
+            results[input.source] = input
+            if len(results) == len(self.branches):
+                joined = self._finish(input.correlation_id)
+            else:
+                if all(branch in results for branch in self.required):
+                    self._schedule(input.correlation_id, self.grace)
+                elif input.correlation_id not in self.timers:
+                    # The result raced ahead of the fork
+                    self._schedule(input.correlation_id, self.timeout)
+                self._drop_oldest()
+                return
+        self._emit(input.correlation_id, *joined)
+
+    def is_waiting_for(self, correlation_id: int, branch: InputStreamProvider) -> bool:
+        """ Whether the join of correlation_id is still open and has no result of branch yet. """
+        with self.lock:
+            return correlation_id not in self.finished and branch not in self.pending.get(correlation_id, {})
+
+    def _schedule(self, correlation_id: int, delay: float) -> None:
+        timer = self.timers.pop(correlation_id, None)
+        if timer is not None:
+            timer.cancel()
+        timer = Timer(delay, self._expire, args=(correlation_id,))
+        timer.daemon = True
+        self.timers[correlation_id] = timer
+        timer.start()
+
+    def _expire(self, correlation_id: int) -> None:
+        with self.lock:
+            if correlation_id not in self.pending:
+                return
+            joined = self._finish(correlation_id)
+        self._emit(correlation_id, *joined)
+
+    def _drop_oldest(self) -> None:
+        while len(self.pending) > self.max_pending:
+            self._finish(next(iter(self.pending)))
+            self.dropped += 1
+
+    def _finish(self, correlation_id: int) -> tuple[Input | None, dict[InputStreamProvider, Input]]:
+        timer = self.timers.pop(correlation_id, None)
+        if timer is not None:
+            timer.cancel()
+        self.finished.append(correlation_id)
+        return self.forks.pop(correlation_id, None), self.pending.pop(correlation_id)
+
+    def _emit(self, correlation_id: int, fork: Input | None, results: dict[InputStreamProvider, Input]) -> None:
+        if not all(branch in results for branch in self.required):
+            self.dropped += 1
+            return
+        if len(results) < len(self.branches):
+            self.degraded += 1
+        self.joined += 1
+        origin = fork if fork is not None else next(iter(results.values()))
+        self.output(results, origin.capture_time, origin.duration, correlation_id)
+
+    def dispose(self) -> None:
+        for subscription in self.subscriptions:
+            subscription.dispose()
+        with self.lock:
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers.clear()
+        super().dispose()
+
 
 class PromptInputData(Generic[P1, P2, P3]):
-    def __init__(self, question: Input[str] | None = None) -> None:
+    """
+    The inputs relevant to one prompt.
+
+    The inputs themselves live in time indexed buffers that are shared between prompts. A prompt only sees the inputs
+    captured while the question was asked, or since the previous answer if the question carries no duration.
+    """
+
+    interval_margin = 0.5
+
+    def __init__(self, question: Input[str] | None = None, input_buffers: dict[InputStreamProvider, TimeIndexedBuffer[Any]] | None = None, since: float = 0.0) -> None:
         self.question: Input[str] | None = question
-        self.input_buffers: dict[InputStreamProvider, list[Input[Any]]] = {}
+        self.input_buffers: dict[InputStreamProvider, TimeIndexedBuffer[Any]] = input_buffers if input_buffers is not None else {}
+        self.since = since
+
+    def interval(self) -> tuple[float, float]:
+        """ The time interval of the inputs belonging to this prompt. """
+        if self.question is None:
+            return self.since, float("inf")
+        if self.question.duration > 0:
+            return self.question.capture_time - self.interval_margin, self.question.capture_time + self.question.duration + self.interval_margin
+        return self.since, self.question.capture_time + self.interval_margin
 
     def has_input(self, provider: InputStreamProvider[P1] | InputStreamProvider[P2] | InputStreamProvider[P3]) -> bool:
-        return provider in self.input_buffers
+        return provider in self.input_buffers and self.input_buffers[provider].count(*self.interval()) > 0
 
     def add_input(self, input: Input[P1] | Input[P2] | Input[P3]) -> None:
-        if not self.has_input(input.source):
-            self.input_buffers[input.source] = []
+        if input.source not in self.input_buffers:
+            self.input_buffers[input.source] = TimeIndexedBuffer()
 
-        self.input_buffers[input.source].append(input)
+        self.input_buffers[input.source].add(input)
 
     @overload
     def get_input(self, provider: InputStreamProvider[P1]) -> list[Input[P1]]: ...
@@ -124,12 +753,19 @@ class PromptInputData(Generic[P1, P2, P3]):
 
     def get_input(self, provider: InputStreamProvider[P1] | InputStreamProvider[P2] | InputStreamProvider[P3]) -> list[Input[P1]] | list[Input[P2]] | list[Input[P3]]:
         if provider in self.input_buffers:
-            return self.input_buffers[provider]
+            return self.input_buffers[provider].window(*self.interval())
         return []
 
+    def get_vectors(self, provider: InputStreamProvider) -> tuple[np.ndarray, np.ndarray]:
+        """ Get the capture times and vectors of the inputs of a vectorized provider within the prompt interval. """
+        if provider in self.input_buffers:
+            return self.input_buffers[provider].vector_window(*self.interval())
+        return np.zeros(0), np.zeros((0, 0))
+
 
 class Message:
     def __init__(self, text: str, sender: str, from_chat=False, timestamp: float | None = None):
+        self.id: int | None = None
         self.text = text
         self.sender = sender
         self.from_chat = from_chat
@@ -143,23 +779,28 @@ class Message:
 
 
 class ChatServer:
-    def __init__(self):
-        self.messages = []
+    def __init__(self, max_messages: int = 200):
+        self.messages: deque[dict[str, Any]] = deque(maxlen=max_messages)
         self.message_stream = rx.Subject[Message]()
         self.message_stream.subscribe(self.send_message)
 
     def add_message(self, message: str, sender: str, from_chat=False) -> None:
         """ Add a message to the chat server. """
-        self.message_stream.on_next(Message(message, sender, from_chat=from_chat))
-        self.messages.append({"message": message, "sender": sender})
+        chat_message = Message(message, sender, from_chat=from_chat)
+        self.store_message(chat_message)
+        self.message_stream.on_next(chat_message)
+
+    def store_message(self, message: Message) -> None:
+        """ Store a message in the history. Only the last max_messages are kept in memory. """
+        self.messages.append({"message": message.text, "sender": message.sender})
 
     def send_message(self, message: Message) -> None:
         """ Send a message to the chat clients. """
         raise NotImplementedError
 
     def get_messages(self):
-        """ Get all messages. """
-        return self.messages
+        """ Get the stored messages. """
+        return list(self.messages)
 
     def stop(self) -> None:
         """ Stop the chat server. """
@@ -178,7 +819,168 @@ class RobotController:
         pass
 
 
+@dataclass
+class LLMRequest:
+    """ A prompt dispatched to the chat agent and its state: queued, running, answered, superseded, dropped, expired or failed. """
+
+    id: int
+    prompt: dict[str, str]
+    context: Any
+    submitted: float
+    deadline: float
+    state: str = "queued"
+    started: float | None = None
+    finished: float | None = None
+    future: Future | None = None
+    timer: Timer | None = None
+
+    def is_open(self) -> bool:
+        return self.state in ("queued", "running")
+
+
+class LLMDispatcher:
+    """
+    Runs chat agent requests on worker threads, so the thread of the input completing a prompt never waits for the
+    network.
+
+    With the supersede policy a new request supersedes the open ones, queued requests are cancelled and the answers of
+    running requests are discarded. With the queue policy requests are answered one after another, with the drop policy
+    a request is dropped while another one is open. A request not answered before its deadline expires and is answered
+    with None, a late answer is discarded. Every request is answered at most once.
+    """
+
+    policies = ("supersede", "queue", "drop")
+
+    def __init__(
+        self,
+        llm: ChatAgent,
+        on_response: Callable[[LLMRequest, dict[str, Any] | None], None],
+        policy: str = "supersede",
+        timeout: float = 30.0,
+        max_workers: int = 2,
+        history: int = 32,
+    ):
+        """
+        Create a new instance of the LLMDispatcher class.
+
+        Args:
+            llm (ChatAgent): The chat agent answering the prompts.
+            on_response (Callable[[LLMRequest, dict[str, Any] | None], None]): Called with a request and its response, None if the request expired or failed.
+            policy (str, optional): What happens to open requests when a new one is submitted, one of supersede, queue and drop. Defaults to "supersede".
+            timeout (float, optional): The deadline of a request in seconds after its submission. Defaults to 30.0.
+            max_workers (int, optional): The number of worker threads, superseded requests keep a worker until their answer arrives. Ignored by the queue policy, which uses one. Defaults to 2.
+            history (int, optional): The number of recent requests kept for reporting. Defaults to 32.
+        """
+        if policy not in self.policies:
+            raise ValueError(f"Unknown policy {policy}, expected one of {self.policies}")
+        self.llm = llm
+        self.on_response = on_response
+        self.policy = policy
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=1 if policy == "queue" else max_workers, thread_name_prefix="llm")
+
+        self.requests: deque[LLMRequest] = deque(maxlen=history)
+        self.open_requests: list[LLMRequest] = []
+        self.counts = {state: 0 for state in ("answered", "superseded", "dropped", "expired", "failed")}
+        self.next_id = 0
+        self.lock = Lock()
+
+    def submit(self, prompt: dict[str, str], context: Any = None) -> LLMRequest:
+        """ Dispatch a prompt without waiting for the answer. The context is passed back with the request. """
+        now = time.time()
+        with self.lock:
+            request = LLMRequest(self.next_id, prompt, context, now, now + self.timeout)
+            self.next_id += 1
+            self.requests.append(request)
+
+            if self.policy == "drop" and self.open_requests:
+                self._close(request, "dropped")
+                return request
+            if self.policy == "supersede":
+                for open_request in self.open_requests:
+                    self._close(open_request, "superseded")
+                self.open_requests.clear()
+
+            self.open_requests.append(request)
+            request.timer = Timer(self.timeout, self._expire, args=(request,))
+            request.timer.daemon = True
+            request.timer.start()
+            request.future = self.executor.submit(self._run, request)
+        return request
+
+    def _run(self, request: LLMRequest) -> None:
+        with self.lock:
+            if not request.is_open():
+                return
+            request.state = "running"
+            request.started = time.time()
+
+        try:
+            # Drafted without the conversation memory, only a delivered answer is remembered
+            response = self.llm.draft(request.prompt)
+        except Exception as e:
+            print(f"Error in {type(self).__name__} while prompting: ", e)
+            self._deliver(request, None, "failed")
+            return
+        self._deliver(request, response, "answered")
+
+    def _expire(self, request: LLMRequest) -> None:
+        self._deliver(request, None, "expired")
+
+    def _deliver(self, request: LLMRequest, response: dict[str, Any] | None, state: str) -> None:
+        with self.lock:
+            if not request.is_open():
+                if request.state == "superseded":
+                    request.finished = time.time()
+                return
+            self._close(request, state)
+            if request in self.open_requests:
+                self.open_requests.remove(request)
+        if state == "answered" and response is not None:
+            try:
+                self.llm.remember(request.prompt, response)
+            except Exception as e:
+                print(f"Error in {type(self).__name__} while remembering: ", e)
+        self.on_response(request, response)
+
+    def _close(self, request: LLMRequest, state: str) -> None:
+        """ Set the final state of a request. Requires the lock. """
+        request.state = state
+        request.finished = time.time()
+        self.counts[state] += 1
+        metrics.inc("llm_requests_total", state=state)
+        if request.timer is not None:
+            request.timer.cancel()
+        if request.future is not None:
+            request.future.cancel()
+
+    def metrics(self) -> dict[str, Any]:
+        """ Get the number of open requests, the number of requests per final state and the states of the recent requests. """
+        with self.lock:
+            return {
+                "open": len(self.open_requests),
+                **self.counts,
+                "recent": [
+                    {
+                        "id": request.id,
+                        "state": request.state,
+                        "queued": (request.started or request.finished or time.time()) - request.submitted,
+                        "duration": (request.finished or time.time()) - request.started if request.started is not None else None,
+                    }
+                    for request in self.requests
+                ],
+            }
+
+    def dispose(self) -> None:
+        with self.lock:
+            for request in self.open_requests:
+                self._close(request, "superseded")
+            self.open_requests.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
 class Prompter(Generic[P1, P2, P3]):
+    fallback_answer = "There was a problem with the answer!"
 
     @overload
     def __init__(
@@ -188,6 +990,11 @@ class Prompter(Generic[P1, P2, P3]):
         chat_server: ChatServer,
         robot_controller: RobotController,
         inputs: InputStreamProvider[P1],
+        buffer_capacity: int = 2048,
+        buffer_max_age: float = 120.0,
+        question_join: ForkJoin | None = None,
+        llm_policy: str = "supersede",
+        llm_timeout: float = 30.0,
     ): ...
 
     @overload
@@ -198,6 +1005,11 @@ class Prompter(Generic[P1, P2, P3]):
         chat_server: ChatServer,
         robot_controller: RobotController,
         inputs: tuple[InputStreamProvider[P1], InputStreamProvider[P2]],
+        buffer_capacity: int = 2048,
+        buffer_max_age: float = 120.0,
+        question_join: ForkJoin | None = None,
+        llm_policy: str = "supersede",
+        llm_timeout: float = 30.0,
     ): ...
 
     @overload
@@ -208,6 +1020,11 @@ class Prompter(Generic[P1, P2, P3]):
         chat_server: ChatServer,
         robot_controller: RobotController,
         inputs: tuple[InputStreamProvider[P1], InputStreamProvider[P2], InputStreamProvider[P3]],
+        buffer_capacity: int = 2048,
+        buffer_max_age: float = 120.0,
+        question_join: ForkJoin | None = None,
+        llm_policy: str = "supersede",
+        llm_timeout: float = 30.0,
     ): ...
 
     def __init__(
@@ -223,18 +1040,32 @@ class Prompter(Generic[P1, P2, P3]):
             | tuple[InputStreamProvider[P1], InputStreamProvider[P2]]
             | tuple[InputStreamProvider[P1], InputStreamProvider[P2], InputStreamProvider[P3]]
         ) = None,
+        buffer_capacity: int = 2048,
+        buffer_max_age: float = 120.0,
+        question_join: ForkJoin | None = None,
+        llm_policy: str = "supersede",
+        llm_timeout: float = 30.0,
     ):
         self.llm = llm
+        # Answers are generated on the worker threads of the dispatcher, a newer question supersedes an unanswered one by default
+        self.llm_dispatcher = LLMDispatcher(llm, self.__handle_llm_response, llm_policy, llm_timeout)
 
         if isinstance(inputs, InputStreamProvider):
             inputs = (inputs,)
 
         self.inputs = inputs
         self.text_input = text_input
+        # Joins a question with the inputs derived from the same utterance, the question is only prompted once they are buffered
+        self.question_join = question_join
         self.chat_server = chat_server
         self.robot_controller = robot_controller
 
-        self.prompt_data = PromptInputData()
+        self.input_buffers: dict[InputStreamProvider, TimeIndexedBuffer[Any]] = {}
+        for provider in inputs if isinstance(inputs, tuple) else ():
+            self.input_buffers[provider] = TimeIndexedBuffer(buffer_capacity, buffer_max_age, self.vectorizer(provider))
+        self.prompt_data = PromptInputData(input_buffers=self.input_buffers)
+        self.prompted_question: Input[str] | None = None
+        self.prompt_lock = Lock()
 
         text_input._stream.subscribe(lambda text: chat_server.add_message(text.value, "You"))
 
@@ -246,16 +1077,24 @@ class Prompter(Generic[P1, P2, P3]):
 
         if isinstance(inputs, tuple):
             all_inputs: list[InputStreamProvider] = [*inputs, text_input]
-            prompt_stream = rx.merge(*[input._stream for input in all_inputs])
+            if question_join is not None:
+                all_inputs = [input for input in all_inputs if input not in question_join.branches]
+            streams = [input._stream for input in all_inputs]
+            if question_join is not None:
+                streams.append(question_join._stream.pipe(ops.flat_map(lambda input: rx.from_iterable(self._joined_inputs(input.value)))))
+            prompt_stream = rx.merge(*streams)
         else:
             prompt_stream: Observable[Input] = text_input_stream
 
         self.prompt_stream_subscription = prompt_stream.pipe(
             ops.map(self._to_prompt_input_data),
-            ops.filter(self.detect_prompt_ending),
-            ops.map(self.create_prompt),
-            ops.map(self.llm.prompt),
-        ).subscribe(self.__handle_llm_response)
+            ops.filter(self._claim_prompt),
+            ops.map(lambda prompt_data: (self.create_prompt(prompt_data), prompt_data.question)),
+        ).subscribe(lambda prompt: self.llm_dispatcher.submit(*prompt))
+
+    def _joined_inputs(self, results: dict[InputStreamProvider, Input]) -> list[Input]:
+        """ The joined results with the question last, so the prompt ending is detected once all of them are buffered. """
+        return sorted(results.values(), key=lambda input: input.source == self.text_input)
 
     def _to_prompt_input_data(self, input: Input) -> PromptInputData[P1, P2, P3]:
 
@@ -266,12 +1105,32 @@ class Prompter(Generic[P1, P2, P3]):
 
         return self.prompt_data
 
+    def _claim_prompt(self, prompt_data: PromptInputData[P1, P2, P3]) -> bool:
+        """ Detect the prompt ending once per question, inputs arriving while a question is answered do not prompt it again. """
+        with self.prompt_lock:
+            if prompt_data.question is not None and prompt_data.question is self.prompted_question:
+                return False
+            if not self.detect_prompt_ending(prompt_data):
+                return False
+            self.prompted_question = prompt_data.question
+            return True
+
+    def vectorizer(self, provider: InputStreamProvider) -> Callable[[Any], np.ndarray] | None:
+        """ The function mapping the values of an input provider to fixed size vectors, enabling O(log n) window means. None keeps only the inputs. """
+        return None
+
     def create_prompt(self, input_data: PromptInputData[P1, P2, P3]) -> dict[str, str]:
         raise NotImplementedError("create_prompt method must be implemented")
 
-    def __handle_llm_response(self, response: dict[str, Any]) -> None:
-        self.prompt_data = PromptInputData()
-        answer = response.get("clean_answer") or response.get("answer", "There was a problem with the answer!")
+    def __handle_llm_response(self, request: LLMRequest, response: dict[str, Any] | None) -> None:
+        with self.prompt_lock:
+            # Keep a question that arrived while this one was answered
+            if self.prompt_data.question is request.context:
+                self.prompt_data = PromptInputData(input_buffers=self.input_buffers, since=time.time())
+        if response is None:
+            print(f"No answer for request {request.id}: {request.state}")
+            response = {"answer": self.fallback_answer}
+        answer = response.get("clean_answer") or response.get("answer", self.fallback_answer)
         self.chat_server.add_message(answer, "ZeKI GPT")
         response = self.transform_llm_response(response)
         self.robot_controller.execute_llm_response(response)
@@ -288,6 +1147,9 @@ class Prompter(Generic[P1, P2, P3]):
         self.text_input.dispose()
         self.chat_server.stop()
         self.prompt_stream_subscription.dispose()
+        self.llm_dispatcher.dispose()
+        if self.question_join is not None:
+            self.question_join.dispose()
         if self.inputs is not None:
             for input in self.inputs:
                 input.dispose()
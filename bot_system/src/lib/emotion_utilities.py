@@ -1,79 +1,209 @@
-from typing import Any, Callable
+import time
+from dataclasses import dataclass
+from typing import Any
 
-from bot_system.src.lib.core import Input, InputStreamHandler, InputStreamProvider, PromptInputData
+import numpy as np
+
+from bot_system.src.lib.core import InputStreamProvider, PromptInputData
+
+CANONICAL_EMOTIONS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral", "other")
+
+# DeepFace labels of the facial expression handler
+FACIAL_LABELS = {"angry": "angry", "disgust": "disgust", "fear": "fear", "happy": "happy", "sad": "sad", "surprise": "surprise", "neutral": "neutral"}
+
+# emotion2vec labels of the speech emotion handler
+SPEECH_LABELS = {
+    "angry": "angry",
+    "disgusted": "disgust",
+    "fearful": "fear",
+    "happy": "happy",
+    "sad": "sad",
+    "surprised": "surprise",
+    "neutral": "neutral",
+    "other": "other",
+    "<unk>": "other",
+}
+
+
+@dataclass
+class EmotionDistributions:
+    """ The per-turn emotion distributions on the canonical emotion axis. None if there was no input. """
+
+    facial: np.ndarray | None
+    speech: np.ndarray | None
+    fused: np.ndarray | None
+
+    @staticmethod
+    def to_dict(distribution: np.ndarray | None) -> dict[str, float]:
+        if distribution is None:
+            return {}
+        return {emotion: float(score) for emotion, score in zip(CANONICAL_EMOTIONS, distribution)}
+
+
+class EmotionFusionEngine:
+    """
+    Maps the facial and speech emotion labels onto the canonical emotion axis once, when the inputs are buffered, and
+    aggregates them with vectorized NumPy operations. Aggregation is weighted by recency and by confidence, the score of
+    the dominant emotion of each input.
+    """
+
+    def __init__(self, facial_weight: float = 0.5, recency_half_life: float | None = 2.0, confidence_weighting: bool = True):
+        """
+        Create a new instance of the EmotionFusionEngine class.
+
+        Args:
+            facial_weight (float, optional): The weight of the facial distribution in the fused distribution, speech gets the rest. Defaults to 0.5.
+            recency_half_life (float | None, optional): The age in seconds at which an input counts half. None disables recency weighting. Defaults to 2.0.
+            confidence_weighting (bool, optional): Whether inputs are weighted by the score of their dominant emotion. Defaults to True.
+        """
+        self.facial_weight = facial_weight
+        self.recency_half_life = recency_half_life
+        self.confidence_weighting = confidence_weighting
+        self.facial_index = self._index(FACIAL_LABELS)
+        self.speech_index = self._index(SPEECH_LABELS)
+
+    @staticmethod
+    def _index(labels: dict[str, str]) -> dict[str, int]:
+        return {label: CANONICAL_EMOTIONS.index(emotion) for label, emotion in labels.items()}
+
+    @staticmethod
+    def _vectorize(scores: dict[str, Any], index: dict[str, int]) -> np.ndarray:
+        vector = np.zeros(len(CANONICAL_EMOTIONS), dtype=np.float64)
+        for label, score in scores.items():
+            if label in index:
+                vector[index[label]] += score
+        return vector
+
+    def facial_vector(self, facial_expression: dict[str, Any]) -> np.ndarray:
+        """ Map a DeepFace result (or its emotion dict) onto the canonical axis. """
+        return self._vectorize(facial_expression.get("emotion", facial_expression), self.facial_index)
+
+    def speech_vector(self, speech_emotion: dict[str, Any]) -> np.ndarray:
+        """ Map an emotion2vec result onto the canonical axis. """
+        return self._vectorize({str(label).split("/")[-1]: score for label, score in speech_emotion.items()}, self.speech_index)
+
+    def aggregate(self, times: np.ndarray, vectors: np.ndarray, reference_time: float) -> np.ndarray | None:
+        """
+        Compute the weighted mean of emotion vectors.
+
+        Args:
+            times (np.ndarray): The capture times, shape (n,).
+            vectors (np.ndarray): The emotion vectors, shape (n, len(CANONICAL_EMOTIONS)).
+            reference_time (float): The time recency is measured against.
+
+        Returns:
+            np.ndarray | None: The aggregated distribution, None if there are no vectors.
+        """
+        if len(vectors) == 0:
+            return None
+
+        weights = np.ones(len(vectors))
+        if self.recency_half_life is not None:
+            weights *= np.power(0.5, np.clip(reference_time - times, 0, None) / self.recency_half_life)
+        if self.confidence_weighting:
+            weights *= vectors.max(axis=1)
+
+        total = weights.sum()
+        if total <= 0:
+            return vectors.mean(axis=0)
+        return weights @ vectors / total
+
+    def fuse(self, facial: np.ndarray | None, speech: np.ndarray | None) -> np.ndarray | None:
+        """ Combine the facial and speech distributions. If only one is available it is used as is. """
+        if facial is None or speech is None:
+            return facial if facial is not None else speech
+        return self.facial_weight * facial + (1 - self.facial_weight) * speech
 
 
 class EmotionUtilities:
     def __init__(
         self,
-        facial_expression_handler: InputStreamHandler,
-        speech_emotion_handler: InputStreamHandler,
+        facial_expression_handler: InputStreamProvider,
+        speech_emotion_handler: InputStreamProvider,
         emotion_threshold: float,
+        fusion_engine: EmotionFusionEngine | None = None,
     ):
         self.facial_expression_handler = facial_expression_handler
         self.speech_emotion_handler = speech_emotion_handler
         self.emotion_threshold = emotion_threshold
+        self.fusion_engine = fusion_engine if fusion_engine is not None else EmotionFusionEngine()
 
-    def facial_expressions_from_prompt_data(self, prompt_data: PromptInputData) -> str:
-        facial_expressions = self._emotions_from_prompt_data(prompt_data, self.facial_expression_handler, self._facial_expression_to_string)
+    def vectorizer(self, provider: InputStreamProvider):
+        """ The function mapping the values of the given provider onto the canonical emotion axis, for use in the prompt input buffers. """
+        if provider == self.facial_expression_handler:
+            return self.fusion_engine.facial_vector
+        if provider == self.speech_emotion_handler:
+            return self.fusion_engine.speech_vector
+        return None
+
+    def distributions_from_prompt_data(self, prompt_data: PromptInputData) -> EmotionDistributions:
+        """ Compute the facial, speech and fused emotion distributions of the prompt in one pass over the buffered vectors. """
+        reference_time = prompt_data.interval()[1]
+        if reference_time == float("inf"):
+            reference_time = time.time()
+
+        facial = self.fusion_engine.aggregate(*self._vectors(prompt_data, self.facial_expression_handler), reference_time)
+        speech = self.fusion_engine.aggregate(*self._vectors(prompt_data, self.speech_emotion_handler), reference_time)
+        return EmotionDistributions(facial, speech, self.fusion_engine.fuse(facial, speech))
+
+    def _vectors(self, prompt_data: PromptInputData, provider: InputStreamProvider) -> tuple[np.ndarray, np.ndarray]:
+        times, vectors = prompt_data.get_vectors(provider)
+        if vectors.shape[-1] == len(CANONICAL_EMOTIONS):
+            return times, vectors
+
+        # The buffer of the provider is not vectorized, map the inputs now
+        vectorize = self.vectorizer(provider)
+        inputs = prompt_data.get_input(provider)
+        if vectorize is None or len(inputs) == 0:
+            return np.zeros(0), np.zeros((0, len(CANONICAL_EMOTIONS)))
+        return np.array([input.capture_time for input in inputs]), np.stack([vectorize(input.value) for input in inputs])
+
+    def facial_expressions_to_string(self, distributions: EmotionDistributions) -> str:
+        facial_expressions = self._distribution_to_string(distributions.facial, "Sieht ({}) {} aus.")
         return facial_expressions if facial_expressions else "Es konnte keine Emotionen im Gesicht erkannt werden."
 
-    def speech_emotions_from_prompt_data(self, prompt_data: PromptInputData) -> str:
-        speech_emotions = self._emotions_from_prompt_data(prompt_data, self.speech_emotion_handler, self._speech_emotion_to_string)
+    def speech_emotions_to_string(self, distributions: EmotionDistributions) -> str:
+        speech_emotions = self._distribution_to_string(distributions.speech, "Klingt ({}) {}.")
         return speech_emotions if speech_emotions else "Es konnte keine Emotionen in der Sprache erkannt werden."
 
-    def _emotions_from_prompt_data(
-        self,
-        prompt_data: PromptInputData,
-        provider: InputStreamProvider,
-        to_string_fn: Callable[[str, float], str],
-    ) -> str | None:
-        emotions_buffer: list[dict[str, Any]] = [facial_expressions.value for facial_expressions in prompt_data.get_input(provider)]
-        emotions = self._compute_average_emotions(emotions_buffer)
+    def facial_expressions_from_prompt_data(self, prompt_data: PromptInputData) -> str:
+        return self.facial_expressions_to_string(self.distributions_from_prompt_data(prompt_data))
 
-        if emotions is not None:
-            emotions = {key: value for key, value in emotions.items() if value > self.emotion_threshold}
-            emotions = "".join([to_string_fn(key, value) for key, value in emotions.items()])
+    def speech_emotions_from_prompt_data(self, prompt_data: PromptInputData) -> str:
+        return self.speech_emotions_to_string(self.distributions_from_prompt_data(prompt_data))
 
-        return emotions if emotions else None
+    def emotion_scores_from_prompt_data(self, prompt_data: PromptInputData) -> dict[str, float]:
+        """ Get the fused emotion scores of the prompt data by canonical emotion. """
+        return EmotionDistributions.to_dict(self.distributions_from_prompt_data(prompt_data).fused)
 
-    def _compute_average_emotions(self, emotions_buffer: list[dict[str, Any]]):
-        if len(emotions_buffer) == 0:
+    def _distribution_to_string(self, distribution: np.ndarray | None, template: str) -> str | None:
+        if distribution is None:
             return None
-        emotions_sum: dict[str, float] = {}
-        for emotions in emotions_buffer:
-            if "emotion" in emotions:
-                emotions = emotions["emotion"]
-            if emotions_sum == {}:
-                emotions_sum = emotions
-            else:
-                for key, value in emotions.items():
-                    emotions_sum[key] += value
-        emotions_avg = {key: value / len(emotions_buffer) for key, value in emotions_sum.items()}
-        return emotions_avg
-
-    def _facial_expression_to_string(self, emotion_label: str, emotion_value: float):
-        return f"Sieht ({self._translate_emotion_value(emotion_value)}) {self._translate_emotion_label(emotion_label)} aus."
-
-    def _speech_emotion_to_string(self, emotion_label: str, emotion_value: float):
-        return f"Klingt ({self._translate_emotion_value(emotion_value)}) {self._translate_emotion_label(emotion_label)}."
+        emotions = "".join(
+            [
+                template.format(self._translate_emotion_value(score), self._translate_emotion_label(emotion))
+                for emotion, score in zip(CANONICAL_EMOTIONS, distribution)
+                if score > self.emotion_threshold
+            ]
+        )
+        return emotions if emotions else None
 
     def _translate_emotion_label(self, emotion: str):
         if emotion == "angry":
             return "Wütend"
-        elif emotion == "disgust" or emotion == "disgusted":
+        elif emotion == "disgust":
             return "Ekel"
-        elif emotion == "fear" or emotion == "fearful":
+        elif emotion == "fear":
             return "Angst"
         elif emotion == "happy":
             return "Glücklich"
         elif emotion == "sad":
             return "Traurig"
-        elif emotion == "surprise" or emotion == "surprised":
+        elif emotion == "surprise":
             return "Überrascht"
         elif emotion == "neutral":
             return "Neutral"
-        elif emotion == "<unk>" or emotion == "other":
+        elif emotion == "other":
             return "Unbekannt"
         else:
             return emotion
@@ -0,0 +1,75 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from bot_system.src.lib.core import InputStreamHandler, InputStreamProvider
+
+
+class StageHandler(InputStreamHandler[float, float, float, float]):
+    """ A stand-in for a cheap per-frame stage, e.g. the face detection, spinning for the given work time. """
+
+    def __init__(self, provider: InputStreamProvider[float], work_time: float, fusable: bool):
+        self.work_time = work_time
+        self.fusable = fusable
+        super().__init__(provider)
+
+    def handle(self, input):
+        end = time.perf_counter() + self.work_time
+        while time.perf_counter() < end:
+            pass
+        self.output(input.value, input.capture_time)
+
+
+def benchmark(fusable: bool, stages: int, frames: int, fps: float, work_time: float) -> dict[str, float]:
+    """ Push frames through a linear chain of handlers and measure the latency from the provider to the end of the chain. """
+    source = InputStreamProvider[float]()
+    chain: list[InputStreamProvider[float]] = [source]
+    for _ in range(stages):
+        chain.append(StageHandler(chain[-1], work_time, fusable))
+
+    latencies: list[float] = []
+    done = threading.Event()
+
+    def receive(input):
+        latencies.append(time.perf_counter() - input.value)
+        if len(latencies) == frames:
+            done.set()
+
+    chain[-1]._stream.subscribe(receive)
+
+    max_threads = threading.active_count()
+    start = time.perf_counter()
+    for index in range(frames):
+        time.sleep(max(start + index / fps - time.perf_counter(), 0))
+        source.output(time.perf_counter())
+        max_threads = max(max_threads, threading.active_count())
+    done.wait(timeout=10)
+
+    for handler in chain[1:]:
+        handler.dispose()
+    return {
+        "frames": len(latencies),
+        "mean_ms": float(np.mean(latencies)) * 1000,
+        "p99_ms": float(np.percentile(latencies, 99)) * 1000,
+        "overhead_ms": (float(np.mean(latencies)) - stages * work_time) * 1000,
+        "max_threads": max_threads,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a thread per input and per handler with fused handler chains.")
+    parser.add_argument("--stages", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--work-ms", type=float, default=1.0, help="The work time of each stage in milliseconds.")
+    args = parser.parse_args()
+
+    print(f"{args.stages} stages of {args.work_ms:.1f} ms, {args.frames} frames at {args.fps:.0f} fps")
+    print(f"{'mode':<9} {'frames':>7} {'mean ms':>8} {'p99 ms':>8} {'overhead ms':>12} {'threads':>8}")
+    for name, fusable in (("threaded", False), ("fused", True)):
+        result = benchmark(fusable, args.stages, args.frames, args.fps, args.work_ms / 1000)
+        print(
+            f"{name:<9} {result['frames']:>7} {result['mean_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['overhead_ms']:>12.3f} {result['max_threads']:>8}"
+        )
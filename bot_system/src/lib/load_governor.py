@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable
+
+import psutil
+
+from bot_system.src.lib.core import MetricsRegistry, metrics
+
+metrics.describe("governor_level", "gauge", "Load shedding steps the governor applied.")
+metrics.describe("governor_decisions_total", "counter", "Load shedding steps applied and restored, by step.")
+
+
+@dataclass
+class GovernorStep:
+    name: str
+    apply: Callable[[], None]
+    restore: Callable[[], None]
+
+
+@dataclass
+class GovernorDecision:
+    time: float
+    action: str
+    step: str
+    level: int
+    reason: str
+
+
+class LoadGovernor:
+    """
+    Sheds load when the pipeline falls behind and restores it when there is headroom again.
+
+    Every interval, the governor compares the mean lag of the budgeted handlers since the previous interval with their
+    latency budgets, and the CPU use with the high and low watermarks. The lag is the time from the end of an input's
+    capture until it was handled, per input source, so a backlog in front of a handler counts and frequent cheap inputs
+    do not dilute expensive ones. If a budget is exceeded or the CPU use is above the high watermark, the next step is
+    applied. If all handlers are within half of their budgets and the CPU use is below the low watermark for
+    restore_after intervals in a row, the last applied step is restored. The steps are applied in the given order and
+    restored in the reverse order, so the first step is the least important work.
+    """
+
+    def __init__(
+        self,
+        steps: list[GovernorStep],
+        budgets: dict[str, float],
+        cpu_high: float = 0.85,
+        cpu_low: float = 0.6,
+        interval: float = 1.0,
+        restore_after: int = 3,
+        registry: MetricsRegistry = metrics,
+        session_id: str = "default",
+        start: bool = True,
+    ):
+        """
+        Create a new instance of the LoadGovernor class.
+
+        Args:
+            steps (list[GovernorStep]): The load shedding steps, the least important work first.
+            budgets (dict[str, float]): The lag budgets in seconds by handler class name, applying to each input source of the handler.
+            cpu_high (float, optional): The CPU use from 0 to 1 above which a step is applied. Defaults to 0.85.
+            cpu_low (float, optional): The CPU use from 0 to 1 below which a step may be restored. Defaults to 0.6.
+            interval (float, optional): The time in seconds between decisions. Defaults to 1.0.
+            restore_after (int, optional): The number of intervals in a row with headroom before a step is restored. Defaults to 3.
+            registry (MetricsRegistry, optional): The registry with the handling lags. Defaults to the registry of the process.
+            session_id (str, optional): The session whose handlers are budgeted, the governors of other sessions shed their own load. Defaults to "default".
+            start (bool, optional): Whether to start the governor thread. Defaults to True.
+        """
+        self.steps = steps
+        self.budgets = budgets
+        self.cpu_high = cpu_high
+        self.cpu_low = cpu_low
+        self.interval = interval
+        self.restore_after = restore_after
+        self.registry = registry
+        self.session_id = session_id
+
+        self.level = 0
+        self.headroom_intervals = 0
+        self.decisions = deque[GovernorDecision](maxlen=100)
+        self.lock = threading.Lock()
+        # The lag sums and counts of the previous interval by handler and source
+        self.previous_lags: dict[tuple[str, str], tuple[float, float]] = {}
+        self.sample_lags()
+        psutil.cpu_percent(interval=None)
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="LoadGovernor", daemon=True)
+        if start:
+            self.thread.start()
+        self.registry.set("governor_level", self.level, session=self.session_id)
+
+    def _run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.update(self.sample_lags(), psutil.cpu_percent(interval=None) / 100)
+            except Exception as e:
+                print("Error in load governor: ", e)
+
+    def sample_lags(self) -> dict[tuple[str, str], float]:
+        """ Get the mean lag in seconds of each input source of the budgeted handlers of the session since the previous sample, of the sources with handled inputs. """
+        with self.registry.lock:
+            histograms = {key: (histogram[-2], histogram[-1]) for key, histogram in self.registry.histograms.get("handling_lag_seconds", {}).items()}
+
+        lags = {}
+        for labels, (total, count) in histograms.items():
+            labels = dict(labels)
+            handler, source = labels.get("handler", ""), labels.get("source", "")
+            if handler not in self.budgets or labels.get("session") != self.session_id:
+                continue
+            key = (handler, source)
+            previous_total, previous_count = self.previous_lags.get(key, (0.0, 0.0))
+            if count > previous_count:
+                lags[key] = (total - previous_total) / (count - previous_count)
+            self.previous_lags[key] = (total, count)
+        return lags
+
+    def update(self, lags: dict[tuple[str, str], float], cpu: float) -> GovernorDecision | None:
+        """
+        Decide whether to apply or restore a step.
+
+        Args:
+            lags (dict[tuple[str, str], float]): The mean lags in seconds by handler class name and source class name.
+            cpu (float): The CPU use from 0 to 1.
+
+        Returns:
+            GovernorDecision | None: The decision, or None if the level is kept.
+        """
+        over_budget = [
+            f"{handler} {source} {lag * 1000:.0f}/{self.budgets[handler] * 1000:.0f} ms" for (handler, source), lag in lags.items() if lag > self.budgets[handler]
+        ]
+        has_headroom = cpu < self.cpu_low and all(lag <= self.budgets[handler] / 2 for (handler, _), lag in lags.items())
+
+        with self.lock:
+            if over_budget or cpu > self.cpu_high:
+                self.headroom_intervals = 0
+                if self.level >= len(self.steps):
+                    return None
+                step = self.steps[self.level]
+                reason = ", ".join(over_budget + ([f"CPU {cpu:.0%}"] if cpu > self.cpu_high else []))
+                return self._decide("apply", step, step.apply, self.level + 1, reason)
+
+            if not has_headroom:
+                self.headroom_intervals = 0
+                return None
+            self.headroom_intervals += 1
+            if self.level == 0 or self.headroom_intervals < self.restore_after:
+                return None
+            self.headroom_intervals = 0
+            step = self.steps[self.level - 1]
+            return self._decide("restore", step, step.restore, self.level - 1, f"CPU {cpu:.0%} for {self.restore_after} intervals")
+
+    def _decide(self, action: str, step: GovernorStep, change: Callable[[], Any], level: int, reason: str) -> GovernorDecision:
+        """ Apply or restore a step and log the decision. Requires the lock. """
+        change()
+        self.level = level
+        decision = GovernorDecision(time.time(), action, step.name, level, reason)
+        self.decisions.append(decision)
+        self.registry.set("governor_level", level, session=self.session_id)
+        self.registry.inc("governor_decisions_total", action=action, step=step.name, session=self.session_id)
+        print(f"Load governor {self.session_id}: {action} {step.name} (level {level}/{len(self.steps)}): {reason}")
+        return decision
+
+    def dispose(self) -> None:
+        """ Stop the governor and restore all applied steps. """
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=self.interval + 1)
+        with self.lock:
+            while self.level > 0:
+                self._decide("restore", self.steps[self.level - 1], self.steps[self.level - 1].restore, self.level - 1, "disposed")
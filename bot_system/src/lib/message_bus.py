@@ -0,0 +1,221 @@
+import dataclasses
+import io
+import json
+import struct
+from threading import Lock, Thread
+from typing import Any, Callable
+
+import numpy as np
+import zmq
+
+from bot_system.src.lib.core import OUT, Input, InputStreamProvider
+
+# capture_time, duration and correlation id of the input (-1 for none), followed by the JSON description of the value
+HEADER = struct.Struct("!ddq")
+
+
+class StreamCodec:
+    """
+    Serializes input values without pickle.
+
+    The value is described by a small JSON document in which NumPy arrays, bytes and files are replaced by references to
+    raw buffer frames, so frames and PCM audio are sent as is. Dataclasses are sent field by field and are only decoded
+    into the types passed to the codec, other dataclasses arrive as dicts.
+    """
+
+    def __init__(self, types: tuple[type, ...] = ()):
+        """
+        Create a new instance of the StreamCodec class.
+
+        Args:
+            types (tuple[type, ...], optional): The dataclasses that can be decoded. Defaults to ().
+        """
+        self.types = {cls.__name__: cls for cls in types}
+
+    def encode(self, value: Any) -> tuple[bytes, list[Any]]:
+        """ Encode a value into its JSON description and the buffers it references. """
+        buffers: list[Any] = []
+        description = self._encode(value, buffers)
+        return json.dumps(description, separators=(",", ":")).encode(), buffers
+
+    def _encode(self, value: Any, buffers: list[Any]) -> Any:
+        if value is None or isinstance(value, (str, bool, int, float)):
+            return value
+        if isinstance(value, np.ndarray):
+            buffers.append(np.ascontiguousarray(value))
+            return {"$": "array", "i": len(buffers) - 1, "dtype": value.dtype.str, "shape": value.shape}
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            buffers.append(value)
+            return {"$": "bytes", "i": len(buffers) - 1}
+        if isinstance(value, io.IOBase):
+            # Read without moving the position, local handlers read the same file
+            position = value.tell()
+            buffers.append(value.read())
+            value.seek(position)
+            return {"$": "file", "i": len(buffers) - 1}
+        if dataclasses.is_dataclass(value) and not isinstance(value, type):
+            fields = {field.name: self._encode(getattr(value, field.name), buffers) for field in dataclasses.fields(value)}
+            return {"$": "dataclass", "type": type(value).__name__, "fields": fields}
+        if isinstance(value, dict):
+            items = {str(key): self._encode(item, buffers) for key, item in value.items()}
+            return {"$": "dict", "v": items} if "$" in items else items
+        if isinstance(value, (list, tuple)):
+            return [self._encode(item, buffers) for item in value]
+        raise TypeError(f"Cannot encode {type(value).__name__} for the message bus")
+
+    def decode(self, description: bytes | memoryview, buffers: list[Any]) -> Any:
+        """ Decode a value from its JSON description and the received buffers. Arrays are read-only views of the buffers. """
+        return self._decode(json.loads(bytes(description)), buffers)
+
+    def _decode(self, value: Any, buffers: list[Any]) -> Any:
+        if isinstance(value, list):
+            return [self._decode(item, buffers) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        kind = value.get("$")
+        if kind is None:
+            return {key: self._decode(item, buffers) for key, item in value.items()}
+        if kind == "array":
+            return np.frombuffer(buffers[value["i"]], dtype=np.dtype(value["dtype"])).reshape(value["shape"])
+        if kind == "bytes":
+            return bytes(buffers[value["i"]])
+        if kind == "file":
+            return io.BufferedReader(io.BytesIO(bytes(buffers[value["i"]])))  # type: ignore
+        if kind == "dataclass":
+            fields = {key: self._decode(item, buffers) for key, item in value["fields"].items()}
+            cls = self.types.get(value["type"])
+            return cls(**fields) if cls is not None else fields
+        if kind == "dict":
+            return {key: self._decode(item, buffers) for key, item in value["v"].items()}
+        raise ValueError(f"Unknown value kind {kind} on the message bus")
+
+
+class StreamPublisher:
+    """
+    Publishes the stream of an InputStreamProvider on a ZeroMQ socket, so that handlers in other processes or on other
+    hosts can subscribe to it with a RemoteStreamProvider.
+
+    Every subscriber has a queue of at most hwm messages. If a queue is full the input is dropped, or, with block=True,
+    the providing thread waits until the subscriber caught up.
+    """
+
+    def __init__(
+        self,
+        provider: InputStreamProvider,
+        address: str,
+        topic: str = "",
+        hwm: int = 8,
+        block: bool = False,
+        predicate: Callable[[Input], bool] | None = None,
+        codec: StreamCodec | None = None,
+        context: zmq.Context | None = None,
+    ):
+        """
+        Create a new instance of the StreamPublisher class.
+
+        Args:
+            provider (InputStreamProvider): The provider whose stream is published.
+            address (str): The address to bind to, e.g. "tcp://*:5555".
+            topic (str, optional): The topic of the messages, subscribers only receive the topic they subscribed to. Defaults to "".
+            hwm (int, optional): The maximum number of messages queued per subscriber. Defaults to 8.
+            block (bool, optional): Whether to wait for slow subscribers instead of dropping inputs. Defaults to False.
+            predicate (Callable[[Input], bool] | None, optional): Only inputs matching the predicate are published. Defaults to None, publishing all inputs.
+            codec (StreamCodec | None, optional): The serializer of the values. Defaults to a new StreamCodec.
+            context (zmq.Context | None, optional): The ZeroMQ context. Defaults to the global instance.
+        """
+        self.topic = topic.encode()
+        self.block = block
+        self.predicate = predicate
+        self.codec = codec if codec is not None else StreamCodec()
+        self.sent = 0
+        self.dropped = 0
+
+        self.socket = (context if context is not None else zmq.Context.instance()).socket(zmq.XPUB)
+        self.socket.setsockopt(zmq.SNDHWM, hwm)
+        self.socket.setsockopt(zmq.XPUB_NODROP, 1)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.bind(address)
+        # ZeroMQ sockets must not be used by several threads at once and handlers output on their own threads
+        self.send_lock = Lock()
+
+        self.subscription = provider._stream.subscribe(self.publish)
+
+    def publish(self, input: Input) -> None:
+        if self.predicate is not None and not self.predicate(input):
+            return
+        description, buffers = self.codec.encode(input.value)
+        frames = [self.topic, HEADER.pack(input.capture_time, input.duration, input.correlation_id if input.correlation_id is not None else -1) + description, *buffers]
+        with self.send_lock:
+            try:
+                self.socket.send_multipart(frames, flags=0 if self.block else zmq.NOBLOCK, copy=False)
+                self.sent += 1
+            except zmq.Again:
+                self.dropped += 1
+            except zmq.ZMQError as e:
+                print(f"Error in {type(self).__name__}: ", e)
+
+    def dispose(self) -> None:
+        self.subscription.dispose()
+        with self.send_lock:
+            self.socket.close()
+
+
+class RemoteStreamProvider(InputStreamProvider[OUT]):
+    """ Provides the inputs published by a StreamPublisher in another process or on another host, with their original capture time, duration and correlation id. """
+
+    def __init__(
+        self,
+        address: str,
+        topic: str = "",
+        hwm: int = 8,
+        codec: StreamCodec | None = None,
+        context: zmq.Context | None = None,
+    ):
+        """
+        Create a new instance of the RemoteStreamProvider class.
+
+        Args:
+            address (str): The address of the publisher, e.g. "tcp://pepper-host:5555".
+            topic (str, optional): The topic to subscribe to. Defaults to "".
+            hwm (int, optional): The maximum number of received messages queued before the publisher has to wait or drop. Defaults to 8.
+            codec (StreamCodec | None, optional): The deserializer of the values, knowing the dataclasses of the stream. Defaults to a new StreamCodec.
+            context (zmq.Context | None, optional): The ZeroMQ context. Defaults to the global instance.
+        """
+        super().__init__()
+        self.codec = codec if codec is not None else StreamCodec()
+        self.topic = topic.encode()
+
+        self.socket = (context if context is not None else zmq.Context.instance()).socket(zmq.SUB)
+        self.socket.setsockopt(zmq.RCVHWM, hwm)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.setsockopt(zmq.SUBSCRIBE, self.topic)
+        self.socket.connect(address)
+
+        self.is_running = True
+        self.receive_thread = Thread(target=self._receive_loop, daemon=True)
+        self.receive_thread.start()
+
+    def _receive_loop(self):
+        while self.is_running:
+            if not self.socket.poll(100):
+                continue
+            frames = self.socket.recv_multipart(copy=False)
+            # Subscriptions match topic prefixes, skip other topics sharing the prefix
+            if frames[0].bytes != self.topic:
+                continue
+            try:
+                header = frames[1].buffer
+                capture_time, duration, correlation_id = HEADER.unpack_from(header)
+                value = self.codec.decode(header[HEADER.size :], [frame.buffer for frame in frames[2:]])
+            except Exception as e:
+                print(f"Error in {type(self).__name__} while decoding: ", e)
+                continue
+            self.output(value, capture_time, duration, correlation_id if correlation_id >= 0 else None)
+        self.socket.close()
+
+    def dispose(self) -> None:
+        self.is_running = False
+        super().dispose()
@@ -0,0 +1,138 @@
+from threading import Condition, Lock, Thread
+from typing import Any
+
+from sqlalchemy import Boolean, Float, Integer, String, create_engine, func, select
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from bot_system.src.lib.core import Message
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class StoredMessage(Base):
+    __tablename__ = "messages"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    text: Mapped[str] = mapped_column(String)
+    sender: Mapped[str] = mapped_column(String)
+    from_chat: Mapped[bool] = mapped_column(Boolean, default=False)
+    timestamp: Mapped[float] = mapped_column(Float, index=True)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"id": self.id, "message": self.text, "sender": self.sender, "timestamp": self.timestamp}
+
+
+class MessageStore:
+    """
+    A SQLite backed chat history.
+
+    Messages get their id when they are added, so they can be sent to the clients right away, and are written in batches by
+    a background thread, at the latest every flush_interval seconds. Reads first write all pending messages, so they always see the complete history.
+    """
+
+    def __init__(self, url: str = "sqlite:///bot_system/chat_history.db", batch_size: int = 100, flush_interval: float = 0.5):
+        """
+        Create a new instance of the MessageStore class.
+
+        Args:
+            url (str, optional): The SQLAlchemy database url. Defaults to "sqlite:///bot_system/chat_history.db".
+            batch_size (int, optional): The number of pending messages that triggers a write before flush_interval has passed. Defaults to 100.
+            flush_interval (float, optional): The maximum time in seconds messages stay pending. Defaults to 0.5.
+        """
+        self.engine = create_engine(url, connect_args={"check_same_thread": False} if url.startswith("sqlite") else {})
+        Base.metadata.create_all(self.engine)
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending: list[StoredMessage] = []
+        self.condition = Condition()
+        self.write_lock = Lock()
+        self.is_running = True
+
+        with Session(self.engine) as session:
+            self.next_id = (session.scalar(select(func.max(StoredMessage.id))) or 0) + 1
+
+        self.writer_thread = Thread(target=self._write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def add(self, message: Message) -> int:
+        """
+        Queue a message for writing and assign its id.
+
+        Args:
+            message (Message): The message. Its id attribute is set.
+
+        Returns:
+            int: The id of the message.
+        """
+        with self.condition:
+            message.id = self.next_id
+            self.next_id += 1
+            self.pending.append(StoredMessage(id=message.id, text=message.text, sender=message.sender, from_chat=message.from_chat, timestamp=message.timestamp))
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+        return message.id
+
+    def _write_loop(self):
+        while self.is_running:
+            with self.condition:
+                self.condition.wait(self.flush_interval)
+            self.flush()
+        self.flush()
+
+    def flush(self) -> None:
+        """ Write all pending messages now. """
+        with self.write_lock:
+            with self.condition:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return
+            try:
+                with Session(self.engine) as session:
+                    session.add_all(batch)
+                    session.commit()
+            except Exception as e:
+                print(f"Error in {type(self).__name__} while writing {len(batch)} messages: ", e)
+
+    def page(self, before_id: int | None = None, limit: int = 50) -> list[dict[str, Any]]:
+        """
+        Get a page of the history.
+
+        Args:
+            before_id (int | None, optional): Only return messages older than this id. Defaults to None, the newest messages.
+            limit (int, optional): The maximum number of messages. Defaults to 50.
+
+        Returns:
+            list[dict[str, Any]]: The messages, oldest first.
+        """
+        self.flush()
+        query = select(StoredMessage).order_by(StoredMessage.id.desc()).limit(limit)
+        if before_id is not None:
+            query = query.where(StoredMessage.id < before_id)
+        with Session(self.engine) as session:
+            return [message.to_dict() for message in reversed(session.scalars(query).all())]
+
+    def since(self, after_id: int, limit: int = 200) -> list[dict[str, Any]]:
+        """
+        Get the messages newer than an id, e.g. for a reconnecting client.
+
+        Args:
+            after_id (int): The id of the last message the client has.
+            limit (int, optional): The maximum number of messages. Defaults to 200.
+
+        Returns:
+            list[dict[str, Any]]: The messages, oldest first.
+        """
+        self.flush()
+        query = select(StoredMessage).where(StoredMessage.id > after_id).order_by(StoredMessage.id).limit(limit)
+        with Session(self.engine) as session:
+            return [message.to_dict() for message in session.scalars(query).all()]
+
+    def dispose(self) -> None:
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+        self.writer_thread.join(timeout=5)
+        self.engine.dispose()
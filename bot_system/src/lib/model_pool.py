@@ -0,0 +1,147 @@
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread
+from typing import Any, Callable, TypeVar
+
+R = TypeVar("R")
+
+
+class SharedModel:
+    """
+    A model shared by several sessions.
+
+    The model is loaded once on first use. Inference requests are queued per session and executed on one worker thread
+    that takes the sessions in round-robin order, so a busy session cannot starve the others.
+    """
+
+    def __init__(self, name: str, load: Callable[[], Any]):
+        """
+        Create a new instance of the SharedModel class.
+
+        Args:
+            name (str): The name of the model, used in the metrics.
+            load (Callable[[], Any]): Loads the model.
+        """
+        self.name = name
+        self.load = load
+        self.model: Any = None
+        # A loader may return None, e.g. for models cached globally by their library
+        self.is_loaded = False
+        self.load_lock = Lock()
+
+        self.condition = Condition()
+        self.queues: OrderedDict[str, deque[tuple[Callable[[Any], Any], Future, float]]] = OrderedDict()
+        self.metrics: dict[str, dict[str, float]] = {}
+        self.is_running = True
+
+        self.worker_thread = Thread(target=self._work, daemon=True, name=f"SharedModel-{name}")
+        self.worker_thread.start()
+
+    def get_model(self) -> Any:
+        with self.load_lock:
+            if not self.is_loaded:
+                print(f"Loading shared model {self.name}...")
+                self.model = self.load()
+                self.is_loaded = True
+            return self.model
+
+    def run(self, session_id: str, inference: Callable[[Any], R]) -> R:
+        """
+        Run an inference on the shared model and wait for its result.
+
+        Args:
+            session_id (str): The session requesting the inference.
+            inference (Callable[[Any], R]): Called with the model on the worker thread.
+
+        Returns:
+            R: The result of the inference.
+        """
+        return self.submit(session_id, inference).result()
+
+    def submit(self, session_id: str, inference: Callable[[Any], R]) -> "Future[R]":
+        """ Queue an inference on the shared model. """
+        future: Future[R] = Future()
+        with self.condition:
+            self.queues.setdefault(session_id, deque()).append((inference, future, time.time()))
+            self.condition.notify()
+        return future
+
+    def _next_request(self) -> tuple[str, Callable[[Any], Any], Future, float] | None:
+        with self.condition:
+            while self.is_running and not any(self.queues.values()):
+                self.condition.wait()
+            for session_id, queue in self.queues.items():
+                if queue:
+                    inference, future, enqueue_time = queue.popleft()
+                    # Move the session to the end of the round-robin order
+                    self.queues.move_to_end(session_id)
+                    return session_id, inference, future, enqueue_time
+            return None
+
+    def _work(self):
+        while True:
+            request = self._next_request()
+            if request is None:
+                return
+
+            session_id, inference, future, enqueue_time = request
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            start = time.time()
+            try:
+                future.set_result(inference(self.get_model()))
+            except Exception as e:
+                future.set_exception(e)
+            self._record(session_id, start - enqueue_time, time.time() - start)
+
+    def _record(self, session_id: str, wait_time: float, inference_time: float):
+        with self.condition:
+            metrics = self.metrics.setdefault(session_id, {"requests": 0, "wait_time": 0.0, "inference_time": 0.0, "max_latency": 0.0})
+            metrics["requests"] += 1
+            metrics["wait_time"] += wait_time
+            metrics["inference_time"] += inference_time
+            metrics["max_latency"] = max(metrics["max_latency"], wait_time + inference_time)
+
+    def latency_metrics(self) -> dict[str, dict[str, float]]:
+        """ Get the number of requests, the mean queue wait, the mean inference time and the maximum latency in seconds, per session. """
+        with self.condition:
+            return {
+                session_id: {
+                    "requests": metrics["requests"],
+                    "mean_wait_time": metrics["wait_time"] / metrics["requests"],
+                    "mean_inference_time": metrics["inference_time"] / metrics["requests"],
+                    "max_latency": metrics["max_latency"],
+                }
+                for session_id, metrics in self.metrics.items()
+            }
+
+    def dispose(self) -> None:
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+
+
+class ModelPool:
+    """ The expensive models shared by all sessions of a process, by name. """
+
+    def __init__(self, loaders: dict[str, Callable[[], Any]]):
+        """
+        Create a new instance of the ModelPool class.
+
+        Args:
+            loaders (dict[str, Callable[[], Any]]): The function loading each model, by name.
+        """
+        self.models = {name: SharedModel(name, load) for name, load in loaders.items()}
+
+    def get(self, name: str) -> SharedModel:
+        return self.models[name]
+
+    def latency_metrics(self) -> dict[str, dict[str, dict[str, float]]]:
+        """ Get the latency metrics of every model, by model name and session. """
+        return {name: model.latency_metrics() for name, model in self.models.items()}
+
+    def dispose(self) -> None:
+        for model in self.models.values():
+            model.dispose()
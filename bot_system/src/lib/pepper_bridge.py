@@ -15,17 +15,18 @@ class PepperBridge():
     This encapsulation is needed because the qi framework runs on Python 2.7 only, while the application depends on python 3.12.
     """
 
-    def __init__(self, session):
+    def __init__(self, session, chat_url="http://10.42.0.38:4200"):
         """
         Create a new instance of the PepperBridge class.
 
         Args:
             session (qi.Session): The session object for connecting to the Pepper robot.
+            chat_url (str): The url of the chat server shown on the tablet.
         """
         self.session = session
 
         self.tablet_service = session.service("ALTabletService")
-        self.tablet_service.showWebview("http://10.42.0.38:4200")
+        self.tablet_service.showWebview(chat_url)
 
         self.animated_speech = session.service("ALAnimatedSpeech")
         self.memory = session.service("ALMemory")
@@ -72,13 +73,14 @@ class PepperBridge():
         self.is_running = False
 
     @staticmethod
-    def setup(ip, port):
+    def setup(ip, port, chat_url="http://10.42.0.38:4200"):
         """
         Set up the PepperBridge with a qi session.
 
         Args:
             ip (str): The IP address of the Pepper robot.
             port (int): The port number for connecting to the Pepper robot.
+            chat_url (str): The url of the chat server shown on the tablet.
 
         Returns:
             PepperBridge: An instance of the PepperBridge class.
@@ -91,7 +93,7 @@ class PepperBridge():
             print ("Can't connect to Naoqi at ip \"" + ip + "\" on port " + str(port) +".\n"
                     "Please check your script arguments. Run with -h option for help.")
             sys.exit(1)
-        module = PepperBridge(session)
+        module = PepperBridge(session, chat_url)
         print("VideoTransmissionModule instance created")
         return module
 
@@ -106,9 +108,13 @@ if __name__ == "__main__":
         help="Parent broker port. The port NAOqi is listening to",
         dest="port",
         type="int")
+    parser.add_option("--chat-url",
+        help="The url of the chat server shown on the tablet",
+        dest="chat_url")
     parser.set_defaults(
         ip="pepper.local",
-        port=9559)
+        port=9559,
+        chat_url="http://10.42.0.38:4200")
 
     (opts, args_) = parser.parse_args()
     pepper_ip   = opts.ip
@@ -116,7 +122,7 @@ if __name__ == "__main__":
 
     pepperBridge = None
     try:
-        pepperBridge = PepperBridge.setup(pepper_ip, pepper_port)
+        pepperBridge = PepperBridge.setup(pepper_ip, pepper_port, opts.chat_url)
         pepperBridge.start()
         while True:
             time.sleep(1)
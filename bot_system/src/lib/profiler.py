@@ -0,0 +1,105 @@
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+from types import FrameType
+from typing import Any
+
+
+@dataclass
+class ProfileResult:
+    duration: float
+    samples: int
+    stacks: Counter = field(default_factory=Counter)
+    top_allocations: list[dict[str, Any]] = field(default_factory=list)
+
+    def collapsed(self) -> str:
+        """ The stacks in the collapsed format of flamegraph.pl and speedscope, one "thread;outer;...;inner count" line per stack. """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class SamplingProfiler:
+    """
+    A wall-clock sampling profiler of all threads of the process.
+
+    A capture samples the stack of every other thread at a fixed interval on the calling thread and stops after the given
+    duration, so nothing runs while no capture is in progress. Waiting threads are sampled too, which shows where the pipeline
+    blocks. The root of every stack is the thread name with trailing numbers removed, so the short lived handler threads
+    of one handler are merged. Optionally, the allocations during the capture are traced with tracemalloc.
+    """
+
+    def __init__(self, max_duration: float = 60.0):
+        self.max_duration = max_duration
+        self.lock = threading.Lock()
+
+    def capture(self, duration: float, interval: float = 0.01, trace_memory: bool = False, top_allocations: int = 25) -> ProfileResult:
+        """
+        Profile the process. Only one capture runs at a time.
+
+        Args:
+            duration (float): The capture time in seconds, at most max_duration.
+            interval (float, optional): The sampling interval in seconds. Defaults to 0.01.
+            trace_memory (bool, optional): Whether to trace the allocations during the capture. Slows down the process while capturing. Defaults to False.
+            top_allocations (int, optional): The number of source lines with the largest allocations to report. Defaults to 25.
+
+        Returns:
+            ProfileResult: The sampled stacks and the top allocations.
+
+        Raises:
+            RuntimeError: If a capture is already in progress.
+        """
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already being captured")
+        try:
+            duration = min(max(duration, 0.0), self.max_duration)
+            started_tracing = trace_memory and not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(16)
+            try:
+                result = self._sample(duration, interval)
+                if trace_memory:
+                    result.top_allocations = self._top_allocations(tracemalloc.take_snapshot(), top_allocations)
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+            return result
+        finally:
+            self.lock.release()
+
+    def _sample(self, duration: float, interval: float) -> ProfileResult:
+        result = ProfileResult(duration, 0)
+        own_thread = threading.get_ident()
+        start = time.perf_counter()
+        next_sample = start
+        while next_sample - start < duration:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread:
+                    result.stacks[self._collapse(names.get(thread_id, str(thread_id)), frame)] += 1
+            result.samples += 1
+            next_sample += interval
+            time.sleep(max(next_sample - time.perf_counter(), 0))
+        result.duration = time.perf_counter() - start
+        return result
+
+    @staticmethod
+    def _collapse(thread_name: str, frame: FrameType | None) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            # Without line numbers, so the samples of a function merge into one flame graph node
+            frames.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]})")
+            frame = frame.f_back
+        # Thread-12 (handle) and Thread-13 (handle) are the same kind of thread
+        root = " ".join(part for part in thread_name.replace("-", " ").split() if not part.isdigit())
+        return ";".join([root or "thread", *reversed(frames)]).replace(" ", "_")
+
+    @staticmethod
+    def _top_allocations(snapshot: tracemalloc.Snapshot, limit: int) -> list[dict[str, Any]]:
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)))
+        return [
+            {"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", "size": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:limit]
+        ]
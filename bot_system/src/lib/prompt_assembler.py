@@ -0,0 +1,155 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable
+
+import tiktoken
+
+
+class ConversationMemory:
+    """
+    Bounded conversation memory: a sliding window of the most recent turns plus a running summary of everything older.
+
+    Turns leaving the window are folded into the summary on a background thread, so the compaction never delays a response.
+    """
+
+    def __init__(self, summarize: Callable[[str, list[tuple[str, str]]], str], window_turns: int = 4):
+        """
+        Create a new instance of the ConversationMemory class.
+
+        Args:
+            summarize (Callable[[str, list[tuple[str, str]]], str]): Folds (question, answer) turns into the previous summary and returns the new summary.
+            window_turns (int, optional): The number of recent turns kept verbatim. Defaults to 4.
+        """
+        self.summarize = summarize
+        self.turns: deque[tuple[str, str]] = deque()
+        self.window_turns = window_turns
+        self.summary = ""
+        self.pending: list[tuple[str, str]] = []
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ConversationMemory")
+
+    def add_turn(self, question: str, answer: str) -> Future | None:
+        """
+        Add a turn and schedule the compaction of turns that left the window.
+
+        Args:
+            question (str): The question of the user.
+            answer (str): The answer of the agent.
+
+        Returns:
+            Future | None: The scheduled compaction, None if nothing left the window.
+        """
+        with self.lock:
+            self.turns.append((question, answer))
+            while len(self.turns) > self.window_turns:
+                self.pending.append(self.turns.popleft())
+            if not self.pending:
+                return None
+        return self.executor.submit(self._compact)
+
+    def _compact(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            summary = self.summary
+        if not pending:
+            return
+
+        try:
+            summary = self.summarize(summary, pending)
+        except Exception as e:
+            print(f"Error in {type(self).__name__} while summarizing {len(pending)} turns: ", e)
+            return
+
+        with self.lock:
+            self.summary = summary
+
+    def snapshot(self) -> tuple[str, list[tuple[str, str]]]:
+        """ Get the current summary and the recent turns, oldest first. """
+        with self.lock:
+            return self.summary, list(self.turns)
+
+    def dispose(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PromptAssembler:
+    """ Fits the prompt sections into per-section token budgets and reports the token count of every section. """
+
+    def __init__(self, budgets: dict[str, int], model: str = "gpt-4o"):
+        """
+        Create a new instance of the PromptAssembler class.
+
+        Args:
+            budgets (dict[str, int]): The token budget per section. Sections without a budget are not truncated.
+            model (str, optional): The model whose tokenizer is used for counting. Defaults to "gpt-4o".
+        """
+        self.budgets = budgets
+        self.encoding = tiktoken.encoding_for_model(model)
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def truncate(self, text: str, budget: int) -> str:
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= budget:
+            return text
+        return self.encoding.decode(tokens[:budget])
+
+    def fit_items(self, items: list[str], budget: int) -> list[str]:
+        """
+        Take whole items in the given order until the budget is used up.
+
+        Args:
+            items (list[str]): The items ordered by priority.
+            budget (int): The token budget.
+
+        Returns:
+            list[str]: The items that fit.
+        """
+        fitted = []
+        for item in items:
+            tokens = self.count(item)
+            if tokens > budget:
+                break
+            fitted.append(item)
+            budget -= tokens
+        return fitted
+
+    def history(self, summary: str, turns: list[tuple[str, str]], budget: int) -> str:
+        """
+        Render the conversation history, keeping the newest turns and giving the running summary at most a third of the budget.
+
+        Args:
+            summary (str): The summary of older turns.
+            turns (list[tuple[str, str]]): The recent turns, oldest first.
+            budget (int): The token budget.
+
+        Returns:
+            str: The history section.
+        """
+        summary = self.truncate(summary, budget // 3) if summary else ""
+        lines = [f"Gast: {question}\nZEKI-GPT: {answer}" for question, answer in reversed(turns)]
+        lines = self.fit_items(lines, budget - self.count(summary))
+        if summary:
+            lines.append(f"Zusammenfassung des bisherigen Gesprächs: {summary}")
+        return "\n".join(reversed(lines))
+
+    def assemble(self, sections: dict[str, str | list[str]]) -> tuple[dict[str, str], dict[str, int]]:
+        """
+        Fit all sections into their budgets. List sections are cut at item boundaries, text sections at token boundaries.
+
+        Args:
+            sections (dict[str, str | list[str]]): The sections by name, list items ordered by priority.
+
+        Returns:
+            tuple[dict[str, str], dict[str, int]]: The fitted sections and the token count per section.
+        """
+        fitted: dict[str, str] = {}
+        for name, section in sections.items():
+            budget = self.budgets.get(name)
+            if isinstance(section, list):
+                fitted[name] = "\n".join(section if budget is None else self.fit_items(section, budget))
+            else:
+                fitted[name] = section if budget is None else self.truncate(section, budget)
+        return fitted, {name: self.count(text) for name, text in fitted.items()}
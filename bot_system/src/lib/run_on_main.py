@@ -1,23 +1,106 @@
-import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Hashable
 
 
 class RunOnMainThread:
-    """ A utility class for scheduling and executing functions on the main thread. """
+    """
+    A utility class for scheduling and executing functions on the main thread.
 
-    callback_queue = queue.Queue()
+    Callbacks scheduled with a key replace the pending callback of the same key and run at most max_rate times per second
+    per key, so updates produced faster than the main thread draws them are coalesced instead of queued.
+    """
+
+    condition = threading.Condition()
+    callback_queue: deque[Callable[[], Any]] = deque()
+    keyed_callbacks: OrderedDict[Hashable, Callable[[], Any]] = OrderedDict()
+    min_intervals: dict[Hashable, float] = {}
+    last_runs: dict[Hashable, float] = {}
+    counts = {"scheduled": 0, "replaced": 0, "executed": 0, "failed": 0, "max_depth": 0}
 
     @staticmethod
-    def schedule(func_to_call_from_main_thread):
+    def schedule(func_to_call_from_main_thread, key: Hashable | None = None, max_rate: float | None = None):
         """
         Schedule a function to be called from the main thread.
 
         Args:
             func_to_call_from_main_thread (callable): The function to be called from the main thread.
+            key (Hashable | None, optional): Replaces the pending function scheduled with the same key. Defaults to None, queueing every function.
+            max_rate (float | None, optional): The maximum number of calls per second of the functions of the key. Defaults to None, unlimited.
+        """
+        with RunOnMainThread.condition:
+            if key is None:
+                RunOnMainThread.callback_queue.append(func_to_call_from_main_thread)
+            else:
+                if key in RunOnMainThread.keyed_callbacks:
+                    RunOnMainThread.counts["replaced"] += 1
+                RunOnMainThread.keyed_callbacks[key] = func_to_call_from_main_thread
+                if max_rate is not None:
+                    RunOnMainThread.min_intervals[key] = 1.0 / max_rate
+            RunOnMainThread.counts["scheduled"] += 1
+            RunOnMainThread.counts["max_depth"] = max(RunOnMainThread.counts["max_depth"], RunOnMainThread._depth())
+            RunOnMainThread.condition.notify()
+
+    @staticmethod
+    def fetch_and_execute_callback(max_callbacks: int = 16, timeout: float | None = None) -> int:
+        """
+        Waits for due functions and executes up to max_callbacks of them. This should be called from the main thread.
+
+        Args:
+            max_callbacks (int, optional): The maximum number of functions executed per call. Defaults to 16.
+            timeout (float | None, optional): The maximum time in seconds to wait. Defaults to None, waiting until a function is due.
+
+        Returns:
+            int: The number of executed functions.
         """
-        RunOnMainThread.callback_queue.put(func_to_call_from_main_thread)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with RunOnMainThread.condition:
+            while True:
+                callbacks, wait = RunOnMainThread._take_due(max_callbacks)
+                if callbacks:
+                    break
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return 0
+                    wait = min(wait, remaining) if wait is not None else remaining
+                RunOnMainThread.condition.wait(wait)
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                RunOnMainThread.counts["failed"] += 1
+                print(f"Error in main thread callback {callback}: ", e)
+        with RunOnMainThread.condition:
+            RunOnMainThread.counts["executed"] += len(callbacks)
+        return len(callbacks)
+
+    @staticmethod
+    def _take_due(max_callbacks: int) -> tuple[list[Callable[[], Any]], float | None]:
+        """ Take the queued functions and the keyed functions whose rate allows a call, and the time until the next keyed function is due. Requires the condition. """
+        callbacks = []
+        while RunOnMainThread.callback_queue and len(callbacks) < max_callbacks:
+            callbacks.append(RunOnMainThread.callback_queue.popleft())
+
+        now = time.monotonic()
+        wait = None
+        for key in list(RunOnMainThread.keyed_callbacks):
+            due = RunOnMainThread.last_runs.get(key, float("-inf")) + RunOnMainThread.min_intervals.get(key, 0.0)
+            if due > now:
+                wait = min(wait, due - now) if wait is not None else due - now
+            elif len(callbacks) < max_callbacks:
+                callbacks.append(RunOnMainThread.keyed_callbacks.pop(key))
+                RunOnMainThread.last_runs[key] = now
+        return callbacks, wait
+
+    @staticmethod
+    def _depth() -> int:
+        return len(RunOnMainThread.callback_queue) + len(RunOnMainThread.keyed_callbacks)
 
     @staticmethod
-    def fetch_and_execute_callback():
-        """ Fetches a function from the callback queue and executes it. This should be called from the main thread. """
-        callback = RunOnMainThread.callback_queue.get()
-        callback()
+    def stats() -> dict[str, int]:
+        """ Get the queue depth, the pending keyed functions and the number of scheduled, replaced, executed and failed functions and the maximum depth so far. """
+        with RunOnMainThread.condition:
+            return {"depth": RunOnMainThread._depth(), "keyed": len(RunOnMainThread.keyed_callbacks), **RunOnMainThread.counts}
@@ -0,0 +1,194 @@
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Callable, Sequence
+
+import numpy as np
+
+from bot_system.src.lib.core import ChatAgent
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    embedding: np.ndarray
+    emotion_signature: tuple
+    response: dict[str, Any]
+    created: float
+    latency: float
+
+
+class SemanticCacheAgent(ChatAgent):
+    """
+    A ChatAgent decorator that reuses answers to semantically similar questions. Extends the ChatAgent class.
+
+    Questions are normalized and embedded. A cached answer is reused if its question is above the similarity threshold and
+    the emotion context of both prompts is compatible. Entries expire after ttl seconds and the least recently used entry is
+    evicted once max_entries is reached.
+    """
+
+    def __init__(
+        self,
+        agent: ChatAgent,
+        embed: Callable[[str], Sequence[float]],
+        similarity_threshold: float = 0.93,
+        ttl: float = 6 * 60 * 60,
+        max_entries: int = 512,
+        min_words: int = 3,
+        emotion_keys: tuple[str, ...] = ("facial_expressions", "speech_emotions"),
+    ):
+        """
+        Create a new instance of the SemanticCacheAgent class.
+
+        Args:
+            agent (ChatAgent): The agent answering cache misses.
+            embed (Callable[[str], Sequence[float]]): The function embedding a normalized question.
+            similarity_threshold (float, optional): The minimal cosine similarity for a hit. Defaults to 0.93.
+            ttl (float, optional): The time in seconds after which an entry expires. Defaults to six hours.
+            max_entries (int, optional): The maximum number of cached answers. Defaults to 512.
+            min_words (int, optional): Questions with fewer words are likely follow-ups that depend on the conversation and are not cached. Defaults to 3.
+            emotion_keys (tuple[str, ...], optional): The prompt keys holding the emotion summaries. Defaults to ("facial_expressions", "speech_emotions").
+        """
+        super().__init__()
+        self.agent = agent
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_words = min_words
+        self.emotion_keys = emotion_keys
+
+        self.lock = Lock()
+        self.entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self.exact_index: dict[tuple[str, tuple], int] = {}
+        self.next_id = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.hit_latency = 0.0
+        self.saved_latency = 0.0
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+    def emotion_signature(self, prompt: dict[str, str]) -> tuple:
+        """
+        The part of the emotion context that must match for an answer to be reused: the set of detected emotion labels per summary, ignoring the confidence wording.
+
+        Args:
+            prompt (dict[str, str]): The prompt.
+
+        Returns:
+            tuple: A hashable signature.
+        """
+        return tuple(frozenset(re.findall(r"\)\s*(\w+)", prompt.get(key, ""))) for key in self.emotion_keys)
+
+    # Override
+    def prompt(self, prompt):
+        return self._answer(prompt, remember=True)
+
+    # Override
+    def draft(self, prompt):
+        return self._answer(prompt, remember=False)
+
+    def _answer(self, prompt: dict[str, str], remember: bool) -> dict[str, Any]:
+        start = time.time()
+        question = self.normalize(prompt["question"])
+        signature = self.emotion_signature(prompt)
+
+        if len(question.split()) < self.min_words:
+            return self.agent.prompt(prompt) if remember else self.agent.draft(prompt)
+
+        entry = self._lookup_exact(question, signature)
+        embedding = None
+        if entry is None:
+            embedding = self._embed(question)
+            entry = self._lookup_similar(embedding, signature)
+
+        if entry is not None:
+            latency = time.time() - start
+            with self.lock:
+                self.hits += 1
+                self.hit_latency += latency
+                self.saved_latency += max(entry.latency - latency, 0)
+            print(f"Answer cache hit for '{question}' (cached question '{entry.question}') in {latency * 1000:.1f}ms")
+            if remember:
+                self.agent.remember(prompt, entry.response)
+            return dict(entry.response)
+
+        response = self.agent.prompt(prompt) if remember else self.agent.draft(prompt)
+        with self.lock:
+            self.misses += 1
+        if "answer" in response and embedding is not None:
+            self._store(CachedAnswer(question, embedding, signature, dict(response), time.time(), time.time() - start))
+        return response
+
+    # Override
+    def remember(self, prompt, response):
+        self.agent.remember(prompt, response)
+
+    def _embed(self, question: str) -> np.ndarray:
+        embedding = np.asarray(self.embed(question), dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+
+    def _lookup_exact(self, question: str, signature: tuple) -> CachedAnswer | None:
+        with self.lock:
+            self._expire()
+            entry_id = self.exact_index.get((question, signature))
+            if entry_id is None:
+                return None
+            self.entries.move_to_end(entry_id)
+            return self.entries[entry_id]
+
+    def _lookup_similar(self, embedding: np.ndarray, signature: tuple) -> CachedAnswer | None:
+        with self.lock:
+            self._expire()
+            if not self.entries:
+                return None
+
+            ids = list(self.entries.keys())
+            similarities = np.stack([entry.embedding for entry in self.entries.values()]) @ embedding
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.similarity_threshold:
+                    break
+                entry = self.entries[ids[index]]
+                if entry.emotion_signature == signature:
+                    self.entries.move_to_end(ids[index])
+                    return entry
+            return None
+
+    def _store(self, entry: CachedAnswer):
+        with self.lock:
+            self.exact_index[(entry.question, entry.emotion_signature)] = self.next_id
+            self.entries[self.next_id] = entry
+            self.next_id += 1
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def _expire(self):
+        now = time.time()
+        for entry_id in [entry_id for entry_id, entry in self.entries.items() if now - entry.created > self.ttl]:
+            self._remove(entry_id)
+
+    def _remove(self, entry_id: int):
+        entry = self.entries.pop(entry_id)
+        key = (entry.question, entry.emotion_signature)
+        if self.exact_index.get(key) == entry_id:
+            del self.exact_index[key]
+
+    def metrics(self) -> dict[str, float]:
+        """ Get the cache metrics: entries, hits, misses, hit rate, mean hit latency and total saved latency in seconds. """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "mean_hit_latency": self.hit_latency / self.hits if self.hits else 0.0,
+                "saved_latency": self.saved_latency,
+            }
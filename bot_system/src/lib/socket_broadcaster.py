@@ -0,0 +1,110 @@
+import time
+from threading import Condition, Thread
+from typing import Any
+
+from flask_socketio import SocketIO
+
+from bot_system.src.lib.core import metrics
+
+
+class SocketIOBroadcaster:
+    """
+    Outbound Socket.IO broadcaster with its own send loop, so that slow clients never block the threads producing events.
+
+    Conflated events only send their latest value and only if it changed since the last send. Other events are queued and a
+    burst of them is sent as a single "<event>_batch" frame. Every event type is limited to a maximum send rate.
+    """
+
+    def __init__(self, socketio: SocketIO, max_rates: dict[str, float] | None = None, default_max_rate: float | None = None):
+        """
+        Create a new instance of the SocketIOBroadcaster class.
+
+        Args:
+            socketio (SocketIO): The Socket.IO server to emit on.
+            max_rates (dict[str, float] | None, optional): The maximum number of frames per second per event type. Defaults to None.
+            default_max_rate (float | None, optional): The maximum rate of event types without an entry in max_rates. None means unlimited. Defaults to None.
+        """
+        self.socketio = socketio
+        self.max_rates = max_rates if max_rates is not None else {}
+        self.default_max_rate = default_max_rate
+
+        self.condition = Condition()
+        self.pending: dict[str, list[Any]] = {}
+        self.conflated: set[str] = set()
+        self.last_sent: dict[str, Any] = {}
+        self.next_send_time: dict[str, float] = {}
+        self.sent_frames: dict[str, int] = {}
+        self.skipped_updates: dict[str, int] = {}
+        self.is_running = True
+
+        self.send_thread = Thread(target=self._send_loop, daemon=True)
+        self.send_thread.start()
+
+    def publish(self, event: str, payload: Any, conflate: bool = False) -> None:
+        """
+        Queue an event for broadcasting. Never blocks on the network.
+
+        Args:
+            event (str): The event name.
+            payload (Any): The JSON serializable payload.
+            conflate (bool, optional): Whether only the latest payload of this event matters. Defaults to False.
+        """
+        with self.condition:
+            if conflate:
+                self.conflated.add(event)
+                is_unchanged = event in self.last_sent and payload == self.last_sent[event]
+                if is_unchanged or event in self.pending:
+                    self.skipped_updates[event] = self.skipped_updates.get(event, 0) + 1
+                if is_unchanged:
+                    self.pending.pop(event, None)
+                    return
+                self.pending[event] = [payload]
+            else:
+                self.pending.setdefault(event, []).append(payload)
+            self.condition.notify()
+
+    def _send_loop(self):
+        while True:
+            with self.condition:
+                due = self._take_due_events()
+                while self.is_running and not due:
+                    self.condition.wait(self._time_until_next_due())
+                    due = self._take_due_events()
+                if not due:
+                    return
+
+            for event, payloads in due.items():
+                try:
+                    if event in self.conflated or len(payloads) == 1:
+                        self.socketio.emit(event, payloads[-1])
+                    else:
+                        self.socketio.emit(f"{event}_batch", payloads)
+                    metrics.inc("socketio_emits_total", event=event)
+                except Exception as e:
+                    print(f"Error in {type(self).__name__} while sending {event}: ", e)
+
+    def _take_due_events(self) -> dict[str, list[Any]]:
+        now = time.time()
+        due = {event: payloads for event, payloads in self.pending.items() if self.next_send_time.get(event, 0) <= now}
+        for event, payloads in due.items():
+            del self.pending[event]
+            self.last_sent[event] = payloads[-1]
+            self.sent_frames[event] = self.sent_frames.get(event, 0) + 1
+            max_rate = self.max_rates.get(event, self.default_max_rate)
+            self.next_send_time[event] = now + 1 / max_rate if max_rate else 0
+        return due
+
+    def _time_until_next_due(self) -> float | None:
+        if not self.pending:
+            return None
+        return max(min(self.next_send_time.get(event, 0) for event in self.pending) - time.time(), 0)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """ Get the number of sent frames and of unchanged or superseded updates that were not sent, per event. """
+        with self.condition:
+            return {"sent_frames": dict(self.sent_frames), "skipped_updates": dict(self.skipped_updates)}
+
+    def dispose(self) -> None:
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
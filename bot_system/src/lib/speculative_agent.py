@@ -0,0 +1,131 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any
+
+from bot_system.src.lib.core import ChatAgent
+
+
+@dataclass
+class Speculation:
+    prompt: dict[str, str]
+    started: float
+    future: Future | None = None
+    finished: float | None = None
+
+
+class SpeculativeAgent(ChatAgent):
+    """
+    A ChatAgent decorator that starts answering a question before all of its inputs arrived. Extends the ChatAgent class.
+
+    speculate drafts an answer to a preliminary prompt in the background. When the final prompt of the same question
+    arrives, the draft is used if the match keys of both prompts are equal, otherwise the final prompt is materially
+    different, the draft is cancelled, or discarded if it already runs, and the final prompt is answered anew. Drafts do
+    not enter the conversation memory until the answer is remembered.
+    """
+
+    def __init__(self, agent: ChatAgent, match_keys: tuple[str, ...] = ("facial_expressions", "speech_emotions")):
+        """
+        Create a new instance of the SpeculativeAgent class.
+
+        Args:
+            agent (ChatAgent): The agent answering the prompts.
+            match_keys (tuple[str, ...], optional): The prompt keys that must be equal for a draft to be used. Defaults to ("facial_expressions", "speech_emotions").
+        """
+        super().__init__()
+        self.agent = agent
+        self.match_keys = match_keys
+        # A discarded draft may still run while the final prompt is answered
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="speculation")
+        self.lock = Lock()
+        self.speculation: Speculation | None = None
+
+        self.speculations = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+        self.wasted_latency = 0.0
+
+    def speculate(self, prompt: dict[str, str]) -> None:
+        """ Start drafting an answer to a preliminary prompt, replacing an unused previous draft. """
+        with self.lock:
+            self._discard()
+            speculation = Speculation(prompt, time.time())
+            speculation.future = self.executor.submit(self._draft, speculation)
+            self.speculation = speculation
+            self.speculations += 1
+
+    def _draft(self, speculation: Speculation) -> dict[str, Any]:
+        try:
+            return self.agent.draft(speculation.prompt)
+        finally:
+            speculation.finished = time.time()
+
+    # Override
+    def prompt(self, prompt):
+        response = self.draft(prompt)
+        self.remember(prompt, response)
+        return response
+
+    # Override
+    def draft(self, prompt):
+        arrived = time.time()
+        with self.lock:
+            speculation = self.speculation
+            self.speculation = None
+            is_hit = speculation is not None and self._matches(speculation.prompt, prompt)
+            if speculation is not None and not is_hit:
+                self._discard(speculation)
+
+        if speculation is None or not is_hit:
+            return self.agent.draft(prompt)
+
+        try:
+            response = speculation.future.result()  # type: ignore
+        except Exception as e:
+            print(f"Speculative answer failed, prompting again.\n{e}")
+            with self.lock:
+                self.misses += 1
+            return self.agent.draft(prompt)
+
+        with self.lock:
+            self.hits += 1
+            self.saved_latency += min(arrived, speculation.finished or arrived) - speculation.started
+        return response
+
+    # Override
+    def remember(self, prompt, response):
+        self.agent.remember(prompt, response)
+
+    def _matches(self, speculative_prompt: dict[str, str], prompt: dict[str, str]) -> bool:
+        return speculative_prompt.get("question") == prompt.get("question") and all(speculative_prompt.get(key) == prompt.get(key) for key in self.match_keys)
+
+    def _discard(self, speculation: Speculation | None = None) -> None:
+        """ Cancel a draft that is not used, or let it run to completion unused if it already started. Requires the lock. """
+        speculation = speculation if speculation is not None else self.speculation
+        if speculation is None:
+            return
+        if speculation is self.speculation:
+            self.speculation = None
+        self.misses += 1
+        if speculation.future is not None and not speculation.future.cancel():
+            self.wasted_latency += (speculation.finished or time.time()) - speculation.started
+
+    def metrics(self) -> dict[str, float]:
+        """ Get the speculation metrics: started drafts, hits, misses, hit rate, total saved and wasted latency in seconds. """
+        with self.lock:
+            decided = self.hits + self.misses
+            return {
+                "speculations": self.speculations,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / decided if decided else 0.0,
+                "saved_latency": self.saved_latency,
+                "wasted_latency": self.wasted_latency,
+            }
+
+    def dispose(self) -> None:
+        with self.lock:
+            self._discard()
+        self.executor.shutdown(wait=False, cancel_futures=True)
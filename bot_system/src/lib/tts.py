@@ -0,0 +1,234 @@
+import queue
+import re
+import time
+from threading import Thread
+from typing import Callable, Iterator
+
+import pyaudio
+
+from bot_system.src.lib.config import CHANNELS, FORMAT, TTS_MODEL, TTS_RATE, TTS_SPEED, TTS_VOICE, openai_client
+from bot_system.src.lib.core import metrics
+
+SAMPLE_WIDTH = 2  # bytes per sample for paInt16
+
+
+class TTSBackend:
+    """ Base class for text-to-speech backends producing raw 16 bit mono PCM. """
+
+    sample_rate: int = TTS_RATE
+
+    def synthesize(self, text: str) -> Iterator[bytes]:
+        """
+        Synthesize the given text.
+
+        Args:
+            text (str): The text to synthesize.
+
+        Returns:
+            Iterator[bytes]: PCM chunks, yielded as soon as they are available.
+        """
+        raise NotImplementedError
+
+    def cache_key(self) -> tuple:
+        """ The parameters (besides the text) that determine the synthesized audio. """
+        return (type(self).__name__, self.sample_rate)
+
+
+class OpenAITTSBackend(TTSBackend):
+    """ Streams PCM from the OpenAI speech endpoint while it is still being synthesized. """
+
+    def __init__(self, model: str = TTS_MODEL, voice: str = TTS_VOICE, speed: float = TTS_SPEED, chunk_size: int = 4096):
+        self.model = model
+        self.voice = voice
+        self.speed = speed
+        self.chunk_size = chunk_size
+
+    def synthesize(self, text):
+        start = time.perf_counter()
+        with openai_client.audio.speech.with_streaming_response.create(
+            model=self.model,
+            voice=self.voice,  # type: ignore
+            speed=self.speed,
+            input=text,
+            response_format="pcm",
+        ) as response:
+            is_first_chunk = True
+            for chunk in response.iter_bytes(self.chunk_size):
+                if is_first_chunk:
+                    # The latency until the speech can start
+                    metrics.observe("openai_request_seconds", time.perf_counter() - start, operation="tts")
+                    is_first_chunk = False
+                yield chunk
+
+    def cache_key(self):
+        return (self.model, self.voice, self.speed, "pcm", self.sample_rate)
+
+
+class OfflineTTSBackend(TTSBackend):
+    """ Offline stand-in that prints the text and yields silence of roughly the spoken duration. For testing without network access or costs. """
+
+    def __init__(self, words_per_second: float = 2.5, chunk_duration: float = 0.1):
+        self.words_per_second = words_per_second
+        self.chunk_duration = chunk_duration
+
+    def synthesize(self, text):
+        print(f"Offline TTS: {text}")
+        duration = max(len(text.split()), 1) / self.words_per_second
+        chunk = bytes(int(self.sample_rate * self.chunk_duration) * SAMPLE_WIDTH)
+        for _ in range(max(int(duration / self.chunk_duration), 1)):
+            yield chunk
+
+    def cache_key(self):
+        return ("offline", self.words_per_second, self.sample_rate)
+
+
+class AudioOutput:
+    """ A persistent audio output device. The stream is opened once and only started and stopped between utterances. """
+
+    def __init__(self, rate: int = TTS_RATE, frames_per_buffer: int = 1024):
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(
+            format=FORMAT,
+            channels=CHANNELS,
+            rate=rate,
+            output=True,
+            frames_per_buffer=frames_per_buffer,
+            start=False,
+        )
+
+    def write(self, pcm: bytes) -> None:
+        """ Write PCM to the device, blocks while the device buffer is full. """
+        if not self.stream.is_active():
+            self.stream.start_stream()
+        self.stream.write(pcm)
+
+    def drain(self) -> None:
+        """ Block until the last buffered sample has been played. """
+        if self.stream.is_active():
+            self.stream.stop_stream()
+
+    def dispose(self) -> None:
+        self.stream.close()
+        self.audio.terminate()
+
+
+class _UtteranceEnd:
+    def __init__(self, on_done: Callable[[], None] | None):
+        self.on_done = on_done
+
+
+class StreamingSpeaker:
+    """
+    Pipelined text-to-speech playback.
+
+    Answers are split into sentences. A synthesis thread streams the PCM of each sentence into a bounded chunk queue while a
+    playback thread writes the chunks to the audio output. Playback therefore starts with the first chunk and the synthesis
+    of the next sentence overlaps with the playback of the current one.
+    """
+
+    def __init__(self, backend: TTSBackend, output: AudioOutput | None = None, max_buffered_chunks: int = 256, edge_trim: float = 0.05):
+        """
+        Create a new instance of the StreamingSpeaker class.
+
+        Args:
+            backend (TTSBackend): The backend used for synthesis.
+            output (AudioOutput | None, optional): The output device. Defaults to a new AudioOutput at the backend sample rate.
+            max_buffered_chunks (int, optional): The maximum number of synthesized chunks waiting for playback. Defaults to 256.
+            edge_trim (float, optional): Seconds cut from the start and end of each utterance to remove clicks. Defaults to 0.05.
+        """
+        self.backend = backend
+        self.output = output if output is not None else AudioOutput(backend.sample_rate)
+        self.edge_trim_bytes = int(backend.sample_rate * edge_trim) * SAMPLE_WIDTH
+
+        self.utterance_queue: queue.Queue[tuple[str, Callable[[], None] | None] | None] = queue.Queue()
+        self.chunk_queue: queue.Queue[bytes | _UtteranceEnd | None] = queue.Queue(maxsize=max_buffered_chunks)
+        self.is_running = True
+
+        self.synthesis_thread = Thread(target=self._synthesize_loop, daemon=True)
+        self.playback_thread = Thread(target=self._playback_loop, daemon=True)
+        self.synthesis_thread.start()
+        self.playback_thread.start()
+
+    def say(self, text: str, on_done: Callable[[], None] | None = None) -> None:
+        """
+        Queue a text for playback.
+
+        Args:
+            text (str): The text to speak.
+            on_done (Callable[[], None] | None, optional): Called once the last sample of this text has been played.
+        """
+        self.utterance_queue.put((text, on_done))
+
+    @staticmethod
+    def split_sentences(text: str) -> list[str]:
+        return [sentence for sentence in re.split(r"(?<=[.!?:;])\s+", text.strip()) if sentence]
+
+    def _synthesize_loop(self):
+        while self.is_running:
+            utterance = self.utterance_queue.get()
+            if utterance is None:
+                break
+
+            text, on_done = utterance
+            start = time.time()
+            first_chunk = True
+            sentences = self.split_sentences(text)
+            for index, sentence in enumerate(sentences):
+                try:
+                    # Only the edges of the utterance are trimmed, the sentence boundaries within it keep their onsets and endings
+                    chunks = self._sample_aligned(self.backend.synthesize(sentence))
+                    for chunk in self._trimmed(chunks, trim_start=index == 0, trim_end=index == len(sentences) - 1):
+                        if first_chunk:
+                            print(f"TTS: first audio after {time.time() - start:.3f}s")
+                            first_chunk = False
+                        self.chunk_queue.put(chunk)
+                except Exception as e:
+                    print(f"Error in TTS backend {type(self.backend).__name__}: ", e)
+            self.chunk_queue.put(_UtteranceEnd(on_done))
+
+        self.chunk_queue.put(None)
+
+    def _playback_loop(self):
+        while True:
+            chunk = self.chunk_queue.get()
+            if chunk is None:
+                break
+
+            if isinstance(chunk, _UtteranceEnd):
+                self.output.drain()
+                if chunk.on_done is not None:
+                    chunk.on_done()
+            else:
+                self.output.write(chunk)
+
+    def _sample_aligned(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """ Regroups chunks so that no sample is split between two writes. """
+        rest = b""
+        for chunk in chunks:
+            chunk = rest + chunk
+            cut = len(chunk) - len(chunk) % SAMPLE_WIDTH
+            rest = chunk[cut:]
+            if cut:
+                yield chunk[:cut]
+
+    def _trimmed(self, chunks: Iterator[bytes], trim_start: bool = True, trim_end: bool = True) -> Iterator[bytes]:
+        """ Drops edge_trim_bytes from the start of the stream and holds back the same amount to drop it from the end. """
+        skip = self.edge_trim_bytes if trim_start else 0
+        held_back = self.edge_trim_bytes if trim_end else 0
+        tail = b""
+        for chunk in chunks:
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk = chunk[dropped:]
+                skip -= dropped
+            chunk = tail + chunk
+            cut = max(len(chunk) - held_back, 0)
+            tail = chunk[cut:]
+            if cut:
+                yield chunk[:cut]
+
+    def dispose(self) -> None:
+        self.is_running = False
+        self.utterance_queue.put(None)
+        self.playback_thread.join(timeout=5)
+        self.output.dispose()
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import mmap
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+from threading import Lock, Thread
+from typing import Iterable, Iterator
+
+from bot_system.src.lib.tts import OpenAITTSBackend, StreamingSpeaker, TTSBackend
+
+
+class TTSCache:
+    """
+    A content-addressed disk cache for synthesized PCM.
+
+    Every entry is a single file named after the hash of the text and the synthesis parameters. Entries are evicted in
+    least-recently-used order once the total size exceeds max_bytes. Hits are served from a memory-mapped file.
+    """
+
+    def __init__(self, directory: str = "bot_system/tts_cache", max_bytes: int = 256 * 1024 * 1024):
+        """
+        Create a new instance of the TTSCache class.
+
+        Args:
+            directory (str, optional): The directory to store the audio files in. Defaults to "bot_system/tts_cache".
+            max_bytes (int, optional): The maximum total size of all cached files. Defaults to 256 MB.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._load_entries()
+
+    def _load_entries(self):
+        files = [file for file in os.listdir(self.directory) if file.endswith(".pcm")]
+        files.sort(key=lambda file: os.path.getmtime(self._path(file[:-4])))
+        for file in files:
+            size = os.path.getsize(self._path(file[:-4]))
+            self.entries[file[:-4]] = size
+            self.total_bytes += size
+        self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".pcm")
+
+    @staticmethod
+    def key(text: str, parameters: tuple) -> str:
+        """
+        Compute the cache key for a text.
+
+        Args:
+            text (str): The synthesized text.
+            parameters (tuple): The synthesis parameters, e.g. voice, speed and format.
+
+        Returns:
+            str: The hex digest identifying the audio.
+        """
+        return hashlib.sha256(json.dumps([" ".join(text.split()), *parameters]).encode("utf-8")).hexdigest()
+
+    def __contains__(self, key: str) -> bool:
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key: str) -> mmap.mmap | None:
+        """
+        Get the cached audio for a key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            mmap.mmap | None: A read-only memory map of the PCM, or None on a cache miss. The caller closes the map.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        try:
+            with open(self._path(key), "rb") as file:
+                audio = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(self._path(key))
+            return audio
+        except (OSError, ValueError):
+            self._remove(key)
+            return None
+
+    def put(self, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Pass the chunks through while writing them to the cache. The entry is only committed if all chunks were consumed.
+
+        Args:
+            key (str): The cache key.
+            chunks (Iterable[bytes]): The synthesized PCM.
+
+        Returns:
+            Iterator[bytes]: The same chunks.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        committed = False
+        try:
+            with os.fdopen(fd, "wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    yield chunk
+            committed = self._commit(key, temp_path)
+        finally:
+            if not committed and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _commit(self, key: str, temp_path: str) -> bool:
+        size = os.path.getsize(temp_path)
+        if size == 0:
+            return False
+
+        os.replace(temp_path, self._path(key))
+        with self.lock:
+            self.total_bytes += size - self.entries.get(key, 0)
+            self.entries[key] = size
+            self.entries.move_to_end(key)
+        self._evict()
+        return True
+
+    def _remove(self, key: str):
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+        if os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def _evict(self):
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or len(self.entries) == 0:
+                    return
+                key = next(iter(self.entries))
+            self._remove(key)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class CachedTTSBackend(TTSBackend):
+    """ Wraps a TTSBackend and serves recurring sentences from a TTSCache. Misses are synthesized and cached while they stream. """
+
+    def __init__(self, backend: TTSBackend, cache: TTSCache | None = None, chunk_size: int = 4096):
+        """
+        Create a new instance of the CachedTTSBackend class.
+
+        Args:
+            backend (TTSBackend): The backend used on cache misses.
+            cache (TTSCache | None, optional): The cache. Defaults to a new TTSCache at the default location.
+            chunk_size (int, optional): The chunk size in bytes used when serving cache hits. Defaults to 4096.
+        """
+        self.backend = backend
+        self.cache = cache if cache is not None else TTSCache()
+        self.chunk_size = chunk_size
+        self.sample_rate = backend.sample_rate
+
+    def synthesize(self, text):
+        key = TTSCache.key(text, self.cache_key())
+        audio = self.cache.get(key)
+        if audio is None:
+            yield from self.cache.put(key, self.backend.synthesize(text))
+            return
+
+        with audio:
+            for start in range(0, len(audio), self.chunk_size):
+                yield audio[start : start + self.chunk_size]
+
+    def cache_key(self):
+        return self.backend.cache_key()
+
+    def presynthesize(self, phrases: Iterable[str]) -> int:
+        """
+        Synthesize and cache a list of phrases, e.g. at deploy time. Phrases are split into sentences the same way the StreamingSpeaker does.
+
+        Args:
+            phrases (Iterable[str]): The phrases to cache.
+
+        Returns:
+            int: The number of newly synthesized sentences.
+        """
+        synthesized = 0
+        for phrase in phrases:
+            for sentence in StreamingSpeaker.split_sentences(phrase):
+                key = TTSCache.key(sentence, self.cache_key())
+                if key in self.cache:
+                    continue
+                for _ in self.cache.put(key, self.backend.synthesize(sentence)):
+                    pass
+                synthesized += 1
+        return synthesized
+
+    def presynthesize_async(self, phrases: Iterable[str]) -> Thread:
+        """ Runs presynthesize on a separate thread. """
+        thread = Thread(target=self.presynthesize, args=(list(phrases),), daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m bot_system.src.lib.tts_cache <phrases.txt> [cache_directory]")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r") as phrase_file:
+        phrases = [line.strip() for line in phrase_file if line.strip()]
+
+    cached_backend = CachedTTSBackend(OpenAITTSBackend(), TTSCache(*sys.argv[2:3]))
+    print(f"Synthesized {cached_backend.presynthesize(phrases)} new sentences for {len(phrases)} phrases.")
@@ -5,8 +5,7 @@ from typing import Any
 from reactivex import Subject
 from bot_system.src.lib.core import InputStreamProvider, RobotController
 
-import pyaudio
-from bot_system.src.lib.config import CHANNELS, FORMAT, openai_client
+from bot_system.src.lib.tts import OpenAITTSBackend, StreamingSpeaker, TTSBackend
 
 
 class PepperController(RobotController):
@@ -16,7 +15,15 @@ class PepperController(RobotController):
     Enables animated messages to be sent to the Pepper robot.
     """
 
-    def __init__(self, audio_provider: InputStreamProvider, mute: bool = False, no_pepper: bool = False):
+    def __init__(
+        self,
+        audio_provider: InputStreamProvider,
+        mute: bool = False,
+        no_pepper: bool = False,
+        tts_backend: TTSBackend | None = None,
+        pepper_ip: str = "pepper.local",
+        chat_url: str | None = None,
+    ):
         """
         Create a new instance of the PepperController class.
 
@@ -24,11 +31,20 @@ class PepperController(RobotController):
             audio_provider (InputStreamProvider): The audio provider for bot system.
             mute (bool, optional): Whether to only print the answer to the console without playing the audio. Defaults to False.
             no_pepper (bool, optional): Whether to play the text from the llm response locally. For testing without Pepper. Defaults to False.
+            tts_backend (TTSBackend | None, optional): The backend for local text-to-speech. Defaults to OpenAITTSBackend.
+            pepper_ip (str, optional): The address of the Pepper robot the bridge connects to. Defaults to "pepper.local".
+            chat_url (str | None, optional): The url of the chat server shown on the tablet of the robot. Defaults to None, the bridge default.
         """
+        self.pepper_ip = pepper_ip
+        self.chat_url = chat_url
         self.audio_provider = audio_provider
         self.mute = mute
         self.no_pepper = no_pepper
         self.on_speech_end = Subject[bool]()
+        self.process: subprocess.Popen | None = None
+        self.speaker = None
+        if no_pepper and not mute:
+            self.speaker = StreamingSpeaker(tts_backend if tts_backend is not None else OpenAITTSBackend())
         if not no_pepper:
             self.start_pepper_bridge()
             self.listen_to_bridge_output_on_thread()
@@ -36,7 +52,8 @@ class PepperController(RobotController):
     def start_pepper_bridge(self):
         """Starts the Pepper bridge subprocess."""
         self.process = subprocess.Popen(
-            ["/usr/local/bin/python", "/Users/simonprivat/Workspace/Projects/emo-consens-bot/bot_system/pepper_bridge.py"],
+            ["/usr/local/bin/python", "/Users/simonprivat/Workspace/Projects/emo-consens-bot/bot_system/pepper_bridge.py", "--ip", self.pepper_ip]
+            + (["--chat-url", self.chat_url] if self.chat_url is not None else []),
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -51,7 +68,7 @@ class PepperController(RobotController):
 
     def listen_to_bridge_output(self):
         """Listens to the output from the Pepper bridge subprocess and handles the events."""
-        if self.process.stdout is None:
+        if self.process is None or self.process.stdout is None:
             raise ValueError("Subprocess stdout is None")
 
         while True:
@@ -71,7 +88,7 @@ class PepperController(RobotController):
         Args:
             event (str): The event to send.
         """
-        if self.process.stdin is None:
+        if self.process is None or self.process.stdin is None:
             raise ValueError("Subprocess stdin is None")
 
         self.process.stdin.write(event + "\n")
@@ -92,40 +109,22 @@ class PepperController(RobotController):
 
     def tts_locally(self, response: dict[str, Any]) -> None:
         """
-        Performs text-to-speech locally.
+        Performs text-to-speech locally. Playback starts with the first synthesized audio chunk and on_speech_end fires once the last sample has been played.
 
         Args:
             response (dict[str, Any]): The response from the bot.
         """
+        if self.speaker is None:
+            raise ValueError("Local text-to-speech is not initialized")
 
-        def tts():
-            audio = pyaudio.PyAudio()
-            stream = audio.open(
-                format=FORMAT,
-                channels=CHANNELS,
-                rate=24000,
-                output=True,
-            )
-            x = openai_client.audio.speech.create(
-                model="tts-1",
-                voice="fable",
-                speed=1.1,
-                input=response["clean_answer"] or response["answer"],
-                response_format="pcm",
-            )
-
-            y = x.read()
-            stream.write(y[int(24000 / 10) : -int(24000 / 10)])
-            stream.stop_stream()
-            stream.close()
-            audio.terminate()
-            self.on_speech_end.on_next(True)
-
-        Thread(target=tts).start()
+        self.speaker.say(response.get("clean_answer") or response["answer"], lambda: self.on_speech_end.on_next(True))
 
     # Override
     def dispose(self):
-        self.process.terminate()
+        if self.process is not None:
+            self.process.terminate()
+        if self.speaker is not None:
+            self.speaker.dispose()
         self.on_speech_end.on_completed()
         super().dispose()
 
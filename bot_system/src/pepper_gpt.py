@@ -1,20 +1,33 @@
-import csv
 from typing import Any
 
-from bot_system.src.lib.core import Prompter, PromptInputData
-from bot_system.src.lib.emotion_utilities import EmotionUtilities
+from langchain_core.vectorstores import VectorStore
+
+from bot_system.src.lib.animation_catalog import AnimationCatalog
+from bot_system.src.lib.config import BUS_FACE_PORT, BUS_FACIAL_EXPRESSION_PORT, BUS_SPEECH_EMOTION_PORT, BUS_SPEECH_PORT
+from bot_system.src.lib.core import ForkJoin, Input, InputStreamHandler, InputStreamProvider, Prompter, PromptInputData
+from bot_system.src.lib.emotion_utilities import EmotionDistributions, EmotionUtilities
+from bot_system.src.lib.load_governor import GovernorStep, LoadGovernor
+from bot_system.src.lib.message_bus import RemoteStreamProvider, StreamPublisher
+from bot_system.src.lib.message_store import MessageStore
+from bot_system.src.lib.model_pool import ModelPool
+from bot_system.src.lib.semantic_cache import SemanticCacheAgent
+from bot_system.src.lib.speculative_agent import SpeculativeAgent
+from bot_system.src.lib.tts import OfflineTTSBackend, OpenAITTSBackend
+from bot_system.src.lib.tts_cache import CachedTTSBackend
 from bot_system.src.providers.pepper_audio_provider import PepperAudioProvider
 from bot_system.src.providers.pepper_video_provider import PepperVideoProvider
 from bot_system.src.providers.console_input_provider import ConsoleInputProvider
 from bot_system.src.providers.microphone_provider import MicrophoneProvider
 from bot_system.src.providers.webcam_provider import WebcamProvider
-from bot_system.src.handlers.face_detection_handler import FaceDetectionHandler
+from bot_system.src.handlers.capture_control_handler import CaptureControlHandler
+from bot_system.src.handlers.face_detection_handler import DetectedFace, FaceDetectionHandler
 from bot_system.src.handlers.facial_expression_handler import FacialExpressionHandler
 from bot_system.src.handlers.speech_buffer_handler import SpeechBufferHandler
 from bot_system.src.handlers.speech_emotion_handler import SpeechEmotionHandler
 from bot_system.src.handlers.speech_intent_detection_handler import SpeechIntentDetectionHandler
 from bot_system.src.handlers.transkription_handler import TranskriptionHandler
 from bot_system.src.pepper_controller import PepperController
+from pepper_data_reciever.av_reciever import AVReceiver
 from bot_system.src.chat_gpt_agent import ChatGPTAgent
 from bot_system.src.chat_server import PepperChatServer
 
@@ -33,6 +46,21 @@ class PepperGPT(Prompter[dict[str, Any], dict[str, Any], None]):
         no_pepper: bool = False,
         debug: bool = False,
         use_console_input: bool = False,
+        tts_phrases: list[str] | None = None,
+        cache_answers: bool = False,
+        speculative: bool = False,
+        load_shedding: bool = False,
+        animation_count: int = 24,
+        session_id: str = "default",
+        pepper_ip: str = "pepper.local",
+        chat_port: int = 4200,
+        chat_url: str | None = None,
+        audio_provider: InputStreamProvider | None = None,
+        video_provider: InputStreamProvider | None = None,
+        model_pool: ModelPool | None = None,
+        vectorstore: VectorStore | None = None,
+        analysis_host: str | None = None,
+        bus_port_offset: int = 0,
     ):
         """
         Create a new instance of the PepperGPT class.
@@ -40,86 +68,242 @@ class PepperGPT(Prompter[dict[str, Any], dict[str, Any], None]):
         Args:
             data_path (str | None, optional): The path to the data for training the chatbot. Defaults to None.
             emotion_threshold (float, optional): The threshold for detecting emotions. Defaults to 0.5.
-            no_cost (bool, optional): Whether to simulate no cost for generating responses. Defaults to False.
+            no_cost (bool, optional): Whether to simulate no cost for generating responses. Also uses the offline text-to-speech stand-in. Defaults to False.
             mute (bool, optional): Whether to mute the audio. Defaults to False.
             no_pepper (bool, optional): Whether to simulate running without Pepper robot. Defaults to False.
             use_console_input (bool, optional): Whether to use console input. Defaults to False.
+            tts_phrases (list[str] | None, optional): Additional recurring phrases to synthesize into the TTS cache on startup when playing audio locally. Defaults to None.
+            cache_answers (bool, optional): Whether to reuse answers to semantically similar questions asked with compatible emotions. Defaults to False.
+            speculative (bool, optional): Whether to start answering a spoken question as soon as it is transcribed, with the emotions detected so far.
+                The answer is only used if the speech emotions of the question do not change the dominant emotion. Defaults to False.
+            load_shedding (bool, optional): Whether to reduce the facial expression rate, the detection resolution, the iris landmarks and the voice activity
+                sensitivity, in this order, while the speech intent detection or the speech buffer lag behind the capture or the CPU is saturated, and to
+                restore them once there is headroom. Defaults to False.
+            animation_count (int, optional): The number of animations most relevant to the detected emotions that are offered in each prompt. Defaults to 24.
+            session_id (str, optional): The name of this session when several robots or kiosks are served by one process. Defaults to "default".
+            pepper_ip (str, optional): The address of the Pepper robot of this session. Defaults to "pepper.local".
+            chat_port (int, optional): The port of the chat room of this session. Defaults to 4200.
+            chat_url (str | None, optional): The chat url shown on the tablet of the robot. Defaults to None, the url of the Pepper controller.
+            audio_provider (InputStreamProvider | None, optional): The audio input of this session. Defaults to None, the microphone or the robot depending on no_pepper.
+            video_provider (InputStreamProvider | None, optional): The video input of this session. Defaults to None, the webcam or the robot depending on no_pepper.
+            model_pool (ModelPool | None, optional): The emotion models shared with other sessions. Defaults to None, loading the models for this session only.
+            vectorstore (VectorStore | None, optional): The context knowledge vectorstore shared with other sessions. Defaults to None, building it from context_data_path.
+            analysis_host (str | None, optional): The host running RemoteAnalysis. If set, the facial expression and speech emotion analysis runs there. Defaults to None, analyzing locally.
+            bus_port_offset (int, optional): Added to the message bus ports, so that several sessions of a process can use a remote analysis host.
+                Must match the port offset of the RemoteAnalysis. Defaults to 0.
         """
         print("Initializing PepperGPT...")
-        # Initialize animation dictionary
-        animation_csv = open("bot_system/animations.csv", "r")
-        self.animation_dict = {row["animation"]: (row["path"], row["labels"]) for row in csv.DictReader(animation_csv, fieldnames=["animation", "path", "labels"])}
-        self.animation_list = "\n".join([f"{key}: {value[1]}" for key, value in self.animation_dict.items()])
+        # Initialize animation catalog
+        self.animation_catalog = AnimationCatalog("bot_system/animations.csv")
+        self.animation_count = animation_count
         self.emotion_threshold = emotion_threshold
 
         # Initialize audio and video providers based on no_pepper flag
         if no_pepper:
-            self.audio_provider = MicrophoneProvider()
-            self.video_provider = WebcamProvider()
+            self.audio_provider = audio_provider if audio_provider is not None else MicrophoneProvider()
+            self.video_provider = video_provider if video_provider is not None else WebcamProvider()
         else:
-            self.audio_provider = PepperAudioProvider()
-            self.video_provider = PepperVideoProvider()
+            # Audio and video share one connection, so both are stamped with the same robot clock estimate
+            av_receiver = AVReceiver(pepper_ip)
+            self.audio_provider = audio_provider if audio_provider is not None else PepperAudioProvider(av_receiver=av_receiver)
+            self.video_provider = video_provider if video_provider is not None else PepperVideoProvider(av_receiver=av_receiver)
 
         # Initialize chat GPT agent
         if context_data_path is not None:
-            chat_gpt_agent = ChatGPTAgent(no_cost, context_data_path)
+            chat_gpt_agent = ChatGPTAgent(no_cost, context_data_path, vectorstore=vectorstore)
         else:
-            chat_gpt_agent = ChatGPTAgent(no_cost)
+            chat_gpt_agent = ChatGPTAgent(no_cost, vectorstore=vectorstore)
+        self.chat_gpt_agent = chat_gpt_agent
+        llm = SemanticCacheAgent(chat_gpt_agent, chat_gpt_agent.embedding.embed_query) if cache_answers and not no_cost else chat_gpt_agent
+        self.speculative_agent = SpeculativeAgent(llm, match_keys=("facial_expressions", "dominant_emotion")) if speculative and not use_console_input else None
+        if self.speculative_agent is not None:
+            llm = self.speculative_agent
 
         # Initialize various handlers and providers
         self.face_detection_handler = FaceDetectionHandler(self.video_provider)
+        # Adapt the frame rate and resolution of the robot camera to the detected faces
+        self.capture_control_handler = (
+            CaptureControlHandler(self.face_detection_handler, self.video_provider.request_capture) if isinstance(self.video_provider, PepperVideoProvider) else None
+        )
         self.speech_intent_detection_handler = SpeechIntentDetectionHandler(self.face_detection_handler, self.audio_provider, debug=debug)
-        self.facial_expression_handler = FacialExpressionHandler(self.face_detection_handler)
         self.speech_buffer_handler = SpeechBufferHandler(self.audio_provider, self.speech_intent_detection_handler)
-        self.speech_emotion_handler = SpeechEmotionHandler(self.speech_buffer_handler)
+        self.bus_publishers: list[StreamPublisher] = []
+        if analysis_host is not None:
+            # Send the detected faces and utterances to the analysis host and receive the emotions with their original capture times
+            self.bus_publishers = [
+                StreamPublisher(
+                    self.face_detection_handler, f"tcp://*:{BUS_FACE_PORT + bus_port_offset}", predicate=lambda input: isinstance(input.value, DetectedFace)
+                ),
+                StreamPublisher(self.speech_buffer_handler, f"tcp://*:{BUS_SPEECH_PORT + bus_port_offset}", block=True),
+            ]
+            self.facial_expression_handler = RemoteStreamProvider(f"tcp://{analysis_host}:{BUS_FACIAL_EXPRESSION_PORT + bus_port_offset}")
+            self.speech_emotion_handler = RemoteStreamProvider(f"tcp://{analysis_host}:{BUS_SPEECH_EMOTION_PORT + bus_port_offset}")
+        else:
+            self.facial_expression_handler = FacialExpressionHandler(
+                self.face_detection_handler,
+                shared_model=model_pool.get("facial_expression") if model_pool is not None else None,
+                session_id=session_id,
+            )
+            self.speech_emotion_handler = SpeechEmotionHandler(
+                self.speech_buffer_handler,
+                shared_model=model_pool.get("speech_emotion") if model_pool is not None else None,
+                session_id=session_id,
+            )
 
         # Initialize text input and Pepper controller
         text_input = TranskriptionHandler(self.speech_buffer_handler, mock=no_cost) if not use_console_input else ConsoleInputProvider()
-        pepper_controller = PepperController(self.audio_provider, mute, no_pepper=no_pepper)
-        pepper_chat_server = PepperChatServer(self.speech_intent_detection_handler)
+        # Label the handler metrics with the session, the load governor of a session budgets its own handlers
+        session_handlers = (
+            self.face_detection_handler,
+            self.capture_control_handler,
+            self.speech_intent_detection_handler,
+            self.speech_buffer_handler,
+            self.facial_expression_handler,
+            self.speech_emotion_handler,
+            text_input,
+        )
+        for handler in session_handlers:
+            if isinstance(handler, InputStreamHandler):
+                handler.session_id = session_id
+        # Each utterance is transcribed and analyzed for speech emotions in parallel, the question is prompted once both
+        # results of the utterance arrived, or without the speech emotions if they take too long
+        self.utterance_join = (
+            ForkJoin(self.speech_buffer_handler, (text_input, self.speech_emotion_handler), required=(text_input,)) if not use_console_input else None
+        )
+        tts_backend = None
+        if no_pepper and not mute:
+            tts_backend = CachedTTSBackend(OfflineTTSBackend() if no_cost else OpenAITTSBackend())
+            tts_backend.presynthesize_async([self.fallback_answer, ChatGPTAgent.mock_answer, *(tts_phrases or [])])
+        pepper_controller = PepperController(self.audio_provider, mute, no_pepper=no_pepper, tts_backend=tts_backend, pepper_ip=pepper_ip, chat_url=chat_url)
+        message_store = MessageStore() if session_id == "default" else MessageStore(f"sqlite:///bot_system/chat_history_{session_id}.db")
+        pepper_chat_server = PepperChatServer(self.speech_intent_detection_handler, start=False, message_store=message_store)
+        pepper_chat_server.run(port=chat_port)
 
         self.emotion_utilities = EmotionUtilities(self.facial_expression_handler, self.speech_emotion_handler, emotion_threshold)
 
         # Call the super constructor to initialize the Prompter
         super().__init__(
             text_input=text_input,
-            llm=chat_gpt_agent,
+            llm=llm,
             chat_server=pepper_chat_server,
             robot_controller=pepper_controller,
             inputs=(self.facial_expression_handler, self.speech_emotion_handler),
+            question_join=self.utterance_join,
         )
 
+        if self.speculative_agent is not None:
+            text_input._stream.subscribe(self._speculate)
+
+        self.load_governor = LoadGovernor(self._load_shedding_steps(), self.latency_budgets, session_id=session_id) if load_shedding else None
+
         # Pause the audio provider when speech is detected and resume when robot speech ends
         self.speech_buffer_handler._stream.subscribe(lambda _: self.audio_provider.pause())
         pepper_controller.on_speech_end.subscribe(lambda _: self.audio_provider.resume())
         print("PepperGPT initialized")
 
+    # Budgets in seconds of the lag from the capture of a frame or an audio chunk until the handlers the conversation
+    # depends on handled it, including the face detection in front of the speech intent detection
+    latency_budgets = {"SpeechIntentDetectionHandler": 0.25, "SpeechBufferHandler": 0.15}
+
+    def _load_shedding_steps(self) -> list[GovernorStep]:
+        """ The load shedding steps, the least important work first. """
+        steps = []
+        if isinstance(self.facial_expression_handler, FacialExpressionHandler):
+            facial_expression_handler = self.facial_expression_handler
+            steps.append(
+                GovernorStep(
+                    "facial_expression_rate",
+                    lambda: setattr(facial_expression_handler, "max_rate", 2.0),
+                    lambda: setattr(facial_expression_handler, "max_rate", None),
+                )
+            )
+        return steps + [
+            GovernorStep(
+                "detection_downsampling",
+                lambda: setattr(self.face_detection_handler, "detection_scale", 0.5),
+                lambda: setattr(self.face_detection_handler, "detection_scale", 1.0),
+            ),
+            GovernorStep(
+                "iris_refinement",
+                lambda: self.speech_intent_detection_handler.set_iris_refinement(False),
+                lambda: self.speech_intent_detection_handler.set_iris_refinement(True),
+            ),
+            GovernorStep(
+                "vad_aggressiveness",
+                lambda: self.speech_intent_detection_handler.set_vad_mode(3),
+                lambda: self.speech_intent_detection_handler.set_vad_mode(1),
+            ),
+        ]
+
+    # Override
+    def vectorizer(self, provider):
+        return self.emotion_utilities.vectorizer(provider)
+
     # Override
     def create_prompt(self, input_data):
+        prompt = self._build_prompt(input_data)
+        print(f"Question:                    {prompt['question']}")
+        print(f"Detected facial expressions: {prompt['facial_expressions']}")
+        print(f"Detected speech emotions:    {prompt['speech_emotions']}")
+        return prompt
+
+    def _build_prompt(self, input_data: PromptInputData) -> dict[str, str]:
         if input_data.question is None:
             raise ValueError("Question is None")
 
-        facial_expressions = self.emotion_utilities.facial_expressions_from_prompt_data(input_data)
-        speech_emotions = self.emotion_utilities.speech_emotions_from_prompt_data(input_data)
+        emotions = self.emotion_utilities.distributions_from_prompt_data(input_data)
+        facial_expressions = self.emotion_utilities.facial_expressions_to_string(emotions)
+        speech_emotions = self.emotion_utilities.speech_emotions_to_string(emotions)
+        scores = EmotionDistributions.to_dict(emotions.fused)
+        animations = self.animation_catalog.select(scores, self.animation_count)
 
-        print(f"Question:                    {input_data.question.value}")
-        print(f"Detected facial expressions: {facial_expressions}")
-        print(f"Detected speech emotions:    {speech_emotions}")
         return {
             "question": input_data.question.value,
-            "animations": self.animation_list,
+            "animations": AnimationCatalog.to_prompt(animations),
             "facial_expressions": facial_expressions if facial_expressions is not None else "None",
             "speech_emotions": speech_emotions if speech_emotions is not None else "None",
+            # Not part of the prompt text, decides whether a speculative answer still fits
+            "dominant_emotion": max(scores, key=scores.__getitem__) if scores else "None",
         }
 
+    def _speculate(self, question: Input[str]) -> None:
+        """ Start answering a transcribed question while its speech emotions are still analyzed. """
+        if self.speculative_agent is None or self.utterance_join is None or question.correlation_id is None:
+            return
+        if not self.utterance_join.is_waiting_for(question.correlation_id, self.speech_emotion_handler):
+            return
+        try:
+            self.speculative_agent.speculate(self._build_prompt(PromptInputData(question, self.input_buffers)))
+        except Exception as e:
+            print(f"Failed to start a speculative answer.\n{e}")
+
     # Override
     def transform_llm_response(self, response):
-        for animation, (path, _) in self.animation_dict.items():
-            response["answer"] = response["answer"].replace(animation, path)
+        response["answer"] = self.animation_catalog.resolve_tags(response["answer"])
 
         print(f"Answer: {response['answer']}")
         return response
 
     # Override
     def detect_prompt_ending(self, prompt_data):
+        if self.utterance_join is not None:
+            # The speech emotions of the utterance are buffered before its question, or were given up on
+            return prompt_data.question is not None
         return prompt_data.question is not None and prompt_data.has_input(self.speech_emotion_handler)
+
+    # Override
+    def dispose(self):
+        if self.load_governor is not None:
+            self.load_governor.dispose()
+        if self.speculative_agent is not None:
+            print(f"Speculative answers: {self.speculative_agent.metrics()}")
+            self.speculative_agent.dispose()
+        if self.capture_control_handler is not None:
+            self.capture_control_handler.dispose()
+        if self.bus_publishers:
+            for publisher in self.bus_publishers:
+                publisher.dispose()
+            # The face detection is no longer disposed through the local facial expression handler
+            self.face_detection_handler.dispose()
+        super().dispose()
+        self.chat_gpt_agent.dispose()
@@ -25,4 +25,4 @@ class ConsoleInputProvider(InputStreamProvider[str]):
             while self.recording:
                 user_input = input("Enter something: ")
                 captured_time = time.time() - user_input.count(" ") / self.words_per_second
-                self.output(user_input, captured_time)
+                self.output(user_input, captured_time, time.time() - captured_time)
@@ -1,3 +1,4 @@
+import time
 from typing import Mapping
 import pyaudio
 
@@ -35,6 +36,12 @@ class MicrophoneProvider(InputStreamProvider[bytes]):
         flags: int,
     ) -> tuple[bytes | None, int]:
         if input_data:
-            self.output(input_data)
+            duration = frame_count / RATE
+            # The ADC time of the first sample is on the stream clock, its age is subtracted from the wall clock. Some host
+            # APIs report no stream clock, then the chunk is assumed to have just ended
+            adc_time = time_info.get("input_buffer_adc_time", 0.0)
+            current_time = time_info.get("current_time", 0.0)
+            age = current_time - adc_time if adc_time > 0 and current_time >= adc_time else duration
+            self.output(input_data, time.time() - age, duration)
 
         return input_data, pyaudio.paContinue
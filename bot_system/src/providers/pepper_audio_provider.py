@@ -1,7 +1,7 @@
 from collections import deque
 from bot_system.src.lib.config import RATE
 from bot_system.src.lib.core import InputStreamProvider
-from pepper_data_reciever.audio_reciever import AudioReceiver
+from pepper_data_reciever.av_reciever import AVReceiver
 
 
 import matplotlib.pyplot as plt
@@ -14,14 +14,22 @@ ax.set_ylim(-3000, 3000)
 ax.set_xlim(0, 10)
 x = ax.plot([], [], label="audio")[0]
 class PepperAudioProvider(InputStreamProvider[bytes]):
-    def __init__(self):
+    def __init__(self, host: str = "pepper.local", av_receiver: AVReceiver | None = None):
+        """
+        Create a new instance of the PepperAudioProvider class.
+
+        Args:
+            host (str, optional): The address of the robot. Defaults to "pepper.local".
+            av_receiver (AVReceiver | None, optional): The audio and video stream of the robot, shared with the video provider. Defaults to a new receiver.
+        """
         super().__init__()
-        self.audio_reciever = AudioReceiver()
-        self.audio_reciever.start_async(self.on_audio)
+        self.av_receiver = av_receiver if av_receiver is not None else AVReceiver(host)
+        self.av_receiver.subscribe_audio(self.on_audio)
+        self.av_receiver.start_async()
         self.audio_buffer = deque(maxlen=50)
 
-    def on_audio(self, buffer: bytes, nbOfChannels: int, nbrOfSamplesByChannel: int, buffer_size: int, aTimeStamp: list[int]):
-        self.output(buffer)
+    def on_audio(self, buffer: bytes, nbOfChannels: int, nbrOfSamplesByChannel: int, capture_time: float, sequence: int):
+        self.output(buffer, capture_time, nbrOfSamplesByChannel / RATE)
         # self.audio_buffer.append(buffer)
         # from_dummy_thread(self.plot_audio)
 
@@ -39,5 +47,5 @@ class PepperAudioProvider(InputStreamProvider[bytes]):
         fig.canvas.flush_events()
 
     def dispose(self):
-        self.audio_reciever.dispose()
+        self.av_receiver.dispose()
         super().dispose()
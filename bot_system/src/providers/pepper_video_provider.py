@@ -1,14 +1,32 @@
+from typing import Any
+
 from cv2.typing import MatLike
 
 from bot_system.src.lib.core import InputStreamProvider
-from pepper_data_reciever.video_reciever import VideoReceiver
+from pepper_data_reciever.av_reciever import AVReceiver
 
 
 class PepperVideoProvider(InputStreamProvider[MatLike]):
-    def __init__(self):
+    def __init__(self, host: str = "pepper.local", av_receiver: AVReceiver | None = None):
+        """
+        Create a new instance of the PepperVideoProvider class.
+
+        Args:
+            host (str, optional): The address of the robot. Defaults to "pepper.local".
+            av_receiver (AVReceiver | None, optional): The audio and video stream of the robot, shared with the audio provider. Defaults to a new receiver.
+        """
         super().__init__()
-        self.video_receiver = VideoReceiver()
-        self.video_receiver.start_async(self.on_video)
+        self.av_receiver = av_receiver if av_receiver is not None else AVReceiver(host)
+        self.av_receiver.subscribe_video(self.on_video)
+        self.av_receiver.start_async()
+
+    def on_video(self, buffer: MatLike, height: int, width: int, capture_time: float, sequence: int):
+        self.output(buffer, capture_time)
+
+    def request_capture(self, request: dict[str, Any]) -> bool:
+        """ Request a frame rate ("fps"), resolution ("resolution", "qvga" or "vga") or pause ("paused") of the robot camera. """
+        return self.av_receiver.send_control(request)
 
-    def on_video(self, buffer: MatLike, height: int, width: int):
-        self.output(buffer)
\ No newline at end of file
+    def dispose(self):
+        self.av_receiver.dispose()
+        super().dispose()
\ No newline at end of file
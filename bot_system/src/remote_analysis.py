@@ -0,0 +1,71 @@
+import argparse
+import time
+
+from bot_system.src.lib.config import BUS_FACE_PORT, BUS_FACIAL_EXPRESSION_PORT, BUS_PORT_STRIDE, BUS_SPEECH_EMOTION_PORT, BUS_SPEECH_PORT
+from bot_system.src.lib.message_bus import RemoteStreamProvider, StreamCodec, StreamPublisher
+from bot_system.src.lib.model_pool import ModelPool
+from bot_system.src.handlers.face_detection_handler import DetectedFace
+from bot_system.src.handlers.facial_expression_handler import FacialExpressionHandler
+from bot_system.src.handlers.speech_emotion_handler import SpeechEmotionHandler
+
+
+class RemoteAnalysis:
+    """
+    Runs the facial expression and speech emotion analysis on another host than the robot facing PepperGPT process.
+
+    Subscribes to the detected faces and speech buffers published by PepperGPT started with analysis_host and publishes
+    the results back, keeping the capture times of the inputs.
+    """
+
+    def __init__(self, robot_host: str, port_offset: int = 0, model_pool: ModelPool | None = None, session_id: str = "default"):
+        """
+        Create a new instance of the RemoteAnalysis class.
+
+        Args:
+            robot_host (str): The host running the robot facing PepperGPT process.
+            port_offset (int, optional): Added to the message bus ports, the bus_port_offset of the PepperGPT session. Defaults to 0.
+            model_pool (ModelPool | None, optional): The emotion models shared with the analyses of other sessions. Defaults to None, loading the models for this analysis only.
+            session_id (str, optional): The name of the analyzed session in the model pool. Defaults to "default".
+        """
+        self.face_provider = RemoteStreamProvider(f"tcp://{robot_host}:{BUS_FACE_PORT + port_offset}", codec=StreamCodec((DetectedFace,)))
+        self.speech_provider = RemoteStreamProvider(f"tcp://{robot_host}:{BUS_SPEECH_PORT + port_offset}")
+
+        self.facial_expression_handler = FacialExpressionHandler(
+            self.face_provider, shared_model=model_pool.get("facial_expression") if model_pool is not None else None, session_id=session_id
+        )
+        self.speech_emotion_handler = SpeechEmotionHandler(
+            self.speech_provider, shared_model=model_pool.get("speech_emotion") if model_pool is not None else None, session_id=session_id
+        )
+
+        self.publishers = [
+            StreamPublisher(self.facial_expression_handler, f"tcp://*:{BUS_FACIAL_EXPRESSION_PORT + port_offset}"),
+            StreamPublisher(self.speech_emotion_handler, f"tcp://*:{BUS_SPEECH_EMOTION_PORT + port_offset}", block=True),
+        ]
+
+    def dispose(self) -> None:
+        for publisher in self.publishers:
+            publisher.dispose()
+        self.facial_expression_handler.dispose()
+        self.speech_emotion_handler.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the emotion analysis of a PepperGPT process on this host.")
+    parser.add_argument("--robot-host", type=str, required=True, help="The host running the robot facing PepperGPT process.")
+    parser.add_argument("--sessions", type=int, default=1, help="The number of sessions of the PepperGPT process, analyzed with shared models.")
+    args = parser.parse_args()
+
+    model_pool = ModelPool({"speech_emotion": SpeechEmotionHandler.load_model, "facial_expression": lambda: None}) if args.sessions > 1 else None
+    remote_analyses = [
+        RemoteAnalysis(args.robot_host, port_offset=index * BUS_PORT_STRIDE, model_pool=model_pool, session_id=str(index)) for index in range(args.sessions)
+    ]
+    print("Remote analysis running")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for remote_analysis in remote_analyses:
+            remote_analysis.dispose()
+        if model_pool is not None:
+            model_pool.dispose()
+        print("Exiting")
@@ -0,0 +1,71 @@
+from dataclasses import dataclass
+from typing import Any
+
+from bot_system.src.lib.config import BUS_PORT_STRIDE
+from bot_system.src.lib.model_pool import ModelPool
+from bot_system.src.handlers.speech_emotion_handler import SpeechEmotionHandler
+from bot_system.src.chat_gpt_agent import ChatGPTAgent
+from bot_system.src.pepper_gpt import PepperGPT
+
+
+@dataclass
+class SessionConfig:
+    """ The robot or kiosk and the chat room of one session. """
+
+    session_id: str
+    pepper_ip: str = "pepper.local"
+    chat_port: int = 4200
+    chat_url: str | None = None
+
+
+class SessionManager:
+    """
+    Serves several robots or kiosks from one process.
+
+    Every session has its own inputs, conversation memory, controller and chat room, while the emotion models and the
+    context knowledge vectorstore are loaded once and shared by all sessions.
+    """
+
+    def __init__(self, sessions: list[SessionConfig], context_data_path: str = "data/", no_cost: bool = False, **kwargs: Any):
+        """
+        Create a new instance of the SessionManager class and start all sessions.
+
+        Args:
+            sessions (list[SessionConfig]): The sessions to start. Their session ids and chat ports must be unique.
+                With an analysis_host, the remote analysis must run as many sessions, in the same order.
+            context_data_path (str, optional): The path to the context knowledge data. Defaults to "data/".
+            no_cost (bool, optional): Whether to simulate no cost for generating responses. Defaults to False.
+            **kwargs: Further arguments passed to every PepperGPT session.
+        """
+        if len({session.session_id for session in sessions}) != len(sessions) or len({session.chat_port for session in sessions}) != len(sessions):
+            raise ValueError("Session ids and chat ports must be unique")
+
+        # DeepFace keeps its models in a process wide cache, so the facial expression model only needs its worker
+        self.model_pool = ModelPool({"speech_emotion": SpeechEmotionHandler.load_model, "facial_expression": lambda: None})
+        vectorstore = ChatGPTAgent.build_vectorstore(context_data_path)
+
+        self.sessions: dict[str, PepperGPT] = {}
+        for index, session in enumerate(sessions):
+            print(f"Starting session {session.session_id}...")
+            self.sessions[session.session_id] = PepperGPT(
+                context_data_path=context_data_path,
+                no_cost=no_cost,
+                session_id=session.session_id,
+                pepper_ip=session.pepper_ip,
+                chat_port=session.chat_port,
+                chat_url=session.chat_url,
+                model_pool=self.model_pool,
+                vectorstore=vectorstore,
+                # The n-th session uses the n-th session of the remote analysis host
+                bus_port_offset=index * BUS_PORT_STRIDE,
+                **kwargs,
+            )
+
+    def metrics(self) -> dict[str, dict[str, dict[str, float]]]:
+        """ Get the latency metrics of the shared models, by model name and session. """
+        return self.model_pool.latency_metrics()
+
+    def dispose(self) -> None:
+        for session in self.sessions.values():
+            session.dispose()
+        self.model_pool.dispose()
@@ -1,6 +1,6 @@
 from face_analyzer.src.camera_calibration import CameraCalibration
 from face_analyzer.src.face_analyzer import FaceAnalyzer
-from face_analyzer.src.face_model import FaceModel
+from face_analyzer.src.face_model import FaceModel, with_estimated_pupils
 from face_analyzer.src.math import calc_angle
 from face_analyzer.src.mouth_angle_buffer import MouthAngleBuffer
 from face_analyzer.src.world_projection import WorldProjection
@@ -16,7 +16,7 @@ face_mesh = FaceMesh(
         min_tracking_confidence=0.5)
 face_analyzer = FaceAnalyzer()
 
-def process_frame(frame, w, h):
+def process_frame(frame, w, h, capture_time, sequence):
     try:
         # To improve performance, optionally mark the image as not writeable to
         # pass by reference.
@@ -0,0 +1,215 @@
+import json
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Callable
+
+import cv2
+from cv2.typing import MatLike
+import numpy as np
+
+from pepper_data_reciever.framed_reader import FramedStreamReader
+
+# The port of the multiplexed audio and video stream
+AV_PORT = 40097
+
+PACKET_AUDIO = 1
+PACKET_VIDEO = 2
+
+ENCODING_RAW = 0
+ENCODING_JPEG = 1
+
+# The number of packets the server dropped for this client so far, the packet type, sequence number,
+# robot timestamp in seconds and microseconds and payload size
+HEADER = struct.Struct("!I B I I I I")
+# Number of channels and samples per channel
+AUDIO_HEADER = struct.Struct("!I I")
+# Width, height and encoding
+VIDEO_HEADER = struct.Struct("!I I I")
+
+
+def decode_frame(encoding: int, buffer: np.ndarray | memoryview | bytes, height: int, width: int) -> MatLike:
+    """ Decode a received frame into a new BGR image, so the image does not share memory with the receive buffer. """
+    if encoding == ENCODING_JPEG:
+        image = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Invalid JPEG frame")
+        return image
+    return np.frombuffer(buffer, dtype=np.uint8).reshape((height, width, 3)).copy()
+
+
+class ClockOffsetEstimator:
+    """
+    Estimates the offset between the robot clock and the host clock.
+
+    Every packet gives an upper bound of the offset, its arrival time minus its robot timestamp, which is the true offset
+    plus the network and queueing delay. The minimum over a sliding window is the sample with the least delay, and the
+    window lets the estimate follow clock drift. Times converted with the estimate are exact relative to each other and
+    include the minimum network latency as a constant bias.
+    """
+
+    def __init__(self, window: float = 30.0):
+        """
+        Create a new instance of the ClockOffsetEstimator class.
+
+        Args:
+            window (float, optional): The time in seconds over which the minimum is taken. Defaults to 30.0.
+        """
+        self.window = window
+        # (arrival time, offset) with increasing offsets, the first is the minimum of the window
+        self.samples: deque[tuple[float, float]] = deque()
+        self.lock = threading.Lock()
+
+    def update(self, robot_time: float, arrival_time: float) -> float:
+        """ Add a sample and return the current offset estimate. """
+        offset = arrival_time - robot_time
+        with self.lock:
+            while self.samples and self.samples[-1][1] >= offset:
+                self.samples.pop()
+            self.samples.append((arrival_time, offset))
+            while self.samples[0][0] < arrival_time - self.window:
+                self.samples.popleft()
+            return self.samples[0][1]
+
+    @property
+    def offset(self) -> float | None:
+        with self.lock:
+            return self.samples[0][1] if self.samples else None
+
+    def to_host_time(self, robot_time: float, arrival_time: float | None = None) -> float:
+        """ Convert a robot timestamp into host time, updating the estimate with the arrival time of the packet. """
+        return robot_time + self.update(robot_time, arrival_time if arrival_time is not None else time.time())
+
+
+class AVReceiver:
+    """
+    Receives the multiplexed audio and video stream of the robot over one connection.
+
+    Packets are stamped with the robot clock and converted into host time with a ClockOffsetEstimator. Gaps in the
+    sequence numbers are counted as lost packets per type, which includes the frames the server dropped for this client.
+    """
+
+    def __init__(self, host: str = "pepper.local", port: int = AV_PORT):
+        self.host = host
+        self.port = port
+        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.reader = FramedStreamReader(self.client_socket)
+        self.clock = ClockOffsetEstimator()
+        self.is_running = False
+        self.dropped_packets = 0
+        self.lost_packets = {PACKET_AUDIO: 0, PACKET_VIDEO: 0}
+        self.last_sequence: dict[int, int] = {}
+
+        self.audio_callbacks: list[Callable[[bytes, int, int, float, int], None]] = []
+        self.video_callbacks: list[Callable[[MatLike, int, int, float, int], None]] = []
+        self.control_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+
+    def subscribe_audio(self, receive_audio: Callable[[bytes, int, int, float, int], None]) -> None:
+        """ Receive the audio chunks with their number of channels, samples per channel, capture time in host time and sequence number. """
+        self.audio_callbacks.append(receive_audio)
+
+    def subscribe_video(self, receive_video: Callable[[MatLike, int, int, float, int], None]) -> None:
+        """ Receive the frames with their height, width, capture time in host time and sequence number. """
+        self.video_callbacks.append(receive_video)
+
+    def send_control(self, request: dict[str, Any]) -> bool:
+        """
+        Send a capture request to the robot.
+
+        Args:
+            request (dict[str, Any]): The optional keys fps, resolution ("qvga" or "vga") and paused.
+
+        Returns:
+            bool: Whether the request was sent.
+        """
+        if not self.is_running:
+            return False
+        try:
+            with self.control_lock:
+                self.client_socket.sendall(json.dumps(request).encode() + b"\n")
+            return True
+        except OSError as e:
+            print(f"AVReceiver: Failed to send control request.\n{e}")
+            return False
+
+    def start_async(self) -> None:
+        """ Start receiving on a new thread. Does nothing if already started, so the audio and video providers can share the receiver. """
+        with self.start_lock:
+            if self.is_running:
+                return
+            self.is_running = True
+        threading.Thread(target=self.start, daemon=True).start()
+
+    def start(self) -> None:
+        try:
+            self.client_socket.connect((self.host, self.port))
+            self.is_running = True
+            while self.is_running:
+                header = self.reader.read_header(HEADER)
+                if header is None:
+                    print("AVReceiver: Server closed the connection.")
+                    break
+
+                dropped_packets, packet_type, sequence, timestamp_seconds, timestamp_microseconds, payload_size = header
+                arrival_time = time.time()
+                self.dropped_packets = dropped_packets
+                self._check_sequence(packet_type, sequence)
+                capture_time = self.clock.to_host_time(timestamp_seconds + timestamp_microseconds / 1e6, arrival_time)
+
+                if packet_type == PACKET_AUDIO:
+                    if not self._receive_audio(payload_size, capture_time, sequence):
+                        break
+                elif packet_type == PACKET_VIDEO:
+                    if not self._receive_video(payload_size, capture_time, sequence):
+                        break
+                else:
+                    print(f"AVReceiver: Unknown packet type {packet_type}.")
+                    break
+        except OSError as e:
+            if self.is_running:
+                print(f"AVReceiver: Connection error.\n{e}")
+        finally:
+            self.is_running = False
+
+    def _check_sequence(self, packet_type: int, sequence: int):
+        last_sequence = self.last_sequence.get(packet_type)
+        if last_sequence is not None:
+            self.lost_packets[packet_type] = self.lost_packets.get(packet_type, 0) + (sequence - last_sequence - 1) % (1 << 32)
+        self.last_sequence[packet_type] = sequence
+
+    def _receive_audio(self, payload_size: int, capture_time: float, sequence: int) -> bool:
+        audio_header = self.reader.read_header(AUDIO_HEADER)
+        payload = self.reader.read_payload(payload_size) if audio_header is not None else None
+        if payload is None:
+            print("AVReceiver: Failed to receive all data.")
+            return False
+
+        # The audio chunks are buffered downstream, so they get their own copy of the pooled buffer
+        buffer = bytes(payload)
+        for receive_audio in self.audio_callbacks:
+            receive_audio(buffer, audio_header[0], audio_header[1], capture_time, sequence)
+        return True
+
+    def _receive_video(self, payload_size: int, capture_time: float, sequence: int) -> bool:
+        video_header = self.reader.read_header(VIDEO_HEADER)
+        payload = self.reader.read_array(payload_size) if video_header is not None else None
+        if payload is None:
+            print("AVReceiver: Failed to receive all data.")
+            return False
+
+        width, height, encoding = video_header
+        try:
+            image = decode_frame(encoding, payload, height, width)
+        except ValueError as e:
+            print(f"AVReceiver: Failed to decode frame.\n{e}")
+            return True
+        for receive_video in self.video_callbacks:
+            receive_video(image, height, width, capture_time, sequence)
+        return True
+
+    def dispose(self) -> None:
+        self.is_running = False
+        self.client_socket.close()
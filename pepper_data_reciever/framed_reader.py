@@ -0,0 +1,75 @@
+import socket
+import struct
+
+import numpy as np
+
+
+class BufferPool:
+    """
+    A ring of reusable receive buffers. A buffer is handed out again after size more payloads, so views of a payload are
+    only valid until then. Consumers that keep a payload longer must copy it.
+    """
+
+    def __init__(self, size: int = 4):
+        self.buffers = [bytearray() for _ in range(size)]
+        self.index = 0
+
+    def acquire(self, size: int) -> memoryview:
+        """ Get a view of size bytes of the next buffer, growing it if necessary. """
+        buffer = self.buffers[self.index]
+        if len(buffer) < size:
+            buffer = self.buffers[self.index] = bytearray(size)
+        self.index = (self.index + 1) % len(self.buffers)
+        return memoryview(buffer)[:size]
+
+
+class FramedStreamReader:
+    """ Reads length-prefixed frames from a TCP socket with recv_into, without intermediate copies. """
+
+    def __init__(self, client_socket: socket.socket, pool_size: int = 4, receive_buffer_size: int = 1 << 20):
+        """
+        Create a new instance of the FramedStreamReader class. Create it before connecting, the receive buffer size affects the TCP window.
+
+        Args:
+            client_socket (socket.socket): The socket to read from.
+            pool_size (int, optional): The number of reusable payload buffers. Defaults to 4.
+            receive_buffer_size (int, optional): The kernel receive buffer size in bytes. Defaults to 1 MiB.
+        """
+        self.client_socket = client_socket
+        self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
+        self.pool = BufferPool(pool_size)
+        self.header_buffer = bytearray(64)
+
+    def read_exact(self, view: memoryview) -> bool:
+        """ Fill the view completely. Returns False if the connection closed first. """
+        received = 0
+        size = len(view)
+        while received < size:
+            count = self.client_socket.recv_into(view[received:], size - received)
+            if count == 0:
+                return False
+            received += count
+        return True
+
+    def read_header(self, header: struct.Struct) -> tuple | None:
+        """ Read and unpack a header. Returns None if the connection closed. """
+        if len(self.header_buffer) < header.size:
+            self.header_buffer = bytearray(header.size)
+        view = memoryview(self.header_buffer)[: header.size]
+        if not self.read_exact(view):
+            return None
+        return header.unpack_from(view)
+
+    def read_payload(self, size: int) -> memoryview | None:
+        """ Read a payload into a pooled buffer. Returns None if the connection closed. """
+        view = self.pool.acquire(size)
+        return view if self.read_exact(view) else None
+
+    def read_array(self, size: int, dtype: np.dtype | type = np.uint8, shape: tuple[int, ...] | None = None) -> np.ndarray | None:
+        """ Read a payload into a pooled buffer and return a NumPy view of it. Returns None if the connection closed. """
+        view = self.read_payload(size)
+        if view is None:
+            return None
+        array = np.frombuffer(view, dtype=dtype)
+        return array.reshape(shape) if shape is not None else array
@@ -0,0 +1,82 @@
+import argparse
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from pepper_data_reciever.framed_reader import FramedStreamReader
+
+# A stand-in header of the size of the streaming server header, ending with the payload size
+HEADER = struct.Struct("!I I I I I")
+
+
+def serve(server_socket: socket.socket, payload_size: int, count: int):
+    """ A loopback stand-in for the robot streaming server, sending count frames as fast as possible. """
+    connection, _ = server_socket.accept()
+    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    frame = HEADER.pack(0, 320, 240, 0, payload_size) + bytes(payload_size)
+    for _ in range(count):
+        connection.sendall(frame)
+    connection.close()
+
+
+def read_legacy(client_socket: socket.socket) -> int:
+    """ The previous receiver loop: a single header recv, payload concatenation and a bytearray copy before np.frombuffer. """
+    frames = 0
+    while True:
+        header_data = client_socket.recv(HEADER.size)
+        if not header_data:
+            return frames
+        buffer_size = HEADER.unpack(header_data)[4]
+        buffer = b""
+        while len(buffer) < buffer_size:
+            chunk = client_socket.recv(buffer_size - len(buffer))
+            if not chunk:
+                return frames
+            buffer += chunk
+        np.frombuffer(bytearray(buffer), dtype=np.uint8)
+        frames += 1
+
+
+def read_framed(reader: FramedStreamReader) -> int:
+    frames = 0
+    while True:
+        header = reader.read_header(HEADER)
+        if header is None or reader.read_array(header[4]) is None:
+            return frames
+        frames += 1
+
+
+def benchmark(mode: str, payload_size: int, count: int) -> tuple[int, float]:
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.bind(("127.0.0.1", 0))
+    server_socket.listen(1)
+    server_thread = threading.Thread(target=serve, args=(server_socket, payload_size, count), daemon=True)
+    server_thread.start()
+
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    reader = FramedStreamReader(client_socket) if mode == "framed" else None
+    client_socket.connect(server_socket.getsockname())
+
+    start = time.perf_counter()
+    frames = read_framed(reader) if reader is not None else read_legacy(client_socket)
+    duration = time.perf_counter() - start
+
+    client_socket.close()
+    server_socket.close()
+    return frames, duration
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the previous and the framed socket reader on a loopback stand-in server.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5460, 15_000, 230_400, 921_600], help="Payload sizes in bytes: audio chunk, JPEG, raw QVGA and raw VGA frames.")
+    parser.add_argument("--count", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'payload':>9} {'reader':<7} {'frames':>7} {'MB/s':>9} {'us/frame':>9}")
+    for size in args.sizes:
+        for mode in ("legacy", "framed"):
+            frames, duration = benchmark(mode, size, args.count)
+            print(f"{size:>9} {mode:<7} {frames:>7} {frames * size / duration / 1e6:>9.1f} {duration / max(frames, 1) * 1e6:>9.1f}")
@@ -0,0 +1,81 @@
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from pepper_data_reciever.av_reciever import ENCODING_JPEG, ENCODING_RAW, decode_frame
+
+QVGA = (320, 240)
+
+
+def load_frames(source: str, max_frames: int) -> list[np.ndarray]:
+    """ Load recorded frames from a video file or a directory of images, resized to the QVGA frames of the robot. """
+    frames = []
+    if os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, "*")))[:max_frames]:
+            image = cv2.imread(path)
+            if image is not None:
+                frames.append(cv2.resize(image, QVGA))
+    else:
+        capture = cv2.VideoCapture(source)
+        while len(frames) < max_frames:
+            is_read, image = capture.read()
+            if not is_read:
+                break
+            frames.append(cv2.resize(image, QVGA))
+        capture.release()
+    return frames
+
+
+def benchmark(frames: list[np.ndarray], encoding: int, quality: int, link_mbps: float, fps: float) -> dict[str, float]:
+    """ Measure the mean frame size, encode and decode time and the resulting bandwidth and per-frame latency over the given link. """
+    sizes, encode_times, decode_times = [], [], []
+    for frame in frames:
+        start = time.perf_counter()
+        if encoding == ENCODING_JPEG:
+            data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+        else:
+            data = frame.tobytes()
+        encoded = time.perf_counter()
+        decode_frame(encoding, data, frame.shape[0], frame.shape[1])
+        decoded = time.perf_counter()
+
+        sizes.append(len(data))
+        encode_times.append(encoded - start)
+        decode_times.append(decoded - encoded)
+
+    frame_size = float(np.mean(sizes))
+    transfer_time = frame_size * 8 / (link_mbps * 1e6)
+    return {
+        "frame_kb": frame_size / 1024,
+        "bandwidth_mb_s": frame_size * fps / 1024 / 1024,
+        "encode_ms": float(np.mean(encode_times)) * 1000,
+        "decode_ms": float(np.mean(decode_times)) * 1000,
+        "latency_ms": (float(np.mean(encode_times)) + transfer_time + float(np.mean(decode_times))) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare raw and JPEG video transport on recorded frames.")
+    parser.add_argument("source", nargs="?", default="bot_system/test_images", help="A video file or a directory of images.")
+    parser.add_argument("--max-frames", type=int, default=200)
+    parser.add_argument("--qualities", type=int, nargs="+", default=[50, 70, 80, 90])
+    parser.add_argument("--link-mbps", type=float, default=20.0, help="The effective Wi-Fi throughput in Mbit/s.")
+    parser.add_argument("--fps", type=float, default=20.0)
+    args = parser.parse_args()
+
+    frames = load_frames(args.source, args.max_frames)
+    if not frames:
+        raise SystemExit(f"No frames found in {args.source}")
+
+    print(f"{len(frames)} frames, {args.fps:.0f} fps over {args.link_mbps:.0f} Mbit/s")
+    print(f"{'mode':<10} {'KB/frame':>9} {'MB/s':>7} {'encode ms':>10} {'decode ms':>10} {'latency ms':>11}")
+    modes = [("raw", ENCODING_RAW, 0)] + [(f"jpeg {quality}", ENCODING_JPEG, quality) for quality in args.qualities]
+    for name, encoding, quality in modes:
+        result = benchmark(frames, encoding, quality, args.link_mbps, args.fps)
+        print(
+            f"{name:<10} {result['frame_kb']:>9.1f} {result['bandwidth_mb_s']:>7.2f} {result['encode_ms']:>10.2f} {result['decode_ms']:>10.2f} {result['latency_ms']:>11.1f}"
+        )
@@ -1,77 +1,63 @@
 import queue
-import socket
-import struct
-import threading
-from typing import Callable
+from typing import Any, Callable
 import cv2
 from cv2.typing import MatLike
-import numpy as np
+
+from pepper_data_reciever.av_reciever import AV_PORT, AVReceiver
+
 
 class VideoReceiver:
-    def __init__(self, play_video: bool = False):
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.is_running = False
+    def __init__(self, play_video: bool = False, host: str = "pepper.local", port: int = AV_PORT):
+        self.av_receiver = AVReceiver(host, port)
         self.play_video = play_video
+        # cv2.imshow must be called on the thread that created the window
+        self.frames: queue.Queue[MatLike] = queue.Queue(maxsize=1)
+
+    @property
+    def dropped_packets(self) -> int:
+        return self.av_receiver.dropped_packets
+
+    def send_control(self, request: dict[str, Any]) -> bool:
+        """ Send a capture request to the robot, with the optional keys fps, resolution ("qvga" or "vga") and paused. """
+        return self.av_receiver.send_control(request)
 
     def play(self, buffer: MatLike, height: int, width: int):
         cv2.imshow('Pepper Video Stream', buffer)
         cv2.waitKey(1)
 
-    def start_async(self, receive_data: Callable[[MatLike, int, int], None]):
-        threading.Thread(target=self.start, args=(receive_data,)).start()
-    
-    def start(self, receive_data: Callable[[MatLike, int, int], None]):
-        try:
-            self.client_socket.connect(("pepper.local", 40098))
-            self.is_running = True
-            while self.is_running:
-                header_data = None
-                try:
-                    header_format = "!I I I"
-                    header_size = struct.calcsize(header_format)
-                    header_data = self.client_socket.recv(header_size)
-                    if not header_data:
-                        print("VideoReceiver: Server closed the connection.")
-                        break
-
-                    image_width, image_height, buffer_size = struct.unpack(header_format, header_data)
-                except struct.error as e:
-                    print(f"VideoReceiver: Failed to unpack header data.\n{e}")
-                    print(f"buffer_size: {len(header_data) if header_data else 0}")
-                    continue
+    def start_async(self, receive_data: Callable[[MatLike, int, int, float, int], None]):
+        """ Receive the frames with their height, width, capture time in host time and sequence number. """
+        self.av_receiver.subscribe_video(receive_data)
+        if self.play_video:
+            self.av_receiver.subscribe_video(lambda image, *_: self._queue_frame(image))
+        self.av_receiver.start_async()
 
-                buffer = b""
-                while len(buffer) < buffer_size:
-                    chunk = self.client_socket.recv(buffer_size - len(buffer))
-                    if not chunk:
-                        print("VideoReceiver: Failed to receive all data.")
-                        break
-                    buffer += chunk
-
-
-                image = np.frombuffer(bytearray(buffer), dtype=np.uint8).reshape((image_height, image_width, 3))
-                receive_data(image, image_height, image_width)
-                if self.play_video:
-                    self.play(image, image_height, image_width)
+    def _queue_frame(self, image: MatLike):
+        try:
+            self.frames.put_nowait(image)
+        except queue.Full:
+            pass
 
-        except KeyboardInterrupt:
-            print("VideoReceiver: Stopping...")
-        finally:
-            self.is_running = False
+    def start(self, receive_data: Callable[[MatLike, int, int, float, int], None]):
+        """ Receive the frames until the connection closes, showing them on this thread if play_video is set. """
+        self.start_async(receive_data)
+        while self.av_receiver.is_running:
+            try:
+                image = self.frames.get(timeout=1)
+            except queue.Empty:
+                continue
+            self.play(image, image.shape[0], image.shape[1])
 
     def dispose(self):
-        self.is_running = False
-        self.client_socket.close()
+        self.av_receiver.dispose()
 
 if __name__ == "__main__":
     receiver = VideoReceiver(play_video=True)
-    receiver.start(lambda buffer, height, width: print(f"Received image: {height}x{width}"))
 
     try:
-        while True:
-            pass
+        receiver.start(lambda buffer, height, width, capture_time, sequence: print(f"Received image: {height}x{width}"))
     except KeyboardInterrupt:
         receiver.dispose()
         cv2.destroyAllWindows()
         print("VideoReceiver stopped.")
-        exit(0)
\ No newline at end of file
+        exit(0)
@@ -1,7 +1,7 @@
 from optparse import OptionParser
-import struct
 import sys
 import time
+from av_packet import AUDIO_HEADER, AV_PORT, PACKET_AUDIO, QUEUE_SIZES, PacketWriter
 from data_streaming_server import DataStreamingServer
 # from naoqi import ALProxy, ALModule, ALBroker
 import qi
@@ -11,11 +11,20 @@ SAMPLE_RATE = 16000         # Hz, be careful changing this, both google and Naoq
 class AudioTransmissionModule(object):
     moduleName = "AudioTransmission"
 
-    def __init__(self, app):
+    def __init__(self, app, streaming_server=None, stream_port=AV_PORT):
+        '''
+        | Keyword arguments:
+        | app: qi.Application - the started NAOqi application
+        | streaming_server: DataStreamingServer - the multiplexed audio and video stream, if shared with the video module.
+        |   By default the module listens on its own.
+        | stream_port: int - the port the module listens on without a shared streaming server
+        '''
         super(AudioTransmissionModule, self).__init__()
         
         app.start()
-        self.streaming_server = DataStreamingServer(40099)
+        self.owns_server = streaming_server is None
+        self.streaming_server = streaming_server if streaming_server is not None else DataStreamingServer(stream_port, queue_size=QUEUE_SIZES)
+        self.packet_writer = PacketWriter(PACKET_AUDIO)
         self.audio = app.session.service("ALAudioDevice")
 
         self.nNbrChannelFlag = 3 # ALL_Channels: 0,  AL::LEFTCHANNEL: 1, AL::RIGHTCHANNEL: 2 AL::FRONTCHANNEL: 3  or AL::REARCHANNEL: 4.
@@ -31,36 +40,32 @@ class AudioTransmissionModule(object):
         | Keyword arguments:
         | nbOfChannels: long - number of channels in the buffer
         | nbrOfSamplesByChannel: long - number of samples in one channel
-        | aTimeStamp: list<long> - [[seconds since start], [milliseconds]]
+        | aTimeStamp: list<long> - [seconds, microseconds] of the robot clock
         | buffer: bytearray - the audio buffer
         ''' 
-        buffer_size = len(buffer)
-
-        # Include buffer_size in the header
-        header_format = '!I I I I I'  # Adding an extra 'I' for buffer_size
-        header_data = struct.pack(header_format, nbOfChannels, nbrOfSamplesByChannel, aTimeStamp[0], aTimeStamp[1], buffer_size)
-        
-        # Send header and buffer
-        self.streaming_server.stream(header_data + buffer)
+        audio_header = AUDIO_HEADER.pack(nbOfChannels, nbrOfSamplesByChannel)
+        self.streaming_server.stream(self.packet_writer.pack(aTimeStamp[0], aTimeStamp[1], audio_header, buffer), PACKET_AUDIO)
 
     def start(self):
         print("Streaming audio...")
         self.is_running = True
         self.audio.setClientPreferences(self.moduleName, SAMPLE_RATE, self.nNbrChannelFlag, self.nDeinterleave) # setting same as default generate a bug !?!
         self.audio.subscribe(self.moduleName)
-        self.streaming_server.listenAsync()
+        if self.owns_server:
+            self.streaming_server.listenAsync()
 
         while self.is_running:
             time.sleep(1)
         self.audio.unsubscribe(self.moduleName)
-        self.streaming_server.close()
+        if self.owns_server:
+            self.streaming_server.close()
         print("Audio stream stopped")
 
     def stop(self):
         self.is_running = False
 
     @staticmethod
-    def setup(ip, port):
+    def setup(ip, port, streaming_server=None, stream_port=AV_PORT):
         try:
             print("Initializing module " + AudioTransmissionModule.moduleName + " with ip \"" + ip + "\" on port " + str(port))
             # Initialize qi framework.
@@ -71,7 +76,7 @@ class AudioTransmissionModule(object):
                     "Please check your script arguments. Run with -h option for help.")
             sys.exit(1)
 
-        module = AudioTransmissionModule(app)
+        module = AudioTransmissionModule(app, streaming_server, stream_port)
         app.session.registerService(module.moduleName, module)
         return module
 
@@ -85,15 +90,20 @@ if __name__ == "__main__":
         help="Parent broker port. The port NAOqi is listening to",
         dest="port",
         type="int")
+    parser.add_option("--stream-port",
+        help="The port the audio is streamed on. Differs from the video port if both run standalone, pepper_data_streaming.py streams both on one port",
+        dest="stream_port",
+        type="int")
     parser.set_defaults(
         ip="127.0.0.1",
-        port=9559)
+        port=9559,
+        stream_port=AV_PORT)
 
     (opts, args_) = parser.parse_args()
     pepper_ip   = opts.ip
     pepper_port = opts.port
 
-    audioTransmissionModule = AudioTransmissionModule.setup(pepper_ip, pepper_port)
+    audioTransmissionModule = AudioTransmissionModule.setup(pepper_ip, pepper_port, stream_port=opts.stream_port)
     audioTransmissionModule.start()
     
     
\ No newline at end of file
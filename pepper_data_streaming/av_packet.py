@@ -0,0 +1,31 @@
+import struct
+
+# The port of the multiplexed audio and video stream
+AV_PORT = 40097
+
+PACKET_AUDIO = 1
+PACKET_VIDEO = 2
+
+# Packet type, sequence number, robot timestamp in seconds and microseconds and payload size,
+# followed by the header of the packet type and the payload
+PACKET_HEADER = struct.Struct('!B I I I I')
+# Number of channels and samples per channel
+AUDIO_HEADER = struct.Struct('!I I')
+# Width, height and encoding
+VIDEO_HEADER = struct.Struct('!I I I')
+
+# Audio keeps a small buffer to bridge network stalls, video only the latest frame
+QUEUE_SIZES = {PACKET_AUDIO: 8, PACKET_VIDEO: 1}
+
+
+class PacketWriter(object):
+    ''' Packs the packets of one type with consecutive sequence numbers. '''
+
+    def __init__(self, packet_type):
+        self.packet_type = packet_type
+        self.sequence = 0
+
+    def pack(self, timestamp_seconds, timestamp_microseconds, type_header, payload):
+        header = PACKET_HEADER.pack(self.packet_type, self.sequence, timestamp_seconds, timestamp_microseconds, len(payload))
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        return header + type_header + payload
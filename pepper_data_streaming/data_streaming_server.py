@@ -1,43 +1,131 @@
+import collections
+import json
 import socket
+import struct
 import threading
-import Queue
 
-# This is a thread-safe queue where we'll put the data chunks received from the service
+# Every chunk is sent after the number of chunks dropped for the client so far
+DROPPED_HEADER = struct.Struct('!I')
+
+
+class ClientQueue(object):
+    '''
+    The bounded send queues of one client, one per channel. If the queue of a channel is full its oldest chunk is dropped,
+    so with a size of 1 the client always gets the latest chunk of that channel. Chunks are sent in the order they were put.
+    '''
+
+    def __init__(self, max_sizes):
+        '''
+        | Keyword arguments:
+        | max_sizes: dict - the maximum number of queued chunks by channel
+        '''
+        self.chunks = dict((channel, collections.deque(maxlen=max_size)) for channel, max_size in max_sizes.items())
+        self.condition = threading.Condition()
+        self.order = 0
+        self.dropped = 0
+        self.is_closed = False
+
+    def put(self, data, channel=0):
+        with self.condition:
+            chunks = self.chunks[channel]
+            if len(chunks) == chunks.maxlen:
+                self.dropped += 1
+            chunks.append((self.order, data))
+            self.order += 1
+            self.condition.notify()
+
+    def get(self, timeout=1.0):
+        ''' Wait for the next chunk. Returns None if the queue was closed or no chunk arrived within the timeout. '''
+        with self.condition:
+            if not self.has_chunks() and not self.is_closed:
+                self.condition.wait(timeout)
+            if self.is_closed or not self.has_chunks():
+                return None
+            # The oldest chunk of all channels
+            chunks = min([chunks for chunks in self.chunks.values() if chunks], key=lambda chunks: chunks[0][0])
+            return chunks.popleft()[1]
+
+    def has_chunks(self):
+        return any(self.chunks.values())
+
+    def close(self):
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify()
+
 
 class DataStreamingServer:
-    def __init__(self, port):
+    def __init__(self, port, queue_size=1, on_control=None):
+        '''
+        | Keyword arguments:
+        | port: int - the port to listen on
+        | queue_size: int or dict - the maximum number of chunks queued per client, older chunks are dropped, or a dict
+        |   of the maximum by channel to multiplex several streams. 1 always sends the latest chunk, e.g. for video.
+        |   Audio should use a small buffer.
+        | on_control: function(client_id, request) - called with the JSON control requests clients send as lines,
+        |   and with None as request when a client disconnects
+        '''
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.host = '0.0.0.0'  # Listen on all network interfaces
         self.port = port
+        self.queue_sizes = queue_size if isinstance(queue_size, dict) else {0: queue_size}
+        self.on_control = on_control
         self.is_listening = False
         self.is_connected = False
-        self.reset_queue()
 
-    def reset_queue(self):
-        self.data_queue = Queue.Queue()
-        
-        
+        self.clients_lock = threading.Lock()
+        self.client_queues = []
+
     def handle_client_connection(self, client_socket):
         print("Server: New client connected with address " + str(client_socket.getpeername()))
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_queue = ClientQueue(self.queue_sizes)
+        with self.clients_lock:
+            self.client_queues.append(client_queue)
+            self.is_connected = True
+        if self.on_control is not None:
+            control_thread = threading.Thread(target=self.handle_client_control, args=(client_socket, client_queue))
+            control_thread.daemon = True
+            control_thread.start()
         try:
-            while self.is_listening:
-                # Wait for data to be available in the queue and send it to the client
-                self.is_connected = True
-                data_chunk = self.data_queue.get()
+            while self.is_listening and not client_queue.is_closed:
+                # Wait for data to be available in the queue of this client and send it
+                data_chunk = client_queue.get()
                 if data_chunk is None:
-                    break  # Use None as a signal to close the connection
+                    continue
+                client_socket.sendall(DROPPED_HEADER.pack(client_queue.dropped))
                 client_socket.sendall(data_chunk)
         except socket.error as e:
             print("Server: Client connection error: " + str(e))
         finally:
+            client_queue.close()
             client_socket.close()
-            self.is_connected = False
-            self.reset_queue()
-            print("Server: Client connection closed")
+            with self.clients_lock:
+                self.client_queues.remove(client_queue)
+                self.is_connected = len(self.client_queues) > 0
+            if self.on_control is not None:
+                self.on_control(id(client_queue), None)
+            print("Server: Client connection closed, " + str(client_queue.dropped) + " chunks dropped")
+
+    def handle_client_control(self, client_socket, client_queue):
+        try:
+            for line in client_socket.makefile('r'):
+                if client_queue.is_closed:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    print("Server: Invalid control request " + line.strip())
+                    continue
+                self.on_control(id(client_queue), request)
+        except socket.error:
+            pass
+        # The client closed the connection
+        client_queue.close()
 
     def listen(self):
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(1)
+        self.server_socket.listen(5)
         self.server_socket.settimeout(1)
         self.is_listening = True
 
@@ -47,7 +135,9 @@ class DataStreamingServer:
             while self.is_listening:
                 try:
                     client_socket, _ = self.server_socket.accept()
+                    client_socket.settimeout(None)
                     client_thread = threading.Thread(target=self.handle_client_connection, args=(client_socket,))
+                    client_thread.daemon = True
                     client_thread.start()
                 except socket.timeout:
                     continue
@@ -56,7 +146,6 @@ class DataStreamingServer:
                     break
         finally:
             self.is_listening = False
-            self.data_queue = Queue.Queue()
             self.server_socket.close()
             print("Server: Stopped listening")
 
@@ -67,13 +156,19 @@ class DataStreamingServer:
 
     def close(self):
         print("Server: Stopping...")
-        self.data_queue.put(None)
         self.is_listening = False
+        with self.clients_lock:
+            for client_queue in self.client_queues:
+                client_queue.close()
+
+    def stream(self, data, channel=0):
+        ''' Queue a chunk of a channel for every connected client. Returns whether any client is connected. '''
+        with self.clients_lock:
+            for client_queue in self.client_queues:
+                client_queue.put(data, channel)
+            return len(self.client_queues) > 0
 
-    # Example function that simulates receiving data from another service and putting it into the queue
-    def stream(self, data):
-        if self.is_connected:
-            self.data_queue.put(data)  # Signal to close the client connection
-            return True
-        else:
-            return False
\ No newline at end of file
+    def dropped_chunks(self):
+        ''' The number of chunks dropped for each connected client. '''
+        with self.clients_lock:
+            return [client_queue.dropped for client_queue in self.client_queues]
@@ -0,0 +1,59 @@
+import io
+
+# Optional encoders, the robot uses whatever is installed
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+ENCODING_RAW = 0
+ENCODING_JPEG = 1
+
+ENCODINGS = {"raw": ENCODING_RAW, "jpeg": ENCODING_JPEG}
+
+
+class FrameEncoder(object):
+    '''
+    Encodes BGR frames for the video stream. JPEG is encoded with OpenCV or PIL, whichever is available.
+    Without either the frames are sent raw.
+    '''
+
+    def __init__(self, encoding="jpeg", quality=80):
+        '''
+        | Keyword arguments:
+        | encoding: str - "jpeg" or "raw"
+        | quality: int - the JPEG quality from 0 to 100
+        '''
+        self.quality = quality
+        self.encoding = ENCODINGS[encoding]
+        if self.encoding == ENCODING_JPEG and cv2 is None and Image is None:
+            print("FrameEncoder: Neither OpenCV nor PIL is available, sending raw frames")
+            self.encoding = ENCODING_RAW
+
+    def encode(self, buffer, width, height):
+        '''
+        Encode a BGR frame.
+
+        | Keyword arguments:
+        | buffer: bytearray - the BGR frame
+        | width: int - the width of the frame
+        | height: int - the height of the frame
+
+        Returns the encoding of the data and the data.
+        '''
+        if self.encoding == ENCODING_RAW:
+            return ENCODING_RAW, buffer
+
+        if cv2 is not None:
+            image = np.frombuffer(buffer, dtype=np.uint8).reshape((height, width, 3))
+            _, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            return ENCODING_JPEG, data.tobytes()
+
+        output = io.BytesIO()
+        Image.frombuffer("RGB", (width, height), bytes(buffer), "raw", "BGR", 0, 1).save(output, format="JPEG", quality=self.quality)
+        return ENCODING_JPEG, output.getvalue()
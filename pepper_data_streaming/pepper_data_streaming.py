@@ -3,6 +3,8 @@ import threading
 import time
 
 from audio_transmission import AudioTransmissionModule
+from av_packet import AV_PORT, QUEUE_SIZES
+from data_streaming_server import DataStreamingServer
 from video_transmission import VideoTransmissionModule
 
 
@@ -15,16 +17,34 @@ if __name__ == "__main__":
         help="Parent broker port. The port NAOqi is listening to",
         dest="port",
         type="int")
+    parser.add_option("--encoding",
+        help="The video encoding, jpeg or raw",
+        dest="encoding",
+        choices=["jpeg", "raw"])
+    parser.add_option("--quality",
+        help="The JPEG quality from 0 to 100",
+        dest="quality",
+        type="int")
+    parser.add_option("--fps",
+        help="The frame rate while no client requested another",
+        dest="fps",
+        type="int")
     parser.set_defaults(
         ip="127.0.0.1",
-        port=9559)
+        port=9559,
+        encoding="jpeg",
+        quality=80,
+        fps=20)
 
     (opts, args_) = parser.parse_args()
     pepper_ip   = opts.ip
     pepper_port = opts.port
 
-    audioTransmissionModule = AudioTransmissionModule.setup(pepper_ip, pepper_port)
-    videoTransmissionModule = VideoTransmissionModule.setup(pepper_ip, pepper_port)
+    # Audio and video share one multiplexed connection per client
+    streaming_server = DataStreamingServer(AV_PORT, queue_size=QUEUE_SIZES)
+    audioTransmissionModule = AudioTransmissionModule.setup(pepper_ip, pepper_port, streaming_server)
+    videoTransmissionModule = VideoTransmissionModule.setup(pepper_ip, pepper_port, opts.encoding, opts.quality, opts.fps, streaming_server)
+    streaming_server.listenAsync()
 
     audio_thread = threading.Thread(target=audioTransmissionModule.start)
     video_thread = threading.Thread(target=videoTransmissionModule.start)
@@ -39,4 +59,5 @@ if __name__ == "__main__":
         print("Shutting down...")
         audioTransmissionModule.stop()
         videoTransmissionModule.stop()
+        streaming_server.close()
         exit(0)
\ No newline at end of file
@@ -1,16 +1,47 @@
 from optparse import OptionParser
-import struct
+from av_packet import AV_PORT, PACKET_VIDEO, QUEUE_SIZES, VIDEO_HEADER, PacketWriter
 from data_streaming_server import DataStreamingServer
+from frame_encoding import FrameEncoder
 import qi
 import argparse
+import math
 import sys
+import threading
 import time
 import vision_definitions
 
+RESOLUTIONS = {"qvga": vision_definitions.kQVGA, "vga": vision_definitions.kVGA}
+# The frame rates the camera supports
+MIN_FPS = 1
+MAX_FPS = 30
+
 class VideoTransmissionModule(object):
-    def __init__(self, session):
+    def __init__(self, session, encoding="jpeg", quality=80, fps=20, streaming_server=None, stream_port=AV_PORT):
+        '''
+        | Keyword arguments:
+        | session: qi.Session - the connected NAOqi session
+        | encoding: str - "jpeg" or "raw"
+        | quality: int - the JPEG quality from 0 to 100
+        | fps: int - the frame rate while no client requested another
+        | streaming_server: DataStreamingServer - the multiplexed audio and video stream, if shared with the audio module.
+        |   By default the module listens on its own.
+        | stream_port: int - the port the module listens on without a shared streaming server
+        '''
         self.session = session
-        self.streaming_server = DataStreamingServer(40098)
+        self.encoder = FrameEncoder(encoding, quality)
+        self.packet_writer = PacketWriter(PACKET_VIDEO)
+        # Clients control the capture with requests
+        self.owns_server = streaming_server is None
+        self.streaming_server = streaming_server if streaming_server is not None else DataStreamingServer(stream_port, queue_size=QUEUE_SIZES)
+        self.streaming_server.on_control = self.on_control
+
+        # The capture settings, combined from the requests of all clients
+        self.default_fps = fps
+        self.fps = fps
+        self.resolution = "qvga"
+        self.is_paused = False
+        self.requests = {}
+        self.requests_lock = threading.Lock()
 
         self.video_service = session.service("ALVideoDevice")
 
@@ -20,37 +51,97 @@ class VideoTransmissionModule(object):
             vision_definitions.kTopCamera,
             vision_definitions.kQVGA,
             vision_definitions.kBGRColorSpace,
-            20
+            fps
         )
-        self.streaming_server.listenAsync()
+        self.camera_fps = fps
+        self.camera_resolution = "qvga"
+        if self.owns_server:
+            self.streaming_server.listenAsync()
         self.is_running = False
 
+    def on_control(self, client_id, request):
+        '''
+        Handle a capture request of a client, with the optional keys fps, resolution ("qvga" or "vga") and paused.
+        The highest requested rate and resolution are used, the capture only pauses if all clients requested it.
+        '''
+        if request is not None and not isinstance(request, dict):
+            print("Video: Ignoring control request " + str(request))
+            return
+        with self.requests_lock:
+            if request is None:
+                self.requests.pop(client_id, None)
+            else:
+                self.requests.setdefault(client_id, {}).update(request)
+
+            requests = list(self.requests.values())
+            fps = max([self.requested_fps(r) for r in requests] or [self.default_fps])
+            self.fps = max(MIN_FPS, min(MAX_FPS, fps))
+            self.resolution = "vga" if any(r.get("resolution") == "vga" for r in requests) else "qvga"
+            self.is_paused = len(requests) > 0 and all(r.get("paused", False) for r in requests)
+
+    def requested_fps(self, request):
+        '''
+        The frame rate of a request, the default frame rate if it requested none or no positive finite number.
+        '''
+        try:
+            fps = float(request.get("fps", self.default_fps))
+        except (TypeError, ValueError):
+            return self.default_fps
+        if math.isnan(fps) or math.isinf(fps) or fps <= 0:
+            return self.default_fps
+        return fps
+
+    def apply_camera_settings(self):
+        if self.resolution != self.camera_resolution:
+            self.video_service.setResolution(self.nameId, RESOLUTIONS[self.resolution])
+            self.camera_resolution = self.resolution
+            print("Video resolution: " + self.resolution)
+        camera_fps = int(round(self.fps))
+        if camera_fps != self.camera_fps:
+            self.video_service.setFrameRate(self.nameId, camera_fps)
+            self.camera_fps = camera_fps
+
     def start(self):
         print("Streaming video...")
         self.is_running = True
-        
+        next_deadline = time.time()
+
         while self.is_running:
+            if self.is_paused or not self.streaming_server.is_connected:
+                time.sleep(0.05)
+                next_deadline = time.time()
+                continue
+
+            self.apply_camera_settings()
             image = self.video_service.getImageRemote(self.nameId)
-            image_width = image[0]
-            image_height = image[1]
-            buffer = image[6]
-            buffer_size = len(buffer)
+            if image is not None:
+                image_width = image[0]
+                image_height = image[1]
+                encoding, buffer = self.encoder.encode(image[6], image_width, image_height)
+
+                # image[4] and image[5] are the capture time in seconds and microseconds of the robot clock
+                video_header = VIDEO_HEADER.pack(image_width, image_height, encoding)
+                self.streaming_server.stream(self.packet_writer.pack(image[4], image[5], video_header, buffer), PACKET_VIDEO)
 
-            # Include buffer_size in the header
-            header_format = '!I I I'  # Adding an extra 'I' for buffer_size
-            header_data = struct.pack(header_format, image_width, image_height, buffer_size)
-            self.streaming_server.stream(header_data + buffer)
-            time.sleep(0.05)
+            # Pace by frame deadlines, so the capture and encoding time is part of the frame period
+            next_deadline += 1.0 / self.fps
+            delay = next_deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -1.0 / self.fps:
+                # Behind by more than a frame, do not try to catch up with a burst
+                next_deadline = time.time()
 
         self.video_service.unsubscribe(self.nameId)
-        self.streaming_server.close()
+        if self.owns_server:
+            self.streaming_server.close()
         print("Video stream stopped")
     
     def stop(self):
         self.is_running = False
 
     @staticmethod
-    def setup(ip, port):
+    def setup(ip, port, encoding="jpeg", quality=80, fps=20, streaming_server=None, stream_port=AV_PORT):
         session = qi.Session()
         try:
             session.connect("tcp://" + ip + ":" + str(port))
@@ -58,7 +149,7 @@ class VideoTransmissionModule(object):
             print ("Can't connect to Naoqi at ip \"" + ip + "\" on port " + str(port) +".\n"
                     "Please check your script arguments. Run with -h option for help.")
             sys.exit(1)
-        module = VideoTransmissionModule(session)
+        module = VideoTransmissionModule(session, encoding, quality, fps, streaming_server, stream_port)
         print("VideoTransmissionModule instance created")
         return module
 
@@ -73,13 +164,33 @@ if __name__ == "__main__":
         help="Parent broker port. The port NAOqi is listening to",
         dest="port",
         type="int")
+    parser.add_option("--encoding",
+        help="The video encoding, jpeg or raw",
+        dest="encoding",
+        choices=["jpeg", "raw"])
+    parser.add_option("--quality",
+        help="The JPEG quality from 0 to 100",
+        dest="quality",
+        type="int")
+    parser.add_option("--fps",
+        help="The frame rate while no client requested another",
+        dest="fps",
+        type="int")
+    parser.add_option("--stream-port",
+        help="The port the video is streamed on. Differs from the audio port if both run standalone, pepper_data_streaming.py streams both on one port",
+        dest="stream_port",
+        type="int")
     parser.set_defaults(
         ip="pepper.local",
-        port=9559)
+        port=9559,
+        encoding="jpeg",
+        quality=80,
+        fps=20,
+        stream_port=AV_PORT)
 
     (opts, args_) = parser.parse_args()
     pepper_ip   = opts.ip
     pepper_port = opts.port
 
-    videoTransmissionModule = VideoTransmissionModule.setup(pepper_ip, pepper_port)
+    videoTransmissionModule = VideoTransmissionModule.setup(pepper_ip, pepper_port, opts.encoding, opts.quality, opts.fps, stream_port=opts.stream_port)
     videoTransmissionModule.start()